@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''
+Measures the sustained command rate on one chain with the old fixed
+50 ms write spacing and with the adaptive per-port throttle.
+
+Fire-and-forget commands are echo requests (command 55), which do not
+move anything. Queries are get_position calls.
+
+Usage:
+python benchmarks/command_rate.py port [count]
+'''
+import sys
+import time
+
+from zaber_device import ZaberDevice
+
+
+POLICIES = [
+    ('fixed 50 ms', 0.05),
+    ('adaptive', None),
+]
+
+def command_rate(dev,count):
+    t_start = time.perf_counter()
+    for n in range(count):
+        dev._send_request(55,None,n)
+    return count/(time.perf_counter() - t_start)
+
+def query_rate(dev,count):
+    t_start = time.perf_counter()
+    for n in range(count):
+        dev.get_position()
+    return count/(time.perf_counter() - t_start)
+
+if __name__ == '__main__':
+    port = sys.argv[1]
+    count = 100
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    dev = ZaberDevice(port=port)
+    dev.set_actuator_count(dev.find_actuator_count())
+    print('port {0} at {1} baud, {2} actuators'.format(port,dev.get_baudrate(),dev.get_actuator_count()))
+    for name,delay in POLICIES:
+        dev.set_write_delay(delay)
+        dev.get_position()
+        dev.reset_write_metrics()
+        commands = command_rate(dev,count)
+        queries = query_rate(dev,count)
+        metrics = dev.get_write_metrics()
+        print('{0:<12} commands {1:8.1f}/s  queries {2:8.1f}/s  throttle waits {3} ({4:.3f} s)'.format(name,commands,queries,metrics['waits'],metrics['wait_time']))
+    dev.set_write_delay(None)
+    dev.set_rate_limit(100,burst=10)
+    dev.reset_write_metrics()
+    print('{0:<12} commands {1:8.1f}/s'.format('100/s bucket',command_rate(dev,count)))
+    dev.close()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''
+Hammers one simulated chain from many threads mixing get_position and
+moving queries with fire-and-forget move_relative commands, then checks
+that no call failed, that every move completed exactly once and that
+the final positions equal the sum of the relative moves sent.
+
+Usage:
+python benchmarks/concurrency_stress.py [threads] [iterations] [baudrate]
+'''
+import random
+import sys
+import threading
+import time
+
+from zaber_device import ZaberDevice, ZaberSimulator
+
+
+ACTUATOR_COUNT = 3
+START_POSITION = 100000
+TARGET_SPEED = 20000
+
+def worker(dev,seed,iterations,deltas,moves,errors):
+    rng = random.Random(seed)
+    for n in range(iterations):
+        try:
+            choice = rng.random()
+            if choice < 0.3:
+                actuator = rng.randrange(ACTUATOR_COUNT)
+                delta = rng.randrange(-500,501)
+                dev.move_relative(delta,actuator)
+                deltas[actuator] += delta
+                moves.append(actuator)
+            elif choice < 0.8:
+                positions = dev.get_position()
+                if len(positions) != ACTUATOR_COUNT:
+                    raise AssertionError('got {0} positions'.format(len(positions)))
+            else:
+                dev.moving()
+        except Exception as e:
+            errors.append(e)
+
+if __name__ == '__main__':
+    thread_count = 8
+    iterations = 100
+    baudrate = 115200
+    if len(sys.argv) > 1:
+        thread_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        baudrate = int(sys.argv[3])
+    simulator = ZaberSimulator(actuator_count=ACTUATOR_COUNT,baudrate=baudrate)
+    dev = ZaberDevice(serial_interface=simulator)
+    dev.set_actuator_count(ACTUATOR_COUNT)
+    dev.set_target_speed(TARGET_SPEED)
+    dev.move_absolute(START_POSITION)
+    dev.wait_until_idle()
+    completions = []
+    dev.set_reply_handler(lambda actuator,command,data: completions.append((actuator,command)) if command == 21 else None)
+    errors = []
+    moves = []
+    deltas = [[0]*ACTUATOR_COUNT for thread in range(thread_count)]
+    threads = [threading.Thread(target=worker,args=(dev,seed,iterations,deltas[seed],moves,errors))
+               for seed in range(thread_count)]
+    t_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - t_start
+    dev.wait_until_idle()
+    dev.get_position()
+    time.sleep(0.1)
+    dev.poll_replies()
+    dev.set_reply_handler(None)
+    expected = [START_POSITION + sum(deltas[thread][actuator] for thread in range(thread_count))
+                for actuator in range(ACTUATOR_COUNT)]
+    positions = dev.get_position()
+    calls = thread_count*iterations
+    print('{0} threads, {1} calls in {2:.3f} s ({3:.1f} calls/s) at {4} baud'.format(thread_count,calls,duration,calls/duration,baudrate))
+    print('errors: {0}'.format(len(errors)))
+    for e in errors[:5]:
+        print('  {0!r}'.format(e))
+    print('moves sent {0}, completion replies {1}'.format(len(moves),len(completions)))
+    print('positions {0} expected {1}: {2}'.format(positions,expected,'ok' if positions == expected else 'MISMATCH'))
+    dev.close()
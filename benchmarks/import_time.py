@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''
+Measures how long a fresh interpreter takes to import zaber_device.
+
+Usage:
+python benchmarks/import_time.py [runs]
+'''
+import subprocess
+import sys
+import time
+
+
+STATEMENTS = [
+    ('python startup', 'pass'),
+    ('import zaber_device', 'import zaber_device'),
+    ('zaber_device.__version__', 'import zaber_device; zaber_device.__version__'),
+    ('serial stack', 'import zaber_device.zaber_device as z; z._import_serial_stack()'),
+]
+
+def time_statement(statement,runs):
+    durations = []
+    for run in range(runs):
+        t_start = time.perf_counter()
+        subprocess.check_call([sys.executable,'-c',statement])
+        durations.append(time.perf_counter() - t_start)
+    durations.sort()
+    return durations[len(durations)//2]
+
+def imported_modules(statement):
+    output = subprocess.check_output([sys.executable,'-c',statement + '; import sys; print(sorted(sys.modules))'])
+    return output.decode()
+
+if __name__ == '__main__':
+    runs = 11
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    baseline = None
+    for name,statement in STATEMENTS:
+        duration = time_statement(statement,runs)
+        if baseline is None:
+            baseline = duration
+        print('{0:<28} {1:8.1f} ms  (+{2:.1f} ms over startup)'.format(name,duration*1000,(duration-baseline)*1000))
+    modules = imported_modules('import zaber_device')
+    for module in ['serial','serial_interface','platform','pkg_resources']:
+        print('{0} imported by import zaber_device: {1}'.format(module,"'{0}'".format(module) in modules))
@@ -28,4 +28,11 @@ setup(
     packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
     install_requires=['serial_interface',
     ],
+    entry_points={
+        'console_scripts': [
+            'zaber_device_server=zaber_device.server:main',
+            'zaber_device_batch=zaber_device.cli:main',
+            'zaber_device_replay=zaber_device.replay:main',
+        ],
+    },
 )
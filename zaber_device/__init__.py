@@ -4,4 +4,42 @@ ZaberDevice, ZaberDevices, and ZaberStage, which contain an instance
 of serial_interface.SerialInterface and adds methods to it to interface to
 Zaber motorized linear slides.
 '''
-from .zaber_device import ZaberDevice, ZaberDevices, ZaberStage, ZaberError, find_zaber_device_ports, find_zaber_device_port, __version__
+from .zaber_device import ZaberDevice, ZaberDevices, ZaberStage, ZaberError, ZaberConnectionError, find_zaber_device_ports, find_zaber_device_port, find_zaber_device_port_baudrate
+
+
+# optional subsystems are imported on first access to keep package import fast
+_LAZY_ATTRIBUTES = {
+    'ZaberPositionPublisher': 'position_publisher',
+    'ZaberPositionReader': 'position_publisher',
+    'ZaberStageServer': 'server',
+    'ZaberStageClient': 'server',
+    'ZaberPositionRecorder': 'position_recorder',
+    'load_position_log': 'position_recorder',
+    'ZaberPathPlanner': 'path_planner',
+    'ZaberTopology': 'topology',
+    'apply_profile': 'profile',
+    'load_profile': 'profile',
+    'ZaberSimulator': 'simulator',
+    'ZaberPositionTracker': 'tracking',
+    'ZaberJogController': 'jog',
+    'ZaberSyncDispatcher': 'sync',
+    'home_devices': 'homing',
+    'ZaberCalibration': 'calibration',
+    'load_calibration': 'calibration',
+    'ZaberServo': 'servo',
+    'ZaberReaderFeedback': 'servo',
+    'ZaberFlightRecorder': 'flight_recorder',
+    'load_flight_record': 'flight_recorder',
+    'replay_flight_record': 'replay',
+}
+
+def __getattr__(name):
+    # __version__ is looked up lazily since reading distribution metadata is slow
+    if name == '__version__':
+        from .zaber_device import __version__
+        return __version__
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name],__name__)
+        return getattr(module,name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__,name))
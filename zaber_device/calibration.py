@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+'''
+Maps microsteps to stage units through a measured calibration table
+instead of a single microstep size, for lead-screw error correction.
+'''
+import bisect
+import os
+import threading
+
+from .zaber_device import ZaberError
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+def _is_scalar(values):
+    try:
+        len(values)
+    except TypeError:
+        return True
+    return False
+
+def scale(values,factor):
+    '''
+    Returns values, a number or a sequence of numbers, multiplied by
+    factor, as a float or as a NumPy array when NumPy is available.
+    '''
+    if _is_scalar(values):
+        return float(values)*factor
+    numpy = _import_numpy()
+    if numpy is not None:
+        return numpy.asarray(values,dtype=float)*factor
+    return [float(value)*factor for value in values]
+
+
+class ZaberCalibration(object):
+    '''
+    ZaberCalibration holds a table of microstep positions and the
+    physical positions in stage units measured at them. to_positions
+    and to_microsteps interpolate linearly between table points and
+    extrapolate the end segments beyond the table, converting whole
+    arrays at once with NumPy when it is available. The physical
+    positions must be strictly increasing or strictly decreasing so the
+    mapping can be inverted.
+
+    Example Usage:
+
+    calibration = ZaberCalibration([0,100000,200000],[0.0,49.62,99.19])
+    calibration.to_positions(150000)
+    74.405
+    calibration.to_microsteps(numpy.linspace(0,99,100000))
+    array([0.00000000e+00, 1.99694...
+    calibration.save('x_calibration.npz')
+    calibration = load_calibration('x_calibration.npz')
+    '''
+    def __init__(self,microsteps,positions):
+        table = sorted(zip([float(microstep) for microstep in microsteps],
+                           [float(position) for position in positions]))
+        if len(table) < 2:
+            raise ZaberError('a calibration table needs at least two points')
+        self._microsteps = [microstep for microstep,position in table]
+        self._positions = [position for microstep,position in table]
+        for index in range(1,len(table)):
+            if self._microsteps[index] == self._microsteps[index-1]:
+                raise ZaberError('calibration microsteps must be unique')
+        steps = [b - a for a,b in zip(self._positions[:-1],self._positions[1:])]
+        if all(step > 0 for step in steps):
+            self._increasing = True
+        elif all(step < 0 for step in steps):
+            self._increasing = False
+        else:
+            raise ZaberError('calibration positions must be strictly monotonic')
+        self._numpy = _import_numpy()
+        if self._numpy is not None:
+            self._microsteps_array = self._numpy.array(self._microsteps)
+            self._positions_array = self._numpy.array(self._positions)
+            # numpy.interp needs increasing sample points
+            if self._increasing:
+                self._inverse_arrays = (self._positions_array,self._microsteps_array)
+            else:
+                self._inverse_arrays = (self._positions_array[::-1],self._microsteps_array[::-1])
+
+    def get_table(self):
+        '''
+        Returns the table as lists of microsteps and positions.
+        '''
+        return list(self._microsteps),list(self._positions)
+
+    def get_scale(self):
+        '''
+        Returns the mean stage units per microstep over the table, used
+        where a single factor is needed, such as converting speeds.
+        '''
+        return (self._positions[-1] - self._positions[0])/(self._microsteps[-1] - self._microsteps[0])
+
+    def _interp_array(self,values,xp,fp):
+        numpy = self._numpy
+        result = numpy.interp(values,xp,fp)
+        below = values < xp[0]
+        if below.any():
+            slope = (fp[1] - fp[0])/(xp[1] - xp[0])
+            result[below] = fp[0] + (values[below] - xp[0])*slope
+        above = values > xp[-1]
+        if above.any():
+            slope = (fp[-1] - fp[-2])/(xp[-1] - xp[-2])
+            result[above] = fp[-1] + (values[above] - xp[-1])*slope
+        return result
+
+    def _interp_value(self,value,xp,fp):
+        index = bisect.bisect_right(xp,value)
+        index = min(max(index,1),len(xp) - 1)
+        x0 = xp[index-1]
+        x1 = xp[index]
+        return fp[index-1] + (value - x0)*(fp[index] - fp[index-1])/(x1 - x0)
+
+    def _convert(self,values,xp,fp,arrays):
+        if _is_scalar(values):
+            return self._interp_value(float(values),xp,fp)
+        if self._numpy is None:
+            return [self._interp_value(float(value),xp,fp) for value in values]
+        values = self._numpy.asarray(values,dtype=float)
+        return self._interp_array(values,arrays[0],arrays[1])
+
+    def to_positions(self,microsteps):
+        '''
+        Returns the positions in stage units at microsteps, a number or a
+        sequence of numbers.
+        '''
+        arrays = None
+        if self._numpy is not None:
+            arrays = (self._microsteps_array,self._positions_array)
+        return self._convert(microsteps,self._microsteps,self._positions,arrays)
+
+    def to_microsteps(self,positions):
+        '''
+        Returns the microsteps at positions in stage units, a number or a
+        sequence of numbers.
+        '''
+        if self._increasing:
+            xp,fp = self._positions,self._microsteps
+        else:
+            xp,fp = self._positions[::-1],self._microsteps[::-1]
+        arrays = None
+        if self._numpy is not None:
+            arrays = self._inverse_arrays
+        return self._convert(positions,xp,fp,arrays)
+
+    def save(self,path):
+        '''
+        Writes the table to path, as a compressed NumPy .npz file when
+        path ends in .npz and as two comma separated columns otherwise.
+        '''
+        if path.endswith('.npz'):
+            numpy = _import_numpy()
+            if numpy is None:
+                raise ZaberError('saving .npz calibration files requires numpy')
+            numpy.savez_compressed(path,microsteps=numpy.array(self._microsteps),positions=numpy.array(self._positions))
+            return
+        with open(path,'w') as f:
+            f.write('# microsteps,position\n')
+            for microstep,position in zip(self._microsteps,self._positions):
+                f.write('{0!r},{1!r}\n'.format(microstep,position))
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _read_calibration(path):
+    if path.endswith('.npz'):
+        numpy = _import_numpy()
+        if numpy is None:
+            raise ZaberError('loading .npz calibration files requires numpy')
+        with numpy.load(path) as data:
+            return ZaberCalibration(data['microsteps'],data['positions'])
+    microsteps = []
+    positions = []
+    with open(path,'r') as f:
+        for line_number,line in enumerate(f,1):
+            text = line.split('#',1)[0].strip()
+            if not text:
+                continue
+            fields = text.replace(',',' ').split()
+            try:
+                microstep,position = [float(field) for field in fields]
+            except ValueError:
+                raise ZaberError('{0} line {1}: expected microsteps and position'.format(path,line_number))
+            microsteps.append(microstep)
+            positions.append(position)
+    return ZaberCalibration(microsteps,positions)
+
+def load_calibration(path):
+    '''
+    Returns the ZaberCalibration stored at path, a .npz file with
+    microsteps and positions arrays or a text file with one microsteps,
+    position pair per line. Tables are cached in memory and only read
+    again when the file changes.
+    '''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime,stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if (cached is not None) and (cached[0] == key):
+            return cached[1]
+    calibration = _read_calibration(path)
+    with _cache_lock:
+        _cache[path] = (key,calibration)
+    return calibration
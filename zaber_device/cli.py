@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''
+Runs a script of ZaberDevice or ZaberStage commands from a file or stdin
+and prints the latency of every command and the total wall time.
+
+Script lines hold a method name followed by its arguments, which are
+parsed as JSON when possible and as strings otherwise:
+
+    # comment
+    set_target_speed 20000
+    move_absolute 10000 0
+    wait
+    get_position
+    repeat 10
+        move_relative 100
+        wait 0 1
+        get_position
+    end
+    sleep 0.5
+
+wait calls wait_until_idle with the given actuators, or axes for a
+stage. Commands that need no reply, such as moves, are written back to
+back without waiting for the chain, queries wait for their replies.
+'''
+import argparse
+import json
+import shlex
+import sys
+import time
+
+from .zaber_device import ZaberDevice, ZaberStage, ZaberError
+
+
+LOOP_START = 'repeat'
+LOOP_END = 'end'
+RESULT_WIDTH = 40
+# aliases of the simulated actuators with --stage, in chain order
+SIMULATED_ALIAS_START = 10
+
+
+def _parse_argument(token):
+    try:
+        return json.loads(token)
+    except ValueError:
+        return token
+
+def parse_script(lines):
+    '''
+    Returns the script as a list of ('call',line number,text,name,args)
+    and ('repeat',line number,count,body) entries.
+    '''
+    root = []
+    stack = [root]
+    loops = []
+    for line_number,line in enumerate(lines,1):
+        text = line.split('#',1)[0].strip()
+        if not text:
+            continue
+        tokens = shlex.split(text)
+        name = tokens[0]
+        args = [_parse_argument(token) for token in tokens[1:]]
+        if name == LOOP_START:
+            if len(args) != 1:
+                raise ZaberError('line {0}: repeat takes one count'.format(line_number))
+            body = []
+            stack[-1].append(('repeat',line_number,int(args[0]),body))
+            stack.append(body)
+            loops.append(line_number)
+        elif name == LOOP_END:
+            if len(stack) == 1:
+                raise ZaberError('line {0}: end without repeat'.format(line_number))
+            stack.pop()
+            loops.pop()
+        else:
+            if name.startswith('_'):
+                raise ZaberError('line {0}: {1} is not a public method'.format(line_number,name))
+            stack[-1].append(('call',line_number,text,name,args))
+    if loops:
+        raise ZaberError('line {0}: repeat without end'.format(loops[-1]))
+    return root
+
+
+class ZaberScriptRunner(object):
+    '''
+    ZaberScriptRunner executes a parsed script against a ZaberDevice or
+    ZaberStage and records the latency of every command.
+
+    Example Usage:
+
+    runner = ZaberScriptRunner(dev)
+    runner.run(parse_script(open('script.txt')))
+    runner.get_summary()
+    {'move_absolute': {'count': 1, 'mean': 0.0011, 'max': 0.0011}, ...}
+    '''
+    def __init__(self,target,output=None):
+        self._target = target
+        self._output = output
+        self._records = []
+        self._wall_time = None
+
+    def _call(self,name,args):
+        if name == 'wait':
+            if isinstance(self._target,ZaberStage):
+                return self._target.wait_until_idle(axes=(args or None))
+            if args:
+                return self._target.wait_until_idle(args)
+            return self._target.wait_until_idle()
+        if name == 'sleep':
+            time.sleep(float(args[0]))
+            return None
+        try:
+            method = getattr(self._target,name)
+        except AttributeError:
+            raise ZaberError('unknown command {0}'.format(name))
+        return method(*args)
+
+    def _run(self,entries):
+        for entry in entries:
+            if entry[0] == 'repeat':
+                line_number,count,body = entry[1:]
+                for iteration in range(count):
+                    self._run(body)
+                continue
+            line_number,text,name,args = entry[1:]
+            t_start = time.perf_counter()
+            try:
+                result = self._call(name,args)
+            except ZaberError as e:
+                raise ZaberError('line {0}: {1}'.format(line_number,e.value))
+            except Exception as e:
+                raise ZaberError('line {0}: {1}: {2}'.format(line_number,type(e).__name__,e))
+            latency = time.perf_counter() - t_start
+            self._records.append((line_number,name,latency))
+            if self._output is not None:
+                result = '' if result is None else str(result)
+                if len(result) > RESULT_WIDTH:
+                    result = result[:RESULT_WIDTH-3] + '...'
+                self._output.write('{0:5d} {1:<32} {2:10.3f} ms  {3}\n'.format(line_number,text[:32],latency*1000,result))
+
+    def run(self,entries):
+        '''
+        Runs the script entries and returns the wall time in seconds. A
+        failing command raises ZaberError naming its script line, and the
+        commands run before it stay in the records.
+        '''
+        t_start = time.perf_counter()
+        try:
+            self._run(entries)
+        finally:
+            self._wall_time = time.perf_counter() - t_start
+        return self._wall_time
+
+    def get_wall_time(self):
+        '''
+        Returns the wall time in seconds of the last run, up to the
+        failing command if it did not finish.
+        '''
+        return self._wall_time
+
+    def get_records(self):
+        '''
+        Returns a list of (line number,command,latency) tuples.
+        '''
+        return list(self._records)
+
+    def get_summary(self):
+        '''
+        Returns a dictionary with command names as keys and the count,
+        mean and maximum latency in seconds as values.
+        '''
+        summary = {}
+        for line_number,name,latency in self._records:
+            stats = summary.setdefault(name,{'count': 0,'total': 0.0,'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += latency
+            stats['max'] = max(stats['max'],latency)
+        for name in summary:
+            stats = summary[name]
+            stats['mean'] = stats.pop('total')/stats['count']
+        return summary
+
+
+def _open_target(args):
+    kwargs = {'debug': args.debug}
+    if args.baudrate is not None:
+        kwargs['baudrate'] = args.baudrate
+    if args.simulate is not None:
+        from .simulator import ZaberSimulator
+        simulator_kwargs = {'actuator_count': args.simulate}
+        if args.stage:
+            # stage axes are set by alias
+            simulator_kwargs['aliases'] = list(range(SIMULATED_ALIAS_START,SIMULATED_ALIAS_START + args.simulate))
+        if args.baudrate is not None:
+            simulator_kwargs['baudrate'] = args.baudrate
+        kwargs['serial_interface'] = ZaberSimulator(**simulator_kwargs)
+        if args.stage:
+            kwargs['use_ports'] = ['simulator']
+    elif args.stage:
+        kwargs['use_ports'] = args.use_ports
+    elif args.use_ports is not None:
+        kwargs['port'] = args.use_ports[0]
+    if args.stage:
+        return ZaberStage(**kwargs)
+    dev = ZaberDevice(**kwargs)
+    dev.set_actuator_count(dev.find_actuator_count())
+    return dev
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a script of ZaberDevice or ZaberStage commands and report command latency.')
+    parser.add_argument('script',nargs='?',default='-',help='script file, stdin if omitted or -')
+    parser.add_argument('--use-ports',nargs='+',default=None,help='serial ports to use, found automatically if omitted')
+    parser.add_argument('--stage',action='store_true',help='run commands on a ZaberStage instead of a ZaberDevice')
+    parser.add_argument('--simulate',type=int,default=None,metavar='ACTUATOR_COUNT',
+                        help='run against a simulated chain with serial number 0, with --stage its actuators have aliases 10, 11, ...')
+    parser.add_argument('--baudrate',type=int,default=None)
+    parser.add_argument('--quiet',action='store_true',help='print only the summary')
+    parser.add_argument('--debug',action='store_true')
+    args = parser.parse_args(argv)
+    if args.script == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.script,'r') as f:
+            lines = f.readlines()
+    entries = parse_script(lines)
+    target = _open_target(args)
+    output = None if args.quiet else sys.stdout
+    runner = ZaberScriptRunner(target,output)
+    error = None
+    try:
+        runner.run(entries)
+    except ZaberError as e:
+        error = e
+    finally:
+        if isinstance(target,ZaberDevice):
+            target.close()
+    summary = runner.get_summary()
+    print('{0:<32} {1:>6} {2:>12} {3:>12}'.format('command','count','mean ms','max ms'))
+    for name in sorted(summary):
+        stats = summary[name]
+        print('{0:<32} {1:6d} {2:12.3f} {3:12.3f}'.format(name,stats['count'],stats['mean']*1000,stats['max']*1000))
+    print('{0} commands in {1:.3f} s wall time'.format(len(runner.get_records()),runner.get_wall_time()))
+    if error is not None:
+        # exits with status 1
+        sys.exit('error: {0}'.format(error.value))
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+'''
+Keeps the most recent request and reply frames of a port in a fixed-size
+ring buffer, cheap enough to leave on, and writes them to a compact
+binary file for offline replay.
+'''
+import struct
+import threading
+import time
+
+
+FLIGHT_RECORD_CAPACITY = 16384
+MAGIC = b'ZFR1'
+LAYOUT_VERSION = 1
+# magic, layout version, baudrate, serial number, actuator count, port length, record count
+HEADER_STRUCT = struct.Struct('<4sHIlHHI')
+# monotonic time, kind, then the 6 frame bytes
+RECORD_HEADER_STRUCT = struct.Struct('<dB')
+FRAME_LENGTH = 6
+RECORD_LENGTH = RECORD_HEADER_STRUCT.size + FRAME_LENGTH
+FRAME_STRUCT = struct.Struct('<BBl')
+EMPTY_FRAME = bytes(FRAME_LENGTH)
+UNKNOWN = -1
+
+KIND_COMMAND = 0
+KIND_QUERY = 1
+KIND_REPLY = 2
+KIND_CLEAR = 3
+KIND_NUMBERING_ERROR = 4
+KIND_SHORT_READ = 5
+KIND_NAMES = {KIND_COMMAND: 'command',
+              KIND_QUERY: 'query',
+              KIND_REPLY: 'reply',
+              KIND_CLEAR: 'clear',
+              KIND_NUMBERING_ERROR: 'numbering_error',
+              KIND_SHORT_READ: 'short_read'}
+
+
+class ZaberFlightRecorder(object):
+    '''
+    ZaberFlightRecorder stores one fixed-size record per frame written or
+    read on a port, with its monotonic time, plus events such as receive
+    buffer clears, numbering errors and reads that ended short. Once
+    capacity records are stored the oldest are overwritten. Every
+    ZaberDevice has one, see ZaberDevice.get_flight_recorder.
+
+    Records are (time,kind,device number,command,data) tuples, with kind
+    one of 'command' for requests sent without waiting, 'query' for
+    requests whose replies were read, 'reply', 'clear',
+    'numbering_error' and 'short_read'.
+
+    Example Usage:
+
+    recorder = dev.get_flight_recorder()
+    recorder.get_records()[-2:]
+    [(1042.1031, 'query', 0, 60, 0), (1042.1043, 'reply', 1, 60, 20000)]
+    dev.dump_flight_record('session.zfr')
+    '''
+    def __init__(self,capacity=FLIGHT_RECORD_CAPACITY):
+        self._capacity = int(capacity)
+        self._buffer = bytearray(RECORD_LENGTH*self._capacity)
+        self._lock = threading.Lock()
+        self._enabled = self._capacity > 0
+        self._count = 0
+
+    def set_enabled(self,enabled):
+        self._enabled = bool(enabled) and (self._capacity > 0)
+
+    def is_enabled(self):
+        return self._enabled
+
+    def get_capacity(self):
+        return self._capacity
+
+    def record(self,kind,frame=EMPTY_FRAME,t=None):
+        '''
+        Stores a record of kind with a 6 byte frame, at time t or now.
+        '''
+        if not self._enabled:
+            return
+        if t is None:
+            t = time.monotonic()
+        with self._lock:
+            offset = (self._count % self._capacity)*RECORD_LENGTH
+            RECORD_HEADER_STRUCT.pack_into(self._buffer,offset,t,kind)
+            self._buffer[offset+RECORD_HEADER_STRUCT.size:offset+RECORD_LENGTH] = frame
+            self._count += 1
+
+    def record_request(self,kind,request,t=None):
+        '''
+        Stores one record per frame of request, which may hold several.
+        '''
+        if not self._enabled:
+            return
+        if len(request) == FRAME_LENGTH:
+            self.record(kind,request,t)
+            return
+        for offset in range(0,len(request) - FRAME_LENGTH + 1,FRAME_LENGTH):
+            self.record(kind,request[offset:offset+FRAME_LENGTH],t)
+
+    def get_count(self):
+        '''
+        Returns the number of records stored since creation or clear,
+        including those overwritten.
+        '''
+        return self._count
+
+    def get_raw(self):
+        '''
+        Returns the stored records, oldest first, as bytes.
+        '''
+        with self._lock:
+            count = self._count
+            if count <= self._capacity:
+                return bytes(self._buffer[:count*RECORD_LENGTH])
+            split = (count % self._capacity)*RECORD_LENGTH
+            return bytes(self._buffer[split:]) + bytes(self._buffer[:split])
+
+    def get_records(self):
+        '''
+        Returns the stored records, oldest first, as (time,kind,device
+        number,command,data) tuples.
+        '''
+        return _decode_records(self.get_raw())
+
+    def clear(self):
+        with self._lock:
+            self._count = 0
+
+    def dump(self,path,baudrate=0,serial_number=None,actuator_count=None,port=''):
+        '''
+        Writes the stored records and the session details to path and
+        returns the number of records written.
+        '''
+        raw = self.get_raw()
+        port = (port or '').encode('utf-8')
+        if serial_number is None:
+            serial_number = UNKNOWN
+        if actuator_count is None:
+            actuator_count = 0
+        with open(path,'wb') as f:
+            f.write(HEADER_STRUCT.pack(MAGIC,LAYOUT_VERSION,int(baudrate),int(serial_number),
+                                       int(actuator_count),len(port),len(raw)//RECORD_LENGTH))
+            f.write(port)
+            f.write(raw)
+        return len(raw)//RECORD_LENGTH
+
+
+def _decode_records(raw):
+    records = []
+    header_size = RECORD_HEADER_STRUCT.size
+    for offset in range(0,len(raw),RECORD_LENGTH):
+        t,kind = RECORD_HEADER_STRUCT.unpack_from(raw,offset)
+        number,command,data = FRAME_STRUCT.unpack_from(raw,offset + header_size)
+        records.append((t,KIND_NAMES.get(kind,kind),number,command,data))
+    return records
+
+def load_flight_record(path):
+    '''
+    Reads a file written by ZaberFlightRecorder.dump and returns a
+    dictionary with the baudrate, serial_number, actuator_count and port
+    of the session and its records, oldest first.
+    '''
+    # imported here since zaber_device imports this module
+    from .zaber_device import ZaberError
+    with open(path,'rb') as f:
+        raw = f.read()
+    if len(raw) < HEADER_STRUCT.size:
+        raise ZaberError('{0} is not a Zaber flight record'.format(path))
+    magic,version,baudrate,serial_number,actuator_count,port_length,record_count = HEADER_STRUCT.unpack_from(raw,0)
+    if (magic != MAGIC) or (version != LAYOUT_VERSION):
+        raise ZaberError('{0} is not a Zaber flight record'.format(path))
+    offset = HEADER_STRUCT.size
+    port = raw[offset:offset+port_length].decode('utf-8')
+    offset += port_length
+    records = raw[offset:offset+record_count*RECORD_LENGTH]
+    if len(records) != record_count*RECORD_LENGTH:
+        raise ZaberError('{0} is truncated'.format(path))
+    return {'baudrate': baudrate,
+            'serial_number': None if serial_number == UNKNOWN else serial_number,
+            'actuator_count': actuator_count or None,
+            'port': port,
+            'records': _decode_records(records)}
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Homes only the actuators that need it, on every port at once, and waits
+for their completion replies instead of polling.
+'''
+import threading
+import time
+
+from .zaber_device import ZaberError
+
+
+HOME_TIMEOUT = 120.0
+HOME = 'home'
+MOVE_TO_ZERO = 'move_to_zero'
+SKIP = 'skip'
+
+def _get_devs(devices):
+    try:
+        return devices._devs
+    except AttributeError:
+        pass
+    if isinstance(devices,dict):
+        return devices
+    return None
+
+def plan_device(dev,force=False,fast_rehome=False):
+    '''
+    Reads the home status of every actuator on dev with one broadcast
+    query and returns one action per actuator: 'home' for actuators that
+    are not homed, or every actuator when force is True, 'move_to_zero'
+    for homed actuators when fast_rehome is True, since their position
+    is trusted and a move to zero at target speed is faster than homing,
+    and 'skip' otherwise.
+    '''
+    actions = []
+    for homed in dev.homed():
+        if force or (not homed):
+            actions.append(HOME)
+        elif fast_rehome:
+            actions.append(MOVE_TO_ZERO)
+        else:
+            actions.append(SKIP)
+    return actions
+
+def home_device(dev,actions,timeout=HOME_TIMEOUT):
+    '''
+    Carries out the actions of plan_device on dev and waits for the
+    completion reply of every moved actuator. Homes with one broadcast
+    command when every actuator needs homing and with addressed
+    commands otherwise. Returns a report dictionary.
+    '''
+    t_start = time.monotonic()
+    homes = [actuator for actuator,action in enumerate(actions) if action == HOME]
+    zeros = [actuator for actuator,action in enumerate(actions) if action == MOVE_TO_ZERO]
+    awaited = [(actuator,1) for actuator in homes] + [(actuator,20) for actuator in zeros]
+    if awaited:
+        dev._await_replies(awaited)
+        if homes and (len(homes) == len(actions)):
+            dev.home()
+        else:
+            for actuator in homes:
+                dev.home(actuator)
+        for actuator in zeros:
+            dev.move_absolute(0,actuator)
+        dev._wait_for_replies(timeout)
+    return {'homed': homes,
+            'moved_to_zero': zeros,
+            'skipped': [actuator for actuator,action in enumerate(actions) if action == SKIP],
+            'time': time.monotonic() - t_start}
+
+def home_devices(devices,force=False,fast_rehome=False,timeout=HOME_TIMEOUT):
+    '''
+    Homes the actuators of a ZaberDevice, ZaberDevices or ZaberStage
+    that are not homed, all ports in parallel, and returns when every
+    one of them has replied that it finished. Homed actuators are left
+    alone unless force is True, or moved to zero with move_absolute when
+    fast_rehome is True. Returns a dictionary with serial numbers as keys
+    and reports of the actuators homed, moved to zero and skipped and
+    the time taken as values, or a single report for a ZaberDevice.
+
+    Example Usage:
+
+    home_devices(stage)
+    {123: {'homed': [1], 'moved_to_zero': [], 'skipped': [0, 2], 'time': 3.21}}
+    '''
+    devs = _get_devs(devices)
+    single = devs is None
+    if single:
+        devs = {None: devices}
+    plans = {serial_number: plan_device(devs[serial_number],force,fast_rehome) for serial_number in devs}
+    results = {}
+    errors = []
+    def home(serial_number):
+        try:
+            results[serial_number] = home_device(devs[serial_number],plans[serial_number],timeout)
+        except Exception as e:
+            errors.append(e)
+    threads = []
+    for serial_number in devs:
+        thread = threading.Thread(target=home,args=(serial_number,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    if single:
+        return results[None]
+    return results
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+'''
+Streams joystick speeds to ZaberStage axes, keeping only the newest
+speed per axis so the stage never lags behind queued commands.
+'''
+import threading
+import time
+
+from .zaber_device import ZaberError
+
+
+LATENCY_HISTORY = 1000
+# a sent speed older than this is sent again even when unchanged, in case
+# the axis was stopped by a limit or by other code meanwhile
+SENT_SPEED_MAX_AGE = 0.25
+
+
+class ZaberJogController(object):
+    '''
+    ZaberJogController keeps only the newest requested speed of each
+    axis and sends it with move_at_speed from one thread per device, as
+    fast as the write throttle of the port allows. Speeds superseded
+    before they are sent are dropped, speeds repeated within 0.25 s are
+    not resent, and a zero speed discards any pending speed of the axis and sends
+    stop right away from the calling thread. Latency is measured from
+    set_speed to the end of the serial write.
+
+    Example Usage:
+
+    stage = ZaberStage()
+    stage.set_x_axis(123,10)
+    jog = ZaberJogController(stage)
+    jog.start()
+    # from the joystick loop
+    jog.set_speed('x',2.5)
+    jog.set_speeds({'x': 0.0, 'y': -1.0})
+    jog.get_stats()
+    {'requests': 250, 'sent': 61, 'dropped': 184, 'stops': 3, 'errors': 0, 'latency_mean': 0.0021, 'latency_max': 0.0063, 'latency_p95': 0.0048}
+    jog.stop()
+    '''
+    def __init__(self,stage,axes=None):
+        self._stage = stage
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads = []
+        # serial number: {'axes', 'lock', 'pending'}
+        self._devices = {}
+        self._device_axes = {}
+        for axis,ax in stage._set_axes(axes):
+            serial_number = ax['serial_number']
+            device = self._devices.setdefault(serial_number,{'axes': [],
+                                                             'lock': threading.Lock(),
+                                                             'pending': {}})
+            device['axes'].append(axis)
+            self._device_axes[axis] = serial_number
+        # axis: (speed,time sent)
+        self._sent_speeds = {}
+        self.reset_stats()
+
+    def _get_device(self,axis):
+        try:
+            return self._devices[self._device_axes[axis]]
+        except KeyError:
+            raise ZaberError('axis {0} is not set'.format(axis))
+
+    def _already_sent(self,axis,speed):
+        '''
+        Returns True when speed was the last speed sent to axis, recently
+        enough to still be trusted. Must be called with self._condition
+        held.
+        '''
+        sent = self._sent_speeds.get(axis)
+        if (sent is None) or (sent[0] != speed):
+            return False
+        return (time.monotonic() - sent[1]) < SENT_SPEED_MAX_AGE
+
+    def set_speed(self,axis,speed):
+        '''
+        Requests that axis move at speed in stage units per second,
+        replacing any speed not yet sent. Zero stops the axis at once.
+        '''
+        device = self._get_device(axis)
+        speed = float(speed)
+        time_request = time.monotonic()
+        if speed == 0:
+            self._send_stop(device,axis,time_request)
+            return
+        with self._condition:
+            self._request_count += 1
+            if axis in device['pending']:
+                self._drop_count += 1
+            device['pending'][axis] = (speed,time_request)
+            self._condition.notify_all()
+
+    def set_speeds(self,speeds):
+        '''
+        Calls set_speed for every axis in speeds, a dictionary with axis
+        names as keys.
+        '''
+        for axis in speeds:
+            self.set_speed(axis,speeds[axis])
+
+    def _send_stop(self,device,axis,time_request):
+        with device['lock']:
+            with self._condition:
+                self._request_count += 1
+                if axis in device['pending']:
+                    del device['pending'][axis]
+                    self._drop_count += 1
+                if self._already_sent(axis,0):
+                    return
+            self._stage.stop_axes(axis)
+            self._record(axis,0,time_request,stop=True)
+
+    def _record(self,axis,speed,time_request,stop=False):
+        latency = time.monotonic() - time_request
+        with self._condition:
+            self._sent_speeds[axis] = (speed,time.monotonic())
+            self._sent_count += 1
+            if stop:
+                self._stop_count += 1
+            self._latencies.append(latency)
+            if len(self._latencies) > LATENCY_HISTORY:
+                del self._latencies[0]
+
+    def _run(self,device):
+        while not self._stop_event.is_set():
+            with self._condition:
+                while (not device['pending']) and (not self._stop_event.is_set()):
+                    self._condition.wait()
+            if self._stop_event.is_set():
+                break
+            # one axis per lock hold so a stop waits for at most one write
+            with device['lock']:
+                with self._condition:
+                    if not device['pending']:
+                        continue
+                    axis = min(device['pending'],key=lambda a: device['pending'][a][1])
+                    speed,time_request = device['pending'].pop(axis)
+                    if self._already_sent(axis,speed):
+                        continue
+                try:
+                    self._stage.move_at_speed({axis: speed})
+                except Exception:
+                    with self._condition:
+                        self._error_count += 1
+                        # the axis state is unknown after a failed write
+                        self._sent_speeds.pop(axis,None)
+                    continue
+                self._record(axis,speed,time_request)
+
+    def start(self):
+        '''
+        Starts one sending thread per device.
+        '''
+        if self._threads:
+            return
+        self._stop_event.clear()
+        for serial_number in self._devices:
+            thread = threading.Thread(target=self._run,args=(self._devices[serial_number],),
+                                      name='ZaberJogController')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self,stop_axes=True):
+        '''
+        Stops the sending threads and, unless stop_axes is False, stops
+        every axis.
+        '''
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if stop_axes:
+            time_request = time.monotonic()
+            for axis in self._device_axes:
+                device = self._get_device(axis)
+                with self._condition:
+                    self._sent_speeds.pop(axis,None)
+                self._send_stop(device,axis,time_request)
+
+    def get_stats(self):
+        '''
+        Returns request, sent, dropped, stop and error counts and the mean,
+        maximum and 95th percentile latency in seconds from set_speed to
+        the end of the serial write over the last 1000 sent commands.
+        '''
+        with self._condition:
+            latencies = sorted(self._latencies)
+            stats = {'requests': self._request_count,
+                     'sent': self._sent_count,
+                     'dropped': self._drop_count,
+                     'stops': self._stop_count,
+                     'errors': self._error_count,
+                     'latency_mean': None,
+                     'latency_max': None,
+                     'latency_p95': None}
+        if latencies:
+            stats['latency_mean'] = sum(latencies)/len(latencies)
+            stats['latency_max'] = latencies[-1]
+            stats['latency_p95'] = latencies[min(int(0.95*len(latencies)),len(latencies)-1)]
+        return stats
+
+    def reset_stats(self):
+        with self._condition:
+            self._request_count = 0
+            self._sent_count = 0
+            self._drop_count = 0
+            self._stop_count = 0
+            self._error_count = 0
+            self._latencies = []
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+Trapezoidal move-time model for Zaber actuators.
+'''
+import math
+
+
+# microsteps/s per unit of speed data (target speed, home speed, move at speed)
+SPEED_UNIT = 9.375
+# microsteps/s^2 per unit of acceleration data
+ACCELERATION_UNIT = 11250.0
+
+def move_time(distance,speed,acceleration):
+    '''
+    Returns the time in seconds to travel distance from rest to rest with
+    a trapezoidal velocity profile limited by speed and acceleration. Any
+    consistent units work, e.g. microsteps, microsteps/s and
+    microsteps/s^2.
+    '''
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if acceleration is None or acceleration <= 0:
+        return distance/speed
+    distance_ramps = speed*speed/acceleration
+    if distance >= distance_ramps:
+        return distance/speed + speed/acceleration
+    return 2.0*math.sqrt(distance/acceleration)
+
+def move_times(distances,speed,acceleration,numpy):
+    '''
+    Vectorized move_time for a NumPy array of distances.
+    '''
+    distances = numpy.abs(distances)
+    if acceleration is None or acceleration <= 0:
+        return distances/speed
+    distance_ramps = speed*speed/acceleration
+    return numpy.where(distances >= distance_ramps,
+                       distances/speed + speed/acceleration,
+                       2.0*numpy.sqrt(distances/acceleration))
+
+# microstep resolution the speed and acceleration data units refer to
+MICROSTEP_RESOLUTION_DEFAULT = 64
+
+
+class ZaberKinematicModel(object):
+    '''
+    ZaberKinematicModel predicts move and home durations for every
+    actuator on a ZaberDevice from its target speed, acceleration, home
+    speed and microstep resolution settings, and refines each prediction
+    with a per-actuator correction factor learned from observed
+    completion times.
+
+    Example Usage:
+
+    model = ZaberKinematicModel.from_device(dev)
+    model.predict_move(0,100000)
+    1.4378
+    model.observe(0,1.4378,1.52)
+    '''
+    _ALPHA = 0.25
+    _CORRECTION_MIN = 0.5
+    _CORRECTION_MAX = 4.0
+
+    def __init__(self,target_speeds,accelerations,home_speeds,microstep_resolutions=None):
+        actuator_count = len(target_speeds)
+        if microstep_resolutions is None:
+            microstep_resolutions = [MICROSTEP_RESOLUTION_DEFAULT]*actuator_count
+        scales = [float(resolution)/MICROSTEP_RESOLUTION_DEFAULT for resolution in microstep_resolutions]
+        self._target_speeds = [speed*SPEED_UNIT*scale for speed,scale in zip(target_speeds,scales)]
+        self._home_speeds = [speed*SPEED_UNIT*scale for speed,scale in zip(home_speeds,scales)]
+        self._accelerations = [acceleration*ACCELERATION_UNIT*scale for acceleration,scale in zip(accelerations,scales)]
+        self._corrections = [1.0]*actuator_count
+        self._observation_counts = [0]*actuator_count
+
+    @classmethod
+    def from_device(cls,dev):
+        '''
+        Reads the kinematic settings of every actuator on dev.
+        '''
+        return cls(dev.get_target_speed(),
+                   dev.get_acceleration(),
+                   dev.get_home_speed(),
+                   dev._get_microstep_resolution())
+
+    def get_actuator_count(self):
+        return len(self._target_speeds)
+
+    def predict_move_raw(self,actuator,distance):
+        '''
+        Returns the uncorrected duration in seconds of a move of distance
+        microsteps at the target speed.
+        '''
+        return move_time(distance,self._target_speeds[actuator],self._accelerations[actuator])
+
+    def predict_home_raw(self,actuator,distance):
+        '''
+        Returns the uncorrected duration in seconds of homing from distance
+        microsteps away at the home speed.
+        '''
+        return move_time(distance,self._home_speeds[actuator],self._accelerations[actuator])
+
+    def predict_move(self,actuator,distance):
+        return self.predict_move_raw(actuator,distance)*self._corrections[actuator]
+
+    def predict_home(self,actuator,distance):
+        return self.predict_home_raw(actuator,distance)*self._corrections[actuator]
+
+    def correct(self,actuator,raw_duration):
+        return raw_duration*self._corrections[actuator]
+
+    def observe(self,actuator,raw_duration,observed_duration):
+        '''
+        Refines the correction factor of actuator from a move whose
+        uncorrected prediction was raw_duration and which took
+        observed_duration seconds.
+        '''
+        if raw_duration <= 0:
+            return
+        ratio = observed_duration/raw_duration
+        ratio = min(max(ratio,self._CORRECTION_MIN),self._CORRECTION_MAX)
+        if self._observation_counts[actuator] == 0:
+            self._corrections[actuator] = ratio
+        else:
+            self._corrections[actuator] += self._ALPHA*(ratio - self._corrections[actuator])
+        self._observation_counts[actuator] += 1
+
+    def get_corrections(self):
+        return list(self._corrections)
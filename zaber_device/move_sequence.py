@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+'''
+Compiles repeated stage visiting patterns into moves that reuse the 16
+on-device stored-position slots.
+'''
+import time
+from collections import OrderedDict
+
+from .zaber_device import ZaberError, POSITION_ADDRESS_MIN, POSITION_ADDRESS_MAX
+
+
+OP_ABSOLUTE = 'absolute'
+OP_STORED = 'stored'
+
+
+class ZaberMoveSequence(object):
+    '''
+    ZaberMoveSequence holds a compiled list of steps for a ZaberStage.
+    Every axis target that is visited more than once is stored into a
+    stored-position slot of its actuator the first time the stage arrives
+    there, and later visits use move_to_stored_position (command 18)
+    instead of move_absolute (command 20). When more distinct repeated
+    targets than slots are in use, the least recently used slot is
+    reused. Slots start empty on every run, so positions stored by other
+    code are never trusted, but they are overwritten; restrict the slots
+    used with addresses.
+
+    Create with ZaberStage.compile_move_sequence.
+
+    Example Usage:
+
+    wells = [(9.0*column,9.0*row) for row in range(8) for column in range(12)]
+    sequence = stage.compile_move_sequence(wells*5,axes=('x','y'))
+    sequence.run(callback=acquire_image)
+    sequence.get_report()
+    {'moves': 960, 'hits': 940, 'misses': 20, 'stores': 20, 'hit_rate': 0.9791666666666666, ...}
+    '''
+    def __init__(self,stage,targets,axes=('x','y','z'),addresses=None):
+        if addresses is None:
+            addresses = list(range(POSITION_ADDRESS_MIN,POSITION_ADDRESS_MAX+1))
+        for address in addresses:
+            if (address < POSITION_ADDRESS_MIN) or (address > POSITION_ADDRESS_MAX):
+                raise ZaberError('address must be between {0} and {1}'.format(POSITION_ADDRESS_MIN,POSITION_ADDRESS_MAX))
+        self._stage = stage
+        axes_info = stage.get_axes_info()
+        self._axes = []
+        for axis in axes:
+            if axis not in axes_info:
+                raise ZaberError('axis {0} is not set'.format(axis))
+            info = axes_info[axis]
+            dev = stage._devs[info['serial_number']]
+            self._axes.append((axis,dev,info['alias'],info['actuator']))
+        targets_microstep = []
+        for target in targets:
+            if isinstance(target,dict):
+                target = [target.get(axis) for axis in axes]
+            if len(target) != len(axes):
+                raise ZaberError('each target needs one position per axis {0}'.format(axes))
+            targets_microstep.append(list(target))
+        # convert each axis column at once so calibration tables are applied vectorized
+        for axis_n,axis in enumerate(axes):
+            indexes = [index for index,target in enumerate(targets_microstep) if target[axis_n] is not None]
+            column = stage.positions_to_microsteps(axis,[float(targets_microstep[index][axis_n]) for index in indexes])
+            for index,microsteps in zip(indexes,column):
+                targets_microstep[index][axis_n] = int(microsteps)
+        self._steps = [self._compile_axis(axis_n,targets_microstep,addresses) for axis_n in range(len(axes))]
+        self._steps = list(zip(*self._steps))
+        self._report = None
+
+    def _compile_axis(self,axis_n,targets_microstep,addresses):
+        '''
+        Returns one (op, microsteps, address, store_address) tuple per
+        target for a single axis.
+        '''
+        positions = [target[axis_n] for target in targets_microstep]
+        visits_remaining = {}
+        for position in positions:
+            if position is not None:
+                visits_remaining[position] = visits_remaining.get(position,0) + 1
+        slots = OrderedDict()
+        free_addresses = list(addresses)
+        ops = []
+        for position in positions:
+            if position is None:
+                ops.append(None)
+                continue
+            visits_remaining[position] -= 1
+            if position in slots:
+                slots.move_to_end(position)
+                ops.append((OP_STORED,position,slots[position],None))
+                continue
+            store_address = None
+            if (visits_remaining[position] > 0) and addresses:
+                if free_addresses:
+                    store_address = free_addresses.pop(0)
+                else:
+                    position_evicted,store_address = slots.popitem(last=False)
+                slots[position] = store_address
+            ops.append((OP_ABSOLUTE,position,None,store_address))
+        return ops
+
+    def get_steps(self):
+        '''
+        Returns the compiled steps, one tuple per target with an
+        (op, microsteps, address, store_address) entry or None per axis.
+        '''
+        return list(self._steps)
+
+    def _wait_until_idle(self):
+        devs = {}
+        for axis,dev,alias,actuator in self._axes:
+            devs.setdefault(dev,[]).append(alias)
+        for dev in devs:
+            dev.wait_until_idle(devs[dev])
+
+    def run(self,callback=None):
+        '''
+        Runs the sequence, waiting for the stage to arrive at each target
+        before calling callback(step_index). Returns the report.
+        '''
+        times = {OP_ABSOLUTE: [], OP_STORED: [], 'store': []}
+        t_start = time.perf_counter()
+        for step_index,step in enumerate(self._steps):
+            for (axis,dev,alias,actuator),op in zip(self._axes,step):
+                if op is None:
+                    continue
+                op_type,position,address,store_address = op
+                t_dispatch = time.perf_counter()
+                if op_type == OP_STORED:
+                    dev.move_to_stored_position(address,alias)
+                else:
+                    dev.move_absolute(position,alias)
+                times[op_type].append(time.perf_counter() - t_dispatch)
+            self._wait_until_idle()
+            for (axis,dev,alias,actuator),op in zip(self._axes,step):
+                if (op is not None) and (op[3] is not None):
+                    t_dispatch = time.perf_counter()
+                    dev.store_position(op[3],alias)
+                    times['store'].append(time.perf_counter() - t_dispatch)
+            if callback is not None:
+                callback(step_index)
+        self._report = self._make_report(times,time.perf_counter() - t_start)
+        return self._report
+
+    def _make_report(self,times,duration):
+        def mean(values):
+            if values:
+                return sum(values)/len(values)
+            return None
+        hits = len(times[OP_STORED])
+        misses = len(times[OP_ABSOLUTE])
+        stores = len(times['store'])
+        moves = hits + misses
+        return {'moves': moves,
+                'hits': hits,
+                'misses': misses,
+                'stores': stores,
+                'hit_rate': (float(hits)/moves) if moves else None,
+                'commands': moves + stores,
+                'dispatch_time_absolute': mean(times[OP_ABSOLUTE]),
+                'dispatch_time_stored': mean(times[OP_STORED]),
+                'dispatch_time_store': mean(times['store']),
+                'duration': duration}
+
+    def get_report(self):
+        '''
+        Returns slot hit rate, command count and mean dispatch times
+        from the last run. Stored-position and absolute moves are both
+        one 6 byte frame, so a hit saves no serial traffic and every
+        store adds one command.
+        '''
+        return self._report
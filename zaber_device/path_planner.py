@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+'''
+Orders many stage targets to minimise total move time.
+'''
+import time
+
+from .zaber_device import ZaberError
+from .kinematics import SPEED_UNIT, ACCELERATION_UNIT, move_time, move_times
+
+
+MODE_NEAREST = 'nearest'
+MODE_SERPENTINE = 'serpentine'
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+
+class ZaberPathPlanner(object):
+    '''
+    ZaberPathPlanner orders a set of targets in stage units to minimise
+    the total move time. Axes move simultaneously, so the time between two
+    targets is the slowest axis' trapezoidal move time, using per-axis
+    speeds and accelerations read from get_target_speed and
+    get_acceleration unless given in stage units.
+
+    mode='nearest' builds a nearest-neighbour path and improves it with
+    2-opt until no improvement remains or time_limit expires. NumPy is
+    used when available so thousands of points plan in about a second.
+    mode='serpentine' sweeps rows of the last axis, alternating direction
+    along the first axis.
+
+    Example Usage:
+
+    planner = ZaberPathPlanner(stage,axes=('x','y'))
+    path,estimated_time = planner.plan(targets)
+    # or
+    path,estimated_time = stage.plan_path(targets,axes=('x','y'),mode='serpentine')
+    '''
+    _TIME_LIMIT = 2.0
+
+    def __init__(self,stage=None,axes=('x','y'),speeds=None,accelerations=None):
+        self._axes = tuple(axes)
+        self._stage = stage
+        if (speeds is None) or (accelerations is None):
+            if stage is None:
+                raise ZaberError('speeds and accelerations are required without a stage')
+            stage_speeds,stage_accelerations = self._read_kinematics(stage)
+            if speeds is None:
+                speeds = stage_speeds
+            if accelerations is None:
+                accelerations = stage_accelerations
+        self._speeds = [float(speed) for speed in speeds]
+        self._accelerations = [None if acceleration is None else float(acceleration) for acceleration in accelerations]
+        self._numpy = _import_numpy()
+
+    def _read_kinematics(self,stage):
+        '''
+        Returns per-axis target speeds and accelerations in stage units.
+        '''
+        axes_info = stage.get_axes_info()
+        speeds = []
+        accelerations = []
+        for axis in self._axes:
+            if axis not in axes_info:
+                raise ZaberError('axis {0} is not set'.format(axis))
+            info = axes_info[axis]
+            dev = stage._devs[info['serial_number']]
+            actuator = info['actuator']
+            microstep_size = abs(stage._get_scale(stage._axes[axis]))
+            speeds.append(dev.get_target_speed()[actuator]*SPEED_UNIT*microstep_size)
+            accelerations.append(dev.get_acceleration()[actuator]*ACCELERATION_UNIT*microstep_size)
+        return speeds,accelerations
+
+    def _get_start(self):
+        axes_info = self._stage.get_axes_info()
+        start = []
+        for axis in self._axes:
+            info = axes_info[axis]
+            dev = self._stage._devs[info['serial_number']]
+            start.append(self._stage.microsteps_to_positions(axis,dev.get_position()[info['actuator']]))
+        return start
+
+    def move_time(self,target_a,target_b):
+        '''
+        Returns the estimated time in seconds to move between two targets.
+        '''
+        return max(move_time(b - a,speed,acceleration)
+                   for a,b,speed,acceleration in zip(target_a,target_b,self._speeds,self._accelerations))
+
+    def path_time(self,path,start=None):
+        '''
+        Returns the estimated time in seconds to visit path in order.
+        '''
+        path_time = 0.0
+        previous = start
+        for target in path:
+            if previous is not None:
+                path_time += self.move_time(previous,target)
+            previous = target
+        return path_time
+
+    def _times_from(self,points,point):
+        numpy = self._numpy
+        times = None
+        for axis_n in range(len(self._axes)):
+            axis_times = move_times(points[:,axis_n] - point[axis_n],self._speeds[axis_n],self._accelerations[axis_n],numpy)
+            if times is None:
+                times = axis_times
+            else:
+                times = numpy.maximum(times,axis_times)
+        return times
+
+    def _times_between(self,points_a,points_b):
+        numpy = self._numpy
+        times = None
+        for axis_n in range(len(self._axes)):
+            axis_times = move_times(points_b[:,axis_n] - points_a[:,axis_n],self._speeds[axis_n],self._accelerations[axis_n],numpy)
+            if times is None:
+                times = axis_times
+            else:
+                times = numpy.maximum(times,axis_times)
+        return times
+
+    def _nearest_neighbour(self,targets,start):
+        numpy = self._numpy
+        count = len(targets)
+        if numpy is None:
+            remaining = list(range(count))
+            order = []
+            current = start
+            while remaining:
+                if current is None:
+                    best = remaining[0]
+                else:
+                    best = min(remaining,key=lambda n: self.move_time(current,targets[n]))
+                remaining.remove(best)
+                order.append(best)
+                current = targets[best]
+            return order
+        points = numpy.asarray(targets,dtype=float)
+        visited = numpy.zeros(count,dtype=bool)
+        order = numpy.empty(count,dtype=int)
+        if start is None:
+            current = 0
+        else:
+            current = int(numpy.argmin(self._times_from(points,start)))
+        for n in range(count):
+            order[n] = current
+            visited[current] = True
+            if n == count - 1:
+                break
+            times = self._times_from(points,points[current])
+            times[visited] = numpy.inf
+            current = int(numpy.argmin(times))
+        return order
+
+    def _two_opt(self,targets,order,start,deadline):
+        '''
+        Improves an open path by reversing segments while any reversal
+        shortens it. Requires NumPy.
+        '''
+        numpy = self._numpy
+        points = numpy.asarray(targets,dtype=float)
+        if start is not None:
+            # keep the start fixed at the head of the path
+            points = numpy.vstack([numpy.asarray(start,dtype=float),points])
+            order = numpy.concatenate([[0],numpy.asarray(order) + 1])
+            i_min = 0
+        else:
+            order = numpy.asarray(order)
+            i_min = -1
+        count = len(order)
+        improved = True
+        while improved and (time.perf_counter() < deadline):
+            improved = False
+            for i in range(i_min,count - 2):
+                route = points[order]
+                # reverse order[i+1:j+1] for every j > i
+                c = route[i+2:]
+                if i >= 0:
+                    a = route[i]
+                    b = route[i+1]
+                    time_ab = self._times_from(b[numpy.newaxis,:],a)[0]
+                    time_ac = self._times_from(c,a)
+                else:
+                    # reversing a prefix of a path without a fixed start
+                    time_ab = 0.0
+                    time_ac = numpy.zeros(len(c))
+                b = route[i+1]
+                time_bd = self._times_from(route[i+3:],b)
+                time_cd = self._times_between(route[i+2:-1],route[i+3:])
+                delta = time_ac - time_ab
+                delta[:-1] += time_bd - time_cd
+                j = int(numpy.argmin(delta))
+                if delta[j] < -1e-9:
+                    j += i + 2
+                    order[i+1:j+1] = order[i+1:j+1][::-1].copy()
+                    improved = True
+                if time.perf_counter() >= deadline:
+                    break
+        if start is not None:
+            order = order[1:] - 1
+        return order
+
+    def _serpentine(self,targets,row_tolerance):
+        row_axis = len(self._axes) - 1
+        indices = sorted(range(len(targets)),key=lambda n: (targets[n][row_axis],targets[n][0]))
+        rows = []
+        row_value = None
+        for n in indices:
+            value = targets[n][row_axis]
+            if (row_value is None) or (abs(value - row_value) > row_tolerance):
+                rows.append([])
+                row_value = value
+            rows[-1].append(n)
+        order = []
+        for row_n,row in enumerate(rows):
+            row = sorted(row,key=lambda n: targets[n][0])
+            if row_n % 2:
+                row.reverse()
+            order.extend(row)
+        return order
+
+    def plan_order(self,targets,mode=MODE_NEAREST,start=None,two_opt=True,time_limit=None,row_tolerance=0.0):
+        '''
+        Returns the visiting order as a list of indices into targets and
+        the estimated total move time in seconds, including the move from
+        start when given.
+        '''
+        targets = [tuple(float(position) for position in target) for target in targets]
+        for target in targets:
+            if len(target) != len(self._axes):
+                raise ZaberError('each target needs one position per axis {0}'.format(self._axes))
+        if time_limit is None:
+            time_limit = self._TIME_LIMIT
+        deadline = time.perf_counter() + time_limit
+        if len(targets) == 0:
+            return [],0.0
+        if mode == MODE_SERPENTINE:
+            order = self._serpentine(targets,row_tolerance)
+        elif mode == MODE_NEAREST:
+            order = self._nearest_neighbour(targets,start)
+            if two_opt and (self._numpy is not None) and (len(targets) > 2):
+                order = self._two_opt(targets,order,start,deadline)
+        else:
+            raise ZaberError('mode must be {0} or {1}'.format(MODE_NEAREST,MODE_SERPENTINE))
+        order = [int(n) for n in order]
+        return order,self.path_time([targets[n] for n in order],start)
+
+    def plan(self,targets,mode=MODE_NEAREST,start=None,two_opt=True,time_limit=None,row_tolerance=0.0):
+        '''
+        Returns the targets in visiting order and the estimated total move
+        time in seconds. start='current' reads the current stage position.
+        '''
+        if isinstance(start,str) and (start == 'current'):
+            start = self._get_start()
+        order,estimated_time = self.plan_order(targets,mode,start,two_opt,time_limit,row_tolerance)
+        targets = list(targets)
+        return [targets[n] for n in order],estimated_time
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+'''
+Shares Zaber actuator positions with other local processes through a
+multiprocessing.shared_memory block, so only one process needs to own
+the serial ports.
+'''
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from .zaber_device import ZaberError
+
+
+MAGIC = b'ZPOS'
+LAYOUT_VERSION = 1
+# magic, layout version, record count, sequence
+HEADER_STRUCT = struct.Struct('<4sHHQ')
+# serial_number, actuator, moving, position_microstep, position, timestamp
+RECORD_STRUCT = struct.Struct('<qHBxxxxxqdd')
+SEQUENCE_OFFSET = 8
+SEQUENCE_STRUCT = struct.Struct('<Q')
+READ_ATTEMPTS_MAX = 1000
+
+# names of blocks created by publishers in this process
+_published_names = set()
+
+def _get_devs(devices):
+    try:
+        return devices._devs
+    except AttributeError:
+        return devices
+
+def _get_scales(devices):
+    scales = {}
+    try:
+        axes_info = devices.get_axes_info()
+    except AttributeError:
+        return scales
+    for axis in axes_info:
+        info = axes_info[axis]
+        if info.get('calibration') is not None:
+            scales[(info['serial_number'],info['actuator'])] = info['calibration'].to_positions
+        else:
+            scales[(info['serial_number'],info['actuator'])] = info['microstep_size']
+    return scales
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:
+        # before Python 3.13 attaching registers the block with the
+        # resource tracker, which would unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name in _published_names:
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name,'shared_memory')
+        except (ImportError,AttributeError):
+            pass
+        return shm
+
+
+class ZaberPositionPublisher(object):
+    '''
+    ZaberPositionPublisher owns a ZaberDevices or ZaberStage, polls the
+    position and moving state of every actuator on its own thread and
+    writes them into a shared memory block with one fixed-width record
+    per actuator. A sequence counter in the header is odd while records
+    are being written so readers can detect torn reads.
+
+    Example Usage:
+
+    stage = ZaberStage(use_ports=['/dev/ttyUSB0'])
+    stage.set_x_axis(123,10)
+    stage.set_x_microstep_size(0.49609375e-3)
+    publisher = ZaberPositionPublisher(stage,name='zaber_positions')
+    publisher.start()
+    # in any other local process
+    reader = ZaberPositionReader('zaber_positions')
+    reader.read()
+    [(123, 0, False, 100790, 50.0, 81234.5678), (123, 1, False, 0, 0.0, 81234.5678)]
+    reader.get_position(123,0)
+    50.0
+    publisher.stop()
+    '''
+    _PERIOD = 0.01
+
+    def __init__(self,devices,name=None,period=None,poll_moving=True):
+        self._devices = devices
+        self._devs = _get_devs(devices)
+        if period is None:
+            period = self._PERIOD
+        self._period = period
+        self._poll_moving = poll_moving
+        self._actuators = []
+        for serial_number in self._devs:
+            dev = self._devs[serial_number]
+            actuator_count = dev.get_actuator_count()
+            if actuator_count is None:
+                actuator_count = len(dev.get_position())
+            for actuator in range(actuator_count):
+                self._actuators.append((serial_number,actuator))
+        size = HEADER_STRUCT.size + RECORD_STRUCT.size*len(self._actuators)
+        self._shm = shared_memory.SharedMemory(name=name,create=True,size=size)
+        _published_names.add(self._shm.name)
+        self._buf = self._shm.buf
+        self._sequence = 0
+        HEADER_STRUCT.pack_into(self._buf,0,MAGIC,LAYOUT_VERSION,len(self._actuators),self._sequence)
+        self._scales = _get_scales(devices)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._publish_count = 0
+        self._error_count = 0
+        self._t_start = None
+
+    def get_name(self):
+        '''
+        Returns the shared memory block name readers attach to.
+        '''
+        return self._shm.name
+
+    def _write_sequence(self):
+        SEQUENCE_STRUCT.pack_into(self._buf,SEQUENCE_OFFSET,self._sequence)
+
+    def publish(self):
+        '''
+        Polls every device once and writes a new snapshot.
+        '''
+        readings = {}
+        for serial_number in self._devs:
+            dev = self._devs[serial_number]
+            positions = dev.get_position()
+            if self._poll_moving:
+                movings = dev.moving()
+            else:
+                movings = [False]*len(positions)
+            readings[serial_number] = (positions,movings,time.monotonic())
+        # build every record first so a bad reading leaves the last
+        # snapshot in place instead of an odd sequence
+        records = []
+        for serial_number,actuator in self._actuators:
+            positions,movings,timestamp = readings[serial_number]
+            if (actuator >= len(positions)) or (actuator >= len(movings)):
+                raise ZaberError('device {0} returned {1} positions, expected {2} or more'.format(serial_number,len(positions),actuator+1))
+            position_microstep = positions[actuator]
+            scale = self._scales.get((serial_number,actuator),1)
+            if callable(scale):
+                position = scale(position_microstep)
+            else:
+                position = position_microstep*scale
+            records.append((serial_number,actuator,movings[actuator],position_microstep,position,timestamp))
+        self._sequence += 1
+        self._write_sequence()
+        try:
+            offset = HEADER_STRUCT.size
+            for record in records:
+                RECORD_STRUCT.pack_into(self._buf,offset,*record)
+                offset += RECORD_STRUCT.size
+        finally:
+            self._sequence += 1
+            self._write_sequence()
+        self._publish_count += 1
+
+    def _run(self):
+        t_next = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self.publish()
+            except Exception:
+                # serial_interface ReadError is not an OSError
+                self._error_count += 1
+            t_next += self._period
+            delay = t_next - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                t_next = time.monotonic()
+
+    def start(self):
+        '''
+        Starts polling and publishing on a background thread.
+        '''
+        if (self._thread is not None) and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._t_start = time.monotonic()
+        self._thread = threading.Thread(target=self._run,name='ZaberPositionPublisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the publishing thread.
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_stats(self):
+        '''
+        Returns publish count, error count and mean publish rate in Hz.
+        '''
+        rate = None
+        if (self._t_start is not None) and (self._publish_count > 0):
+            rate = self._publish_count/(time.monotonic() - self._t_start)
+        return {'publish_count': self._publish_count,
+                'error_count': self._error_count,
+                'publish_rate': rate}
+
+    def close(self):
+        '''
+        Stops publishing and removes the shared memory block.
+        '''
+        self.stop()
+        self._buf = None
+        self._shm.close()
+        self._shm.unlink()
+        _published_names.discard(self._shm.name)
+
+
+class ZaberPositionReader(object):
+    '''
+    ZaberPositionReader attaches to the shared memory block written by a
+    ZaberPositionPublisher and returns consistent snapshots without
+    touching the serial ports.
+    '''
+    def __init__(self,name):
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        magic,version,record_count,sequence = HEADER_STRUCT.unpack_from(self._buf,0)
+        if (magic != MAGIC) or (version != LAYOUT_VERSION):
+            self.close()
+            raise ZaberError('{0} is not a Zaber position block'.format(name))
+        self._record_count = record_count
+        self._records_size = RECORD_STRUCT.size*record_count
+        self._index = {}
+
+    def read_raw(self):
+        '''
+        Returns sequence number and a consistent copy of the record bytes.
+        '''
+        buf = self._buf
+        start = HEADER_STRUCT.size
+        end = start + self._records_size
+        unpack_from = SEQUENCE_STRUCT.unpack_from
+        for attempt in range(READ_ATTEMPTS_MAX):
+            sequence = unpack_from(buf,SEQUENCE_OFFSET)[0]
+            if sequence & 1:
+                continue
+            records = bytes(buf[start:end])
+            if unpack_from(buf,SEQUENCE_OFFSET)[0] == sequence:
+                return sequence,records
+        raise ZaberError('Could not read a consistent snapshot')
+
+    def read(self):
+        '''
+        Returns a list of (serial_number, actuator, moving,
+        position_microstep, position, timestamp) tuples, one per
+        actuator. Timestamps are time.monotonic() in the publisher.
+        '''
+        sequence,records = self.read_raw()
+        return [(s,a,bool(m),p_m,p,t) for s,a,m,p_m,p,t in RECORD_STRUCT.iter_unpack(records)]
+
+    def get_sequence(self):
+        '''
+        Returns the current sequence number, which increases by two with
+        every snapshot.
+        '''
+        return SEQUENCE_STRUCT.unpack_from(self._buf,SEQUENCE_OFFSET)[0]
+
+    def get_position(self,serial_number,actuator):
+        '''
+        Returns the most recent published position of one actuator.
+        '''
+        key = (serial_number,actuator)
+        if key not in self._index:
+            self._index = {(r[0],r[1]): n for n,r in enumerate(self.read())}
+        n = self._index[key]
+        sequence,records = self.read_raw()
+        return RECORD_STRUCT.unpack_from(records,n*RECORD_STRUCT.size)[4]
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''
+Records time-stamped actuator positions into a compact append-only
+binary file and loads long sessions back without copying.
+'''
+import os
+import struct
+import threading
+import time
+
+from .zaber_device import ZaberError
+
+
+MAGIC = b'ZREC'
+LAYOUT_VERSION = 1
+# magic, layout version, device count, actuator count max, clock offset
+HEADER_STRUCT = struct.Struct('<4sHHId')
+# serial number of each device index
+DEVICE_STRUCT = struct.Struct('<q')
+# time before write, time after read, device index, actuator count
+RECORD_HEADER_STRUCT = struct.Struct('<ddii')
+POSITION_FORMAT = 'q'
+
+def _get_devs(devices):
+    try:
+        return devices._devs
+    except AttributeError:
+        return devices
+
+def _record_struct(actuator_count_max):
+    return struct.Struct(RECORD_HEADER_STRUCT.format + POSITION_FORMAT*actuator_count_max)
+
+def _read_header(f):
+    header = f.read(HEADER_STRUCT.size)
+    if len(header) < HEADER_STRUCT.size:
+        raise ZaberError('position log header is truncated')
+    magic,version,device_count,actuator_count_max,clock_offset = HEADER_STRUCT.unpack(header)
+    if (magic != MAGIC) or (version != LAYOUT_VERSION):
+        raise ZaberError('not a Zaber position log')
+    serial_numbers = []
+    for device_index in range(device_count):
+        serial_numbers.append(DEVICE_STRUCT.unpack(f.read(DEVICE_STRUCT.size))[0])
+    return {'serial_numbers': serial_numbers,
+            'actuator_count_max': actuator_count_max,
+            'clock_offset': clock_offset,
+            'header_size': HEADER_STRUCT.size + DEVICE_STRUCT.size*device_count}
+
+
+class ZaberPositionRecorder(object):
+    '''
+    ZaberPositionRecorder polls the positions of every device in a
+    ZaberDevices or ZaberStage and appends one fixed-width record per
+    serial transaction to a binary file. Each record holds the
+    time.monotonic() timestamps taken just before the request was written
+    and just after the reply was read, the device index and the
+    microstep position of every actuator. The header stores the offset
+    between time.time() and time.monotonic() when the file was created.
+    Appending to an existing log first drops a partial record left by an
+    interrupted session. Polls that fail on the background thread are
+    counted and recording goes on.
+
+    Example Usage:
+
+    stage = ZaberStage(use_ports=['/dev/ttyUSB0'])
+    recorder = ZaberPositionRecorder(stage,'positions.zrec')
+    recorder.start(period=0.005)
+    recorder.stop()
+    recorder.close()
+    log = load_position_log('positions.zrec')
+    log['records']['t_read']
+    log['records']['position'][:,0]
+    '''
+    _PERIOD = 0.01
+    _FLUSH_PERIOD = 1.0
+
+    def __init__(self,devices,path):
+        self._devs = _get_devs(devices)
+        self._serial_numbers = list(self._devs.keys())
+        self._device_index = {}
+        actuator_count_max = 0
+        for device_index,serial_number in enumerate(self._serial_numbers):
+            self._device_index[serial_number] = device_index
+            dev = self._devs[serial_number]
+            actuator_count = dev.get_actuator_count()
+            if actuator_count is None:
+                actuator_count = len(dev.get_position())
+            actuator_count_max = max(actuator_count_max,actuator_count)
+        self._actuator_count_max = actuator_count_max
+        self._record_struct = _record_struct(actuator_count_max)
+        self._record_buffer = bytearray(self._record_struct.size)
+        self._positions_padding = [0]*actuator_count_max
+        self._path = path
+        if os.path.exists(path) and (os.path.getsize(path) > 0):
+            with open(path,'rb') as f:
+                header = _read_header(f)
+            if (header['serial_numbers'] != self._serial_numbers) or (header['actuator_count_max'] != actuator_count_max):
+                raise ZaberError('{0} was recorded from different devices'.format(path))
+            records_size = os.path.getsize(path) - header['header_size']
+            partial_size = records_size % self._record_struct.size
+            if partial_size:
+                os.truncate(path,os.path.getsize(path) - partial_size)
+            self._file = open(path,'ab')
+        else:
+            self._file = open(path,'ab')
+            self._file.write(HEADER_STRUCT.pack(MAGIC,LAYOUT_VERSION,len(self._serial_numbers),actuator_count_max,time.time() - time.monotonic()))
+            for serial_number in self._serial_numbers:
+                self._file.write(DEVICE_STRUCT.pack(serial_number))
+            self._file.flush()
+        self._file_lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._record_count = 0
+        self._error_count = 0
+
+    def record(self):
+        '''
+        Reads every device once and appends one record per device.
+        '''
+        for serial_number in self._serial_numbers:
+            dev = self._devs[serial_number]
+            positions,t_write,t_read = dev.get_position_timed()
+            actuator_count = len(positions)
+            if actuator_count < self._actuator_count_max:
+                positions = positions + self._positions_padding[actuator_count:]
+            with self._file_lock:
+                self._record_struct.pack_into(self._record_buffer,0,
+                                              t_write,
+                                              t_read,
+                                              self._device_index[serial_number],
+                                              actuator_count,
+                                              *positions)
+                self._file.write(self._record_buffer)
+                self._record_count += 1
+
+    def _run(self,period):
+        t_next = time.monotonic()
+        t_flush = t_next
+        while not self._stop_event.is_set():
+            try:
+                self.record()
+            except Exception:
+                self._error_count += 1
+            t_now = time.monotonic()
+            if (t_now - t_flush) >= self._FLUSH_PERIOD:
+                self.flush()
+                t_flush = t_now
+            t_next += period
+            delay = t_next - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                t_next = time.monotonic()
+
+    def start(self,period=None):
+        '''
+        Starts recording on a background thread.
+        '''
+        if period is None:
+            period = self._PERIOD
+        if (self._thread is not None) and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,args=(period,),name='ZaberPositionRecorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        with self._file_lock:
+            self._file.flush()
+
+    def get_record_count(self):
+        return self._record_count
+
+    def get_error_count(self):
+        return self._error_count
+
+    def close(self):
+        self.stop()
+        self._file.close()
+
+
+def load_position_log(path):
+    '''
+    Loads a position log written by ZaberPositionRecorder. Returns a dict
+    with serial_numbers, clock_offset and records. With NumPy installed
+    records is a read-only memory-mapped structured array with fields
+    t_write, t_read, device, actuator_count and position, so long
+    sessions load without copying. Otherwise records is a list of tuples.
+    '''
+    with open(path,'rb') as f:
+        header = _read_header(f)
+    actuator_count_max = header['actuator_count_max']
+    record_struct = _record_struct(actuator_count_max)
+    record_count = (os.path.getsize(path) - header['header_size']) // record_struct.size
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        dtype = numpy.dtype([('t_write','<f8'),
+                             ('t_read','<f8'),
+                             ('device','<i4'),
+                             ('actuator_count','<i4'),
+                             ('position','<i8',(actuator_count_max,))])
+        if record_count > 0:
+            records = numpy.memmap(path,dtype=dtype,mode='r',offset=header['header_size'],shape=(record_count,))
+        else:
+            records = numpy.zeros(0,dtype=dtype)
+    else:
+        records = []
+        with open(path,'rb') as f:
+            f.seek(header['header_size'])
+            data = f.read(record_count*record_struct.size)
+        for values in record_struct.iter_unpack(data):
+            records.append(values[:4] + (list(values[4:4+values[3]]),))
+    header['records'] = records
+    return header
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+'''
+Applies declarative settings profiles to Zaber devices, writing only the
+settings that differ from what the actuators already hold.
+'''
+import json
+import threading
+
+from .zaber_device import ZaberError, CURRENT_MIN, CURRENT_MAX, ZABER_CURRENT_MIN, ZABER_CURRENT_MAX, ALIAS_MIN, ALIAS_MAX
+
+
+ALL_ACTUATORS = 'all'
+MODE_SETTING = 40
+# profile name: (setting number, setter name)
+SETTINGS = {
+    'running_current': (38,'set_running_current'),
+    'hold_current': (39,'set_hold_current'),
+    'home_speed': (41,'set_home_speed'),
+    'target_speed': (42,'set_target_speed'),
+    'acceleration': (43,'set_acceleration'),
+    'home_offset': (47,'set_home_offset'),
+    'alias': (48,None),
+}
+# profile name: (mode bit, bit value when the profile value is True)
+MODE_BITS = {
+    'potentiometer': (3,0),
+    'power_led': (14,0),
+    'serial_led': (15,0),
+}
+
+def load_profile(path):
+    '''
+    Loads a profile from a JSON file, or from a YAML file when PyYAML is
+    installed.
+    '''
+    with open(path,'r') as f:
+        if path.lower().endswith(('.yaml','.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ZaberError('PyYAML is required to load {0}'.format(path))
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def _get_devs(devices):
+    try:
+        return devices._devs
+    except AttributeError:
+        pass
+    if isinstance(devices,dict):
+        return devices
+    return None
+
+def _to_device(dev,name,value):
+    '''
+    Returns the raw setting value the actuator reports for a profile value.
+    '''
+    if name in ('running_current','hold_current'):
+        if (value < CURRENT_MIN) or (value > CURRENT_MAX):
+            raise ZaberError('{0} must be between {1} and {2}'.format(name,CURRENT_MIN,CURRENT_MAX))
+        return dev._map(value,CURRENT_MIN,CURRENT_MAX,ZABER_CURRENT_MIN,ZABER_CURRENT_MAX)
+    if name == 'alias':
+        if value is None:
+            return 0
+        if (value < ALIAS_MIN) or (value > ALIAS_MAX):
+            raise ZaberError('alias must be between {0} and {1}'.format(ALIAS_MIN,ALIAS_MAX))
+        return int(value) + 1
+    return int(value)
+
+def _actuator_settings(settings,actuator_count):
+    '''
+    Returns one dictionary of profile values per actuator, merging the
+    'all' entry into every actuator.
+    '''
+    for key in settings:
+        if key == ALL_ACTUATORS:
+            continue
+        try:
+            actuator = int(key)
+        except (TypeError,ValueError):
+            raise ZaberError('profile actuator {0} must be {1} or an actuator number'.format(key,ALL_ACTUATORS))
+        if (actuator < 0) or (actuator >= actuator_count):
+            raise ZaberError('profile actuator {0} is not connected'.format(key))
+    common = settings.get(ALL_ACTUATORS,{})
+    actuator_settings = []
+    for actuator in range(actuator_count):
+        values = dict(common)
+        values.update(settings.get(actuator,settings.get(str(actuator),{})))
+        for name in values:
+            if (name not in SETTINGS) and (name not in MODE_BITS):
+                raise ZaberError('unknown profile setting {0}'.format(name))
+        actuator_settings.append(values)
+    return actuator_settings
+
+def diff_device(dev,settings):
+    '''
+    Reads every setting named in settings from dev with one broadcast
+    query per setting and returns the writes needed as a list of
+    (setting number, actuator, raw value, raw current value) tuples.
+    actuator is None when every actuator gets the same value.
+    '''
+    actuator_count = dev.get_actuator_count()
+    if actuator_count is None:
+        actuator_count = dev.find_actuator_count()
+    actuator_settings = _actuator_settings(settings,actuator_count)
+    names = set()
+    for values in actuator_settings:
+        names.update(values.keys())
+    currents = {}
+    for name in names:
+        if name in SETTINGS:
+            setting = SETTINGS[name][0]
+        else:
+            setting = MODE_SETTING
+        if setting not in currents:
+            currents[setting] = dev._return_setting(setting,None)
+    desireds = {}
+    for actuator,values in enumerate(actuator_settings):
+        for name in values:
+            if name in SETTINGS:
+                setting = SETTINGS[name][0]
+                desireds.setdefault(setting,list(currents[setting]))[actuator] = _to_device(dev,name,values[name])
+            else:
+                bit,bit_value = MODE_BITS[name]
+                if not bool(values[name]):
+                    bit_value = 1 - bit_value
+                modes = desireds.setdefault(MODE_SETTING,list(currents[MODE_SETTING]))
+                if bit_value:
+                    modes[actuator] |= 1 << bit
+                else:
+                    modes[actuator] &= ~(1 << bit)
+    writes = []
+    for setting in sorted(desireds):
+        desired = desireds[setting]
+        current = currents[setting]
+        changed = [actuator for actuator in range(actuator_count) if desired[actuator] != current[actuator]]
+        if not changed:
+            continue
+        if ((len(changed) == actuator_count) and (actuator_count > 1) and
+            (len(set(desired)) == 1) and (setting != SETTINGS['alias'][0])):
+            writes.append((setting,None,desired[0],current[0]))
+        else:
+            for actuator in changed:
+                writes.append((setting,actuator,desired[actuator],current[actuator]))
+    return writes
+
+def apply_device(dev,settings,dry_run=False):
+    '''
+    Writes only the settings of dev that differ from settings and
+    returns the writes made, see diff_device.
+    '''
+    writes = diff_device(dev,settings)
+    if dry_run:
+        return writes
+    for setting,actuator,value,current in writes:
+        dev._send_request(setting,actuator,value)
+    if writes:
+        dev._aliases = None
+        dev._kinematic_model = None
+    return writes
+
+def apply_profile(devices,profile,dry_run=False):
+    '''
+    Applies profile to a ZaberDevice, ZaberDevices or ZaberStage.
+    profile is a dictionary, or a path to a JSON or YAML file, with
+    device serial numbers as keys and dictionaries of actuator settings
+    as values. Actuator settings are keyed by actuator index, or 'all'
+    for every actuator, and may hold running_current, hold_current,
+    home_speed, target_speed, acceleration, home_offset, alias and the
+    booleans potentiometer, power_led and serial_led. Devices on
+    different ports are configured in parallel. Returns a dictionary
+    with serial numbers as keys and the writes made as values.
+
+    Example Usage:
+
+    profile = {1234: {'all': {'target_speed': 2000, 'acceleration': 100},
+                      0: {'alias': 10, 'potentiometer': False},
+                      1: {'alias': 11, 'potentiometer': False}}}
+    apply_profile(devs,profile)
+    apply_profile(devs,profile)
+    {1234: []}
+    '''
+    if not isinstance(profile,dict):
+        profile = load_profile(profile)
+    devs = _get_devs(devices)
+    if devs is None:
+        devs = {devices.get_serial_number(): devices}
+    profile = {str(serial_number): profile[serial_number] for serial_number in profile}
+    for serial_number in profile:
+        if serial_number not in [str(key) for key in devs]:
+            raise ZaberError('device {0} in profile is not connected'.format(serial_number))
+    results = {}
+    errors = []
+    def apply(serial_number,dev,settings):
+        try:
+            results[serial_number] = apply_device(dev,settings,dry_run)
+        except Exception as e:
+            errors.append(e)
+    threads = []
+    for serial_number in devs:
+        settings = profile.get(str(serial_number))
+        if settings is None:
+            continue
+        thread = threading.Thread(target=apply,args=(serial_number,devs[serial_number],settings))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''
+Replays a flight record dumped by ZaberDevice through the ZaberDevice
+reply decoder against a port stand-in, so timing problems can be
+profiled without the hardware.
+'''
+import argparse
+import time
+
+from .zaber_device import ZaberDevice, ZaberNumberingError, RESPONSE_LENGTH, _import_serial_stack
+from .flight_recorder import load_flight_record, FRAME_STRUCT
+from .simulator import ZaberSimulator
+
+
+REQUEST_KINDS = ('command','query')
+
+
+class ZaberReplayPort(ZaberSimulator):
+    '''
+    ZaberReplayPort stands in for a serial port and answers each request
+    written to it with the replies recorded after the matching request
+    of a flight record, delayed as they were when recorded. Requests that
+    differ from the record are counted as mismatches and still answered
+    with the recorded replies.
+    '''
+    def __init__(self,records,baudrate=9600,timeout=0.05,port='replay'):
+        ZaberSimulator.__init__(self,actuator_count=0,baudrate=baudrate,timeout=timeout,port=port)
+        # (request time,request frame,[(delay,number,command,data)])
+        self._exchanges = []
+        for t,kind,number,command,data in records:
+            if kind in REQUEST_KINDS:
+                self._exchanges.append((t,FRAME_STRUCT.pack(number,command,data),[]))
+            elif (kind == 'reply') and self._exchanges:
+                t_request = self._exchanges[-1][0]
+                self._exchanges[-1][2].append((t - t_request,number,command,data))
+        self._exchange_index = 0
+        self.mismatch_count = 0
+
+    def _handle(self,frame,t):
+        self.request_count += 1
+        if self._exchange_index >= len(self._exchanges):
+            self.mismatch_count += 1
+            return
+        t_request,request,replies = self._exchanges[self._exchange_index]
+        self._exchange_index += 1
+        if request != frame:
+            self.mismatch_count += 1
+        for delay,number,command,data in replies:
+            self._schedule(t + delay,number,command,data)
+        number,command,data = FRAME_STRUCT.unpack(frame)
+        if command == 122:
+            self._chain_baudrate = data
+
+
+def _recorded_latencies(records,dev):
+    '''
+    Returns the latency of every recorded query, from the request to the
+    last reply carrying one of its reply commands before the next
+    request, or None when no reply arrived.
+    '''
+    latencies = []
+    query = None
+    def close(query):
+        if query is not None:
+            latencies.append(query[2])
+    for t,kind,number,command,data in records:
+        if kind in REQUEST_KINDS:
+            close(query)
+            query = None
+            if kind == 'query':
+                query = [t,dev._reply_commands(command,data),None]
+        elif (kind == 'reply') and (query is not None) and (command in query[1]):
+            query[2] = t - query[0]
+    close(query)
+    return latencies
+
+def _summarize(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None,None
+    return sum(values)/len(values),max(values)
+
+def replay_flight_record(path,serial_interface=None,timing=True,timeout=None):
+    '''
+    Sends the requests of the flight record at path through a ZaberDevice,
+    with the original spacing unless timing is False, and reads the
+    replies of every recorded query through its decoder. The port is a
+    ZaberReplayPort answering with the recorded replies unless
+    serial_interface, such as a ZaberSimulator, is given. Returns a
+    report with request counts, short reads, numbering errors, request
+    mismatches, recorded and replayed wall time and the recorded and
+    replayed query latencies per command.
+
+    Example Usage:
+
+    report = replay_flight_record('session.zfr')
+    report['latency'][60]
+    {'count': 120, 'recorded_mean': 0.0031, 'recorded_max': 0.0093, 'replayed_mean': 0.0029, 'replayed_max': 0.0088}
+    '''
+    _import_serial_stack()
+    from .zaber_device import ReadError
+    flight_record = load_flight_record(path)
+    records = flight_record['records']
+    if serial_interface is None:
+        serial_interface = ZaberReplayPort(records,baudrate=flight_record['baudrate'] or 9600)
+    kwargs = {'serial_interface': serial_interface}
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    dev = ZaberDevice(**kwargs)
+    dev.set_actuator_count(flight_record['actuator_count'])
+    requests = [record for record in records if record[1] in REQUEST_KINDS]
+    recorded_latencies = _recorded_latencies(records,dev)
+    latency = {}
+    replayed_latencies = []
+    short_read_count = 0
+    numbering_error_count = 0
+    t_first = requests[0][0] if requests else 0.0
+    t_start = time.monotonic()
+    for t,kind,number,command,data in requests:
+        if timing:
+            delay = (t - t_first) - (time.monotonic() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        request = dev._args_to_request_bytes(number,command,data)
+        if kind == 'command':
+            dev._write(request)
+            continue
+        expected_count = dev._expected_reply_count(number)
+        with dev._lock:
+            try:
+                response_length = dev._write_read(request,dev._reply_commands(command,data),expected_count)
+            except ReadError:
+                response_length = 0
+            replayed = None
+            if dev._time_last_reply is not None:
+                replayed = dev._time_last_reply - dev._time_query_write
+            if (expected_count is not None) and (response_length < expected_count*RESPONSE_LENGTH):
+                short_read_count += 1
+            if (number == 0) and response_length:
+                try:
+                    dev._response_to_data(dev._response_view,response_length)
+                except ZaberNumberingError:
+                    numbering_error_count += 1
+        replayed_latencies.append((command,replayed))
+    wall_time = time.monotonic() - t_start
+    for (command,replayed),recorded in zip(replayed_latencies,recorded_latencies):
+        stats = latency.setdefault(command,{'recorded': [],'replayed': []})
+        stats['recorded'].append(recorded)
+        stats['replayed'].append(replayed)
+    for command in latency:
+        stats = latency[command]
+        recorded_mean,recorded_max = _summarize(stats['recorded'])
+        replayed_mean,replayed_max = _summarize(stats['replayed'])
+        latency[command] = {'count': len(stats['replayed']),
+                            'recorded_mean': recorded_mean,
+                            'recorded_max': recorded_max,
+                            'replayed_mean': replayed_mean,
+                            'replayed_max': replayed_max}
+    report = {'requests': len(requests),
+              'queries': len(replayed_latencies),
+              'short_reads': short_read_count,
+              'numbering_errors': numbering_error_count,
+              'mismatches': getattr(serial_interface,'mismatch_count',None),
+              'recorded_time': (requests[-1][0] - requests[0][0]) if requests else 0.0,
+              'replayed_time': wall_time,
+              'latency': latency}
+    dev.close()
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a Zaber flight record and compare query latencies.')
+    parser.add_argument('path',help='flight record written by ZaberDevice.dump_flight_record')
+    parser.add_argument('--simulate',type=int,default=None,metavar='ACTUATOR_COUNT',help='answer with a simulated chain instead of the recorded replies')
+    parser.add_argument('--fast',action='store_true',help='send requests back to back instead of with the recorded spacing')
+    args = parser.parse_args(argv)
+    serial_interface = None
+    if args.simulate is not None:
+        baudrate = load_flight_record(args.path)['baudrate'] or 9600
+        serial_interface = ZaberSimulator(actuator_count=args.simulate,baudrate=baudrate)
+    report = replay_flight_record(args.path,serial_interface,timing=not args.fast)
+    print('{0} requests, {1} queries, {2} short reads, {3} numbering errors, {4} mismatches'.format(
+        report['requests'],report['queries'],report['short_reads'],report['numbering_errors'],report['mismatches']))
+    print('recorded {0:.3f} s, replayed {1:.3f} s'.format(report['recorded_time'],report['replayed_time']))
+    print('{0:>8} {1:>6} {2:>14} {3:>14} {4:>14} {5:>14}'.format('command','count','recorded ms','max ms','replayed ms','max ms'))
+    def ms(value):
+        return '-' if value is None else '{0:.3f}'.format(value*1000)
+    for command in sorted(report['latency']):
+        stats = report['latency'][command]
+        print('{0:>8} {1:>6} {2:>14} {3:>14} {4:>14} {5:>14}'.format(command,stats['count'],
+            ms(stats['recorded_mean']),ms(stats['recorded_max']),ms(stats['replayed_mean']),ms(stats['replayed_max'])))
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
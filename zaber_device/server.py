@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+'''
+Serves a ZaberStage to local clients over a compact binary RPC on a TCP
+or Unix socket, so many tools can share one physical connection per
+serial port.
+'''
+import argparse
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from .zaber_device import ZaberStage, ZaberError
+
+
+HOST = '127.0.0.1'
+TCP_PORT = 5590
+# payload length, message type, request id
+HEADER_STRUCT = struct.Struct('<IBI')
+PAYLOAD_LENGTH_MAX = 1 << 24
+
+MESSAGE_REQUEST = 1
+MESSAGE_RESPONSE = 2
+MESSAGE_ERROR = 3
+MESSAGE_SUBSCRIBE = 4
+MESSAGE_UNSUBSCRIBE = 5
+MESSAGE_UPDATE = 6
+
+_TAG_NONE = 0
+_TAG_FALSE = 1
+_TAG_TRUE = 2
+_TAG_INT = 3
+_TAG_FLOAT = 4
+_TAG_STR = 5
+_TAG_BYTES = 6
+_TAG_LIST = 7
+_TAG_TUPLE = 8
+_TAG_DICT = 9
+
+_INT_STRUCT = struct.Struct('<q')
+_FLOAT_STRUCT = struct.Struct('<d')
+_LENGTH_STRUCT = struct.Struct('<I')
+
+def encode(value,out=None):
+    '''
+    Appends the compact binary encoding of value to out and returns out.
+    Supports None, bool, int, float, str, bytes, list, tuple and dict.
+    '''
+    if out is None:
+        out = bytearray()
+    if value is None:
+        out.append(_TAG_NONE)
+    elif value is True:
+        out.append(_TAG_TRUE)
+    elif value is False:
+        out.append(_TAG_FALSE)
+    elif isinstance(value,int):
+        out.append(_TAG_INT)
+        out += _INT_STRUCT.pack(value)
+    elif isinstance(value,float):
+        out.append(_TAG_FLOAT)
+        out += _FLOAT_STRUCT.pack(value)
+    elif isinstance(value,str):
+        data = value.encode('utf-8')
+        out.append(_TAG_STR)
+        out += _LENGTH_STRUCT.pack(len(data))
+        out += data
+    elif isinstance(value,(bytes,bytearray)):
+        out.append(_TAG_BYTES)
+        out += _LENGTH_STRUCT.pack(len(value))
+        out += value
+    elif isinstance(value,(list,tuple)):
+        if isinstance(value,tuple):
+            out.append(_TAG_TUPLE)
+        else:
+            out.append(_TAG_LIST)
+        out += _LENGTH_STRUCT.pack(len(value))
+        for item in value:
+            encode(item,out)
+    elif isinstance(value,dict):
+        out.append(_TAG_DICT)
+        out += _LENGTH_STRUCT.pack(len(value))
+        for key in value:
+            encode(key,out)
+            encode(value[key],out)
+    else:
+        raise ZaberError('cannot encode {0}'.format(type(value).__name__))
+    return out
+
+def decode(data,offset=0):
+    '''
+    Decodes one value from data at offset and returns (value, offset).
+    '''
+    tag = data[offset]
+    offset += 1
+    if tag == _TAG_NONE:
+        return None,offset
+    if tag == _TAG_FALSE:
+        return False,offset
+    if tag == _TAG_TRUE:
+        return True,offset
+    if tag == _TAG_INT:
+        return _INT_STRUCT.unpack_from(data,offset)[0],offset + _INT_STRUCT.size
+    if tag == _TAG_FLOAT:
+        return _FLOAT_STRUCT.unpack_from(data,offset)[0],offset + _FLOAT_STRUCT.size
+    length = _LENGTH_STRUCT.unpack_from(data,offset)[0]
+    offset += _LENGTH_STRUCT.size
+    if tag == _TAG_STR:
+        return bytes(data[offset:offset+length]).decode('utf-8'),offset + length
+    if tag == _TAG_BYTES:
+        return bytes(data[offset:offset+length]),offset + length
+    if tag in (_TAG_LIST,_TAG_TUPLE):
+        items = []
+        for n in range(length):
+            item,offset = decode(data,offset)
+            items.append(item)
+        if tag == _TAG_TUPLE:
+            items = tuple(items)
+        return items,offset
+    if tag == _TAG_DICT:
+        items = {}
+        for n in range(length):
+            key,offset = decode(data,offset)
+            items[key],offset = decode(data,offset)
+        return items,offset
+    raise ZaberError('unknown tag {0}'.format(tag))
+
+def _recv_exactly(sock,size):
+    data = bytearray(size)
+    view = memoryview(data)
+    count = 0
+    while count < size:
+        bytes_read = sock.recv_into(view[count:])
+        if bytes_read == 0:
+            return None
+        count += bytes_read
+    return data
+
+def recv_message(sock):
+    '''
+    Returns (message_type, request_id, body) or None if the peer closed.
+    Raises ZaberError when the payload cannot be decoded.
+    '''
+    header = _recv_exactly(sock,HEADER_STRUCT.size)
+    if header is None:
+        return None
+    length,message_type,request_id = HEADER_STRUCT.unpack(header)
+    if length > PAYLOAD_LENGTH_MAX:
+        raise ZaberError('message too long: {0}'.format(length))
+    payload = _recv_exactly(sock,length)
+    if payload is None:
+        return None
+    try:
+        body,offset = decode(payload)
+    except (struct.error,IndexError,UnicodeDecodeError,RecursionError):
+        raise ZaberError('malformed message payload')
+    return message_type,request_id,body
+
+def pack_message(message_type,request_id,body):
+    payload = encode(body)
+    return HEADER_STRUCT.pack(len(payload),message_type,request_id) + payload
+
+
+class _SharedCall(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _ZaberStageRequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.send_lock = threading.Lock()
+        self.server.zaber_stage_server._add_session(self)
+
+    def send(self,message_type,request_id,body):
+        message = pack_message(message_type,request_id,body)
+        with self.send_lock:
+            self.request.sendall(message)
+
+    def handle(self):
+        stage_server = self.server.zaber_stage_server
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (OSError,ZaberError):
+                return
+            if message is None:
+                return
+            message_type,request_id,body = message
+            try:
+                if message_type == MESSAGE_REQUEST:
+                    method,args,kwargs = body
+                    result = stage_server.call(method,args,kwargs)
+                    self.send(MESSAGE_RESPONSE,request_id,result)
+                elif message_type == MESSAGE_SUBSCRIBE:
+                    stage_server._subscribe(self,body)
+                    self.send(MESSAGE_RESPONSE,request_id,None)
+                elif message_type == MESSAGE_UNSUBSCRIBE:
+                    stage_server._unsubscribe(self)
+                    self.send(MESSAGE_RESPONSE,request_id,None)
+                else:
+                    raise ZaberError('unknown message type {0}'.format(message_type))
+            except OSError:
+                return
+            except Exception as e:
+                try:
+                    self.send(MESSAGE_ERROR,request_id,[type(e).__name__,str(e)])
+                except OSError:
+                    return
+
+    def finish(self):
+        self.server.zaber_stage_server._remove_session(self)
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn,socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver,'UnixStreamServer'):
+    class _ThreadingUnixStreamServer(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class ZaberStageServer(object):
+    '''
+    ZaberStageServer wraps a ZaberStage behind a binary RPC on a TCP or
+    Unix socket. Every client session shares the single serial
+    connection per port, identical queries that arrive concurrently are
+    answered by one shared serial transaction, and subscribers receive
+    pushed position updates.
+
+    Example Usage:
+
+    stage = ZaberStage(use_ports=['/dev/ttyUSB0'])
+    server = ZaberStageServer(stage,host='127.0.0.1',port=5590)
+    server.serve_forever()
+    # or, to listen on a Unix socket
+    server = ZaberStageServer(stage,unix_socket='/tmp/zaber_stage.sock')
+    '''
+    _SUBSCRIBE_PERIOD = 0.05
+
+    def __init__(self,stage,host=HOST,port=TCP_PORT,unix_socket=None):
+        self._stage = stage
+        if unix_socket is not None:
+            self._server = _ThreadingUnixStreamServer(unix_socket,_ZaberStageRequestHandler)
+        else:
+            self._server = _ThreadingTCPServer((host,port),_ZaberStageRequestHandler)
+        self._server.zaber_stage_server = self
+        self._sessions = set()
+        self._subscribers = {}
+        self._sessions_lock = threading.Lock()
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+        self._call_count = 0
+        self._shared_call_count = 0
+        self._server_thread = None
+        self._subscriber_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._publish_thread = threading.Thread(target=self._publish_positions,name='ZaberStageServerPublisher')
+        self._publish_thread.daemon = True
+        self._publish_thread.start()
+
+    def get_address(self):
+        '''
+        Returns the address the server is listening on.
+        '''
+        return self._server.server_address
+
+    def _add_session(self,session):
+        with self._sessions_lock:
+            self._sessions.add(session)
+
+    def _remove_session(self,session):
+        with self._sessions_lock:
+            self._sessions.discard(session)
+            self._subscribers.pop(session,None)
+
+    def _subscribe(self,session,period):
+        if period is None:
+            period = self._SUBSCRIBE_PERIOD
+        with self._sessions_lock:
+            self._subscribers[session] = float(period)
+        self._subscriber_event.set()
+
+    def _unsubscribe(self,session):
+        with self._sessions_lock:
+            self._subscribers.pop(session,None)
+
+    def _is_query(self,method):
+        return method.startswith('get_') or (method in ('moving','homed'))
+
+    def call(self,method,args,kwargs):
+        '''
+        Calls a public ZaberStage method. Concurrent identical queries
+        share a single call.
+        '''
+        if method.startswith('_'):
+            raise ZaberError('{0} is not a public method'.format(method))
+        function = getattr(self._stage,method)
+        self._call_count += 1
+        if not self._is_query(method):
+            return function(*args,**kwargs)
+        key = (method,bytes(encode([args,kwargs])))
+        with self._calls_lock:
+            shared_call = self._calls.get(key)
+            leader = shared_call is None
+            if leader:
+                shared_call = _SharedCall()
+                self._calls[key] = shared_call
+            else:
+                self._shared_call_count += 1
+        if leader:
+            try:
+                shared_call.result = function(*args,**kwargs)
+            except Exception as e:
+                shared_call.error = e
+            finally:
+                with self._calls_lock:
+                    del self._calls[key]
+                shared_call.event.set()
+        else:
+            shared_call.event.wait()
+        if shared_call.error is not None:
+            raise shared_call.error
+        return shared_call.result
+
+    def _publish_positions(self):
+        t_sent = {}
+        while not self._stop_event.is_set():
+            with self._sessions_lock:
+                subscribers = dict(self._subscribers)
+            if not subscribers:
+                self._subscriber_event.wait(self._SUBSCRIBE_PERIOD)
+                self._subscriber_event.clear()
+                continue
+            t_now = time.monotonic()
+            due = [s for s in subscribers if (t_now - t_sent.get(s,0)) >= subscribers[s]]
+            if due:
+                try:
+                    positions = self.call('get_positions',[],{})
+                except Exception:
+                    positions = None
+                if positions is not None:
+                    update = [time.time(),positions]
+                    for session in due:
+                        t_sent[session] = t_now
+                        try:
+                            session.send(MESSAGE_UPDATE,0,update)
+                        except OSError:
+                            self._unsubscribe(session)
+            period_min = min(subscribers.values())
+            self._stop_event.wait(max(0.0,period_min - (time.monotonic() - t_now)))
+
+    def get_stats(self):
+        '''
+        Returns session, subscriber and call counts. shared_call_count
+        counts queries answered by another client's serial transaction.
+        '''
+        with self._sessions_lock:
+            session_count = len(self._sessions)
+            subscriber_count = len(self._subscribers)
+        return {'session_count': session_count,
+                'subscriber_count': subscriber_count,
+                'call_count': self._call_count,
+                'shared_call_count': self._shared_call_count}
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        '''
+        Serves clients on a background thread.
+        '''
+        self._server_thread = threading.Thread(target=self._server.serve_forever,name='ZaberStageServer')
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        self._subscriber_event.set()
+        self._server.shutdown()
+        self._server.server_close()
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ZaberStageClient(object):
+    '''
+    ZaberStageClient connects to a ZaberStageServer and mirrors the
+    ZaberStage API. A single connection is shared by every thread in
+    the client, with replies matched to requests by id.
+
+    Example Usage:
+
+    stage = ZaberStageClient(host='127.0.0.1',port=5590)
+    stage.move_x_absolute(50)
+    stage.get_positions()
+    [49.99980078125, 0.0, 0.0]
+    stage.subscribe(print,period=0.1)
+    '''
+    _TIMEOUT = 10.0
+
+    def __init__(self,host=HOST,port=TCP_PORT,unix_socket=None,timeout=None):
+        if unix_socket is not None:
+            self._socket = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            self._socket.connect(unix_socket)
+        else:
+            self._socket = socket.create_connection((host,port))
+            self._socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        if timeout is None:
+            timeout = self._TIMEOUT
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._request_id = 0
+        self._subscriber = None
+        self._closed = False
+        self._reader_thread = threading.Thread(target=self._read_messages,name='ZaberStageClient')
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+
+    def _read_messages(self):
+        while True:
+            try:
+                message = recv_message(self._socket)
+            except (OSError,ZaberError):
+                message = None
+            if message is None:
+                break
+            message_type,request_id,body = message
+            if message_type == MESSAGE_UPDATE:
+                subscriber = self._subscriber
+                if subscriber is not None:
+                    try:
+                        subscriber(*body)
+                    except Exception:
+                        # a failing callback must not stop the replies to pending calls
+                        pass
+                continue
+            with self._pending_lock:
+                pending = self._pending.pop(request_id,None)
+            if pending is not None:
+                pending.result = (message_type,body)
+                pending.event.set()
+        self._closed = True
+        with self._pending_lock:
+            pendings = list(self._pending.values())
+            self._pending.clear()
+        for pending in pendings:
+            pending.event.set()
+
+    def _request(self,message_type,body):
+        if self._closed:
+            raise ZaberError('connection to server closed')
+        pending = _SharedCall()
+        with self._pending_lock:
+            self._request_id = (self._request_id % 0xFFFFFFFF) + 1
+            request_id = self._request_id
+            self._pending[request_id] = pending
+        message = pack_message(message_type,request_id,body)
+        with self._send_lock:
+            self._socket.sendall(message)
+        if not pending.event.wait(self._timeout):
+            with self._pending_lock:
+                self._pending.pop(request_id,None)
+            raise ZaberError('server did not reply within {0} s'.format(self._timeout))
+        if pending.result is None:
+            raise ZaberError('connection to server closed')
+        reply_type,reply_body = pending.result
+        if reply_type == MESSAGE_ERROR:
+            raise ZaberError('{0}: {1}'.format(*reply_body))
+        return reply_body
+
+    def call(self,method,*args,**kwargs):
+        '''
+        Calls a ZaberStage method on the server.
+        '''
+        return self._request(MESSAGE_REQUEST,[method,list(args),kwargs])
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def remote_method(*args,**kwargs):
+            return self.call(name,*args,**kwargs)
+        remote_method.__name__ = name
+        return remote_method
+
+    def subscribe(self,callback,period=None):
+        '''
+        Calls callback(timestamp, positions) for every position update
+        pushed by the server.
+        '''
+        self._subscriber = callback
+        self._request(MESSAGE_SUBSCRIBE,period)
+
+    def unsubscribe(self):
+        self._request(MESSAGE_UNSUBSCRIBE,None)
+        self._subscriber = None
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a ZaberStage to local clients.')
+    parser.add_argument('--use-ports',nargs='+',default=None,help='serial ports to use, found automatically if omitted')
+    parser.add_argument('--host',default=HOST,help='address to listen on')
+    parser.add_argument('--port',type=int,default=TCP_PORT,help='TCP port to listen on')
+    parser.add_argument('--unix-socket',default=None,help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--debug',action='store_true')
+    args = parser.parse_args(argv)
+    kwargs = {'debug': args.debug}
+    if args.use_ports is not None:
+        kwargs['use_ports'] = args.use_ports
+    stage = ZaberStage(**kwargs)
+    server = ZaberStageServer(stage,host=args.host,port=args.port,unix_socket=args.unix_socket)
+    print('Serving ZaberStage on {0}'.format(server.get_address()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
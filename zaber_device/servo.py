@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+'''
+Holds ZaberStage axes on moving targets with a fixed-rate PID loop on its
+own thread.
+'''
+import threading
+import time
+
+from .zaber_device import ZaberError
+
+
+MODE_SPEED = 'speed'
+MODE_POSITION = 'position'
+TICK_HISTORY = 1000
+MAX_CONSECUTIVE_ERRORS = 10
+
+
+class ZaberReaderFeedback(object):
+    '''
+    ZaberReaderFeedback is a servo feedback callable that returns the
+    positions of stage axes from the snapshots of a ZaberPositionReader,
+    so a servo reads positions published by another process instead of
+    querying the chain. Microstep positions are converted to stage units
+    by the stage, with its calibration tables.
+
+    Example Usage:
+
+    reader = ZaberPositionReader('zaber_positions')
+    servo = stage.start_servo(axes=('x','y'),feedback=ZaberReaderFeedback(stage,reader,('x','y')))
+    '''
+    def __init__(self,stage,reader,axes):
+        self._stage = stage
+        self._reader = reader
+        axes_info = stage.get_axes_info()
+        # (serial number,actuator): axis
+        self._axes = {}
+        for axis in axes:
+            if axis not in axes_info:
+                raise ZaberError('axis {0} is not set'.format(axis))
+            info = axes_info[axis]
+            self._axes[(info['serial_number'],info['actuator'])] = axis
+
+    def __call__(self):
+        positions = {}
+        for serial_number,actuator,moving,position_microstep,position,timestamp in self._reader.read():
+            axis = self._axes.get((serial_number,actuator))
+            if axis is not None:
+                positions[axis] = self._stage.microsteps_to_positions(axis,position_microstep)
+        if len(positions) < len(self._axes):
+            missing = sorted(set(self._axes.values()) - set(positions))
+            raise ZaberError('axes {0} are not published'.format(missing))
+        return positions
+
+
+class ZaberServo(object):
+    '''
+    ZaberServo runs a control loop at a fixed rate on its own thread.
+    Each tick reads the positions of its axes, one query per device or
+    from the feedback callable, compares them with the targets and sends
+    corrections without waiting for replies. In 'speed' mode each axis
+    gets move_at_speed with the target velocity times feed_forward plus
+    a PID correction of the position error, limited to max_speed. In
+    'position' mode move_absolute is sent whenever the target moves by
+    more than deadband. Targets are given with set_target or produced
+    every tick by a target function of the time since start. feedback
+    is a callable returning a dictionary with axis names as keys and
+    positions in stage units as values, or a ZaberPositionReader, which
+    is wrapped in a ZaberReaderFeedback.
+
+    Ticks are scheduled on fixed deadlines. Jitter is how late a tick
+    started, and a tick that runs past the next deadline is a miss, in
+    which case the loop skips ahead rather than bursting to catch up.
+    A tick that raises is counted as an error, and after ten failed
+    ticks in a row the loop stops the axes and ends, after which
+    is_running returns False and get_last_error returns the exception.
+
+    Example Usage:
+
+    servo = stage.start_servo(axes=('x','y'),rate=50,kp=2.0,ki=0.5)
+    servo.set_target({'x': 10.0, 'y': 5.0},velocities={'x': 0.2})
+    servo.get_errors()
+    {'x': 0.0012, 'y': -0.0004}
+    servo.get_stats()
+    {'ticks': 500, 'rate': 49.98, 'misses': 0, 'errors': 0, 'jitter_mean': 0.00021, 'jitter_max': 0.0011, 'jitter_p95': 0.0006, 'loop_time_mean': 0.0049, 'loop_time_max': 0.0071}
+    servo.stop()
+    '''
+    def __init__(self,stage,axes=('x',),rate=50.0,kp=1.0,ki=0.0,kd=0.0,feed_forward=1.0,
+                 max_speed=None,deadband=0.0,mode=MODE_SPEED,feedback=None):
+        if rate <= 0:
+            raise ZaberError('rate must be > 0')
+        if mode not in (MODE_SPEED,MODE_POSITION):
+            raise ZaberError('mode must be {0} or {1}'.format(MODE_SPEED,MODE_POSITION))
+        if isinstance(axes,str):
+            axes = [axes]
+        self._stage = stage
+        self._axes = tuple(axes)
+        set_axes = [axis for axis,ax in stage._set_axes(self._axes)]
+        for axis in self._axes:
+            if axis not in set_axes:
+                raise ZaberError('axis {0} is not set'.format(axis))
+        self._period = 1.0/rate
+        self._kp = kp
+        self._ki = ki
+        self._kd = kd
+        self._feed_forward = feed_forward
+        self._max_speed = max_speed
+        self._deadband = deadband
+        self._mode = mode
+        if feedback is None:
+            feedback = self._read_positions
+        elif (not callable(feedback)) and hasattr(feedback,'read'):
+            feedback = ZaberReaderFeedback(stage,feedback,self._axes)
+        self._feedback = feedback
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._targets = {}
+        self._velocities = {}
+        self._target_function = None
+        self._time_start = None
+        self._last_error = None
+        self._reset_control()
+        self.reset_stats()
+
+    def _reset_control(self):
+        self._integrals = dict((axis,0.0) for axis in self._axes)
+        self._last_positions = {}
+        self._errors = {}
+        self._sent = {}
+
+    def _read_positions(self):
+        return self._stage.get_axis_positions(self._axes)
+
+    def set_gains(self,kp=None,ki=None,kd=None,feed_forward=None):
+        '''
+        Sets the PID gains and feed-forward factor. None leaves a value
+        unchanged.
+        '''
+        with self._lock:
+            if kp is not None:
+                self._kp = kp
+            if ki is not None:
+                self._ki = ki
+            if kd is not None:
+                self._kd = kd
+            if feed_forward is not None:
+                self._feed_forward = feed_forward
+
+    def get_gains(self):
+        return {'kp': self._kp,'ki': self._ki,'kd': self._kd,'feed_forward': self._feed_forward}
+
+    def set_target(self,positions,velocities=None):
+        '''
+        Sets the target of each axis in positions, a dictionary with axis
+        names as keys, in stage units, and optionally the target velocity
+        in stage units per second used as feed-forward.
+        '''
+        with self._lock:
+            for axis in positions:
+                if axis not in self._axes:
+                    raise ZaberError('axis {0} is not servoed'.format(axis))
+                self._targets[axis] = float(positions[axis])
+            if velocities is not None:
+                for axis in velocities:
+                    self._velocities[axis] = float(velocities[axis])
+
+    def set_target_function(self,function=None):
+        '''
+        Calls function(t) every tick, with t the seconds since start, to
+        get a (positions,velocities) pair of dictionaries, for tracking a
+        known trajectory. None goes back to set_target.
+        '''
+        with self._lock:
+            self._target_function = function
+
+    def get_targets(self):
+        with self._lock:
+            return dict(self._targets)
+
+    def get_errors(self):
+        '''
+        Returns the last position error, target minus position, of each
+        axis in stage units.
+        '''
+        with self._lock:
+            return dict(self._errors)
+
+    def _limit(self,speed):
+        if self._max_speed is None:
+            return speed
+        return max(-self._max_speed,min(self._max_speed,speed))
+
+    def _control(self,positions,targets,velocities,dt):
+        '''
+        Returns the commands of one tick as a dictionary with axis names
+        as keys.
+        '''
+        commands = {}
+        for axis in self._axes:
+            if (axis not in targets) or (axis not in positions):
+                continue
+            position = positions[axis]
+            target = targets[axis]
+            error = target - position
+            self._errors[axis] = error
+            if self._mode == MODE_POSITION:
+                if (axis not in self._sent) or (abs(target - self._sent[axis]) > self._deadband):
+                    commands[axis] = target
+                continue
+            velocity = velocities.get(axis,0.0)
+            if (abs(error) <= self._deadband) and (velocity == 0):
+                self._integrals[axis] = 0.0
+                speed = 0.0
+            else:
+                integral = self._integrals[axis] + error*dt
+                derivative = 0.0
+                if (axis in self._last_positions) and (dt > 0):
+                    # on the measurement so target steps do not kick
+                    derivative = -(position - self._last_positions[axis])/dt
+                speed = self._feed_forward*velocity + self._kp*error + self._ki*integral + self._kd*derivative
+                limited = self._limit(speed)
+                # only integrate while the output is not saturated
+                if limited == speed:
+                    self._integrals[axis] = integral
+                speed = limited
+            self._last_positions[axis] = position
+            if self._sent.get(axis) != speed:
+                commands[axis] = speed
+        return commands
+
+    def _send(self,commands):
+        if not commands:
+            return
+        if self._mode == MODE_POSITION:
+            self._stage.move_absolute(commands)
+        else:
+            stops = [axis for axis in commands if commands[axis] == 0]
+            speeds = dict((axis,commands[axis]) for axis in commands if commands[axis] != 0)
+            if stops:
+                self._stage.stop_axes(stops)
+            if speeds:
+                self._stage.move_at_speed(speeds)
+        self._sent.update(commands)
+
+    def _tick(self,time_tick,dt):
+        with self._lock:
+            target_function = self._target_function
+        if target_function is not None:
+            positions,velocities = target_function(time_tick - self._time_start)
+            self.set_target(positions,velocities)
+        positions = self._feedback()
+        with self._lock:
+            commands = self._control(positions,dict(self._targets),dict(self._velocities),dt)
+        self._send(commands)
+
+    def _run(self):
+        time_deadline = time.monotonic()
+        time_last = None
+        consecutive_errors = 0
+        while True:
+            timeout = time_deadline - time.monotonic()
+            if self._stop_event.wait(max(timeout,0)):
+                break
+            time_tick = time.monotonic()
+            dt = self._period if time_last is None else time_tick - time_last
+            time_last = time_tick
+            try:
+                self._tick(time_tick,dt)
+                consecutive_errors = 0
+            except Exception as e:
+                consecutive_errors += 1
+                with self._lock:
+                    self._error_count += 1
+                    self._last_error = e
+                if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                    self._fail()
+                    break
+            time_done = time.monotonic()
+            self._record(time_tick - time_deadline,time_done - time_tick)
+            time_deadline += self._period
+            if time_done > time_deadline:
+                # skip the deadlines already missed
+                missed = int((time_done - time_deadline)/self._period) + 1
+                self._miss_count += missed
+                time_deadline += missed*self._period
+
+    def _fail(self):
+        '''
+        Stops the axes after the loop gave up, so they do not keep moving
+        at the last commanded speed.
+        '''
+        try:
+            self._stage.stop_axes(self._axes)
+        except Exception:
+            pass
+        with self._lock:
+            self._sent = {}
+
+    def _record(self,jitter,loop_time):
+        with self._lock:
+            self._tick_count += 1
+            self._tick_times.append(time.monotonic())
+            self._jitters.append(jitter)
+            self._loop_times.append(loop_time)
+            if len(self._jitters) > TICK_HISTORY:
+                del self._tick_times[0]
+                del self._jitters[0]
+                del self._loop_times[0]
+
+    def start(self):
+        '''
+        Starts the control loop. Axes without a target are held where
+        they are.
+        '''
+        if self.is_running():
+            return
+        self._thread = None
+        positions = self._feedback()
+        with self._lock:
+            for axis in self._axes:
+                if (axis not in self._targets) and (axis in positions):
+                    self._targets[axis] = positions[axis]
+            self._reset_control()
+        self._time_start = time.monotonic()
+        self._last_error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,name='ZaberServo')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self,stop_axes=True):
+        '''
+        Stops the control loop and, unless stop_axes is False, the axes.
+        '''
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        if stop_axes:
+            self._stage.stop_axes(self._axes)
+        with self._lock:
+            self._sent = {}
+
+    def is_running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def get_last_error(self):
+        '''
+        Returns the exception raised by the last failed tick, or None.
+        '''
+        with self._lock:
+            return self._last_error
+
+    def get_stats(self):
+        '''
+        Returns the tick, deadline miss and error counts, the loop rate in
+        ticks per second and the mean, maximum and 95th percentile jitter
+        and the mean and maximum loop time in seconds over the last 1000
+        ticks.
+        '''
+        with self._lock:
+            tick_times = list(self._tick_times)
+            jitters = sorted(self._jitters)
+            loop_times = list(self._loop_times)
+            stats = {'ticks': self._tick_count,
+                     'rate': None,
+                     'misses': self._miss_count,
+                     'errors': self._error_count,
+                     'jitter_mean': None,
+                     'jitter_max': None,
+                     'jitter_p95': None,
+                     'loop_time_mean': None,
+                     'loop_time_max': None}
+        if len(tick_times) > 1:
+            stats['rate'] = (len(tick_times) - 1)/(tick_times[-1] - tick_times[0])
+        if jitters:
+            stats['jitter_mean'] = sum(jitters)/len(jitters)
+            stats['jitter_max'] = jitters[-1]
+            stats['jitter_p95'] = jitters[min(int(0.95*len(jitters)),len(jitters)-1)]
+            stats['loop_time_mean'] = sum(loop_times)/len(loop_times)
+            stats['loop_time_max'] = max(loop_times)
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._tick_count = 0
+            self._miss_count = 0
+            self._error_count = 0
+            self._tick_times = []
+            self._jitters = []
+            self._loop_times = []
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+'''
+Emulates a chain of Zaber actuators speaking the binary protocol behind
+the subset of the serial port interface ZaberDevice uses, so code can be
+exercised without hardware.
+'''
+import heapq
+import struct
+import threading
+import time
+
+from .kinematics import move_time, SPEED_UNIT, ACCELERATION_UNIT
+
+
+FRAME_STRUCT = struct.Struct('<BBl')
+FRAME_LENGTH = FRAME_STRUCT.size
+BITS_PER_BYTE = 10
+ERROR_COMMAND = 255
+ERROR_INVALID_COMMAND = 64
+SETTING_COMMANDS = (37,38,39,40,41,42,43,47,48)
+DEFAULT_SETTINGS = {37: 64,
+                    38: 10,
+                    39: 127,
+                    40: 0,
+                    41: 2000,
+                    42: 2000,
+                    43: 100,
+                    47: 0,
+                    48: 0}
+HOMED_BIT = 7
+
+
+class _SimulatedActuator(object):
+
+    def __init__(self,number,actuator_id,travel):
+        self.number = number
+        self.actuator_id = actuator_id
+        self.travel = travel
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.memory = {}
+        self.stored = {}
+        self.position = 0
+        self.motion = None
+        self.completions = []
+
+    def _speeds(self,command):
+        scale = self.settings[37]/64.0
+        if command == 1:
+            speed = self.settings[41]*SPEED_UNIT*scale
+        else:
+            speed = self.settings[42]*SPEED_UNIT*scale
+        acceleration = max(self.settings[43],1)*ACCELERATION_UNIT*scale
+        return max(speed,1.0),acceleration
+
+    def position_at(self,t):
+        '''
+        Returns the position at time t along the current motion.
+        '''
+        if self.motion is None:
+            return self.position
+        command,t_start,t_end,start,target,speed = self.motion
+        if command == 22:
+            position = start + speed*(t - t_start)
+            return int(min(max(position,0),self.travel))
+        if t >= t_end:
+            return target
+        max_speed,acceleration = self._speeds(command)
+        distance = abs(target - start)
+        elapsed = t - t_start
+        t_ramp = min(max_speed/acceleration,(t_end - t_start)/2.0)
+        peak_speed = acceleration*t_ramp
+        if elapsed < t_ramp:
+            covered = 0.5*acceleration*elapsed*elapsed
+        elif elapsed < (t_end - t_start) - t_ramp:
+            covered = 0.5*acceleration*t_ramp*t_ramp + peak_speed*(elapsed - t_ramp)
+        else:
+            remaining = (t_end - t_start) - elapsed
+            covered = distance - 0.5*acceleration*remaining*remaining
+        covered = min(max(covered,0),distance)
+        if target < start:
+            covered = -covered
+        return int(start + covered)
+
+    def status(self,t):
+        self.update(t)
+        if self.motion is None:
+            return 0
+        return self.motion[0]
+
+    def update(self,t):
+        '''
+        Finishes the current motion if it has ended by time t.
+        '''
+        if (self.motion is None) or (self.motion[0] == 22) or (t < self.motion[2]):
+            return
+        command,t_start,t_end,start,target,speed = self.motion
+        self.position = target
+        self.motion = None
+        if command == 1:
+            self.settings[40] |= 1 << HOMED_BIT
+        self.completions.append((t_end,command,target))
+
+    def _interrupt(self,t):
+        self.update(t)
+        if self.motion is not None:
+            self.position = self.position_at(t)
+            if self.motion[0] != 22:
+                # an interrupted move replies with where it stopped
+                self.completions.append((t,self.motion[0],self.position))
+            self.motion = None
+
+    def start_motion(self,command,target,t,speed=None):
+        self._interrupt(t)
+        start = self.position
+        if command == 22:
+            self.motion = (22,t,None,start,None,speed*SPEED_UNIT*self.settings[37]/64.0)
+            return
+        target = int(min(max(target,0),self.travel))
+        max_speed,acceleration = self._speeds(command)
+        duration = move_time(abs(target - start),max_speed,acceleration)
+        self.motion = (command,t,t + duration,start,target,None)
+
+    def stop(self,t):
+        self._interrupt(t)
+
+
+class ZaberSimulator(object):
+    '''
+    ZaberSimulator stands in for the serial port of a ZaberDevice and
+    emulates a daisy chain of actuators. Replies are delayed by their
+    transmission time at the chain baudrate, moves follow trapezoidal
+    profiles from the speed and acceleration settings and reply when
+    they complete, return setting replies carry the setting number, and
+    requests sent at a baudrate other than the chain baudrate are lost.
+    aliases optionally gives the alias of each actuator, None for none.
+    It is thread safe.
+
+    Example Usage:
+
+    from zaber_device import ZaberDevice
+    from zaber_device.simulator import ZaberSimulator
+    dev = ZaberDevice(serial_interface=ZaberSimulator(actuator_count=2))
+    dev.move_absolute(10000)
+    dev.wait_until_idle()
+    dev.get_position()
+    [10000, 10000]
+    '''
+    def __init__(self,actuator_count=2,serial_number=0,baudrate=9600,timeout=0.05,
+                 actuator_id=4042,travel=100000000,port='simulator',aliases=None):
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+        self._baudrate = baudrate
+        self._chain_baudrate = baudrate
+        self._condition = threading.Condition()
+        self._input = bytearray()
+        self._pending_input = []
+        self._pending_count = 0
+        self._request = bytearray()
+        self._actuators = [_SimulatedActuator(number+1,actuator_id,travel) for number in range(actuator_count)]
+        for actuator in self._actuators:
+            actuator.memory[123] = serial_number
+        if aliases is not None:
+            for actuator,alias in zip(self._actuators,aliases):
+                if alias is not None:
+                    # the alias setting holds the device number, one more than the alias
+                    actuator.settings[48] = alias + 1
+        self.request_count = 0
+        self.reply_count = 0
+
+    def _get_baudrate(self):
+        return self._baudrate
+
+    def _set_baudrate(self,baudrate):
+        self._baudrate = int(baudrate)
+
+    baudrate = property(_get_baudrate,_set_baudrate)
+
+    def get_actuator(self,index):
+        '''
+        Returns the simulated state of the actuator at chain position index.
+        '''
+        return self._actuators[index]
+
+    def set_chain_baudrate(self,baudrate):
+        self._chain_baudrate = int(baudrate)
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def _check_open(self):
+        if not self.is_open:
+            raise OSError('simulated port is closed')
+
+    def _frame_time(self,frames=1):
+        return frames*FRAME_LENGTH*BITS_PER_BYTE/float(self._chain_baudrate)
+
+    def _schedule(self,t,number,command,data):
+        heapq.heappush(self._pending_input,(t,self._pending_count,FRAME_STRUCT.pack(number,command,data)))
+        self._pending_count += 1
+
+    def _deliver(self,t):
+        '''
+        Moves replies due by time t into the input buffer and returns the
+        time the next reply is due, or None.
+        '''
+        for actuator in self._actuators:
+            actuator.update(t)
+            for t_end,command,data in actuator.completions:
+                self._schedule(t_end + self._frame_time(),actuator.number,command,data)
+            del actuator.completions[:]
+        while self._pending_input and (self._pending_input[0][0] <= t):
+            t_due,count,frame = heapq.heappop(self._pending_input)
+            self._input += frame
+            self.reply_count += 1
+        times = [motion_actuator.motion[2] for motion_actuator in self._actuators
+                 if (motion_actuator.motion is not None) and (motion_actuator.motion[2] is not None)]
+        if self._pending_input:
+            times.append(self._pending_input[0][0])
+        if times:
+            return min(times)
+        return None
+
+    def _addressed(self,number):
+        actuators = []
+        for actuator in self._actuators:
+            alias = actuator.settings[48]
+            if (number == 0) or (number == actuator.number) or ((alias != 0) and (number == alias)):
+                actuators.append(actuator)
+        return actuators
+
+    def _reply(self,actuator,command,data,t):
+        '''
+        Returns the immediate reply of actuator to a request as (command,
+        data), or None if the reply comes when a move ends or never.
+        '''
+        if command == 0:
+            actuator.stop(t)
+            actuator.position = 0
+            return None
+        if command in (1,18,20,21):
+            if command == 1:
+                target = 0
+            elif command == 18:
+                target = actuator.stored.get(data,0)
+            elif command == 20:
+                target = data
+            else:
+                actuator.update(t)
+                if actuator.motion is not None:
+                    target = actuator.motion[4] + data
+                else:
+                    target = actuator.position + data
+            actuator.start_motion(command,target,t)
+            return None
+        if command == 2:
+            return (2,actuator.number)
+        if command == 16:
+            actuator.stored[data] = actuator.position_at(t)
+            return (16,data)
+        if command == 17:
+            return (17,actuator.stored.get(data,0))
+        if command == 22:
+            actuator.start_motion(22,None,t,data)
+            return (22,data)
+        if command == 23:
+            actuator.stop(t)
+            return (23,actuator.position)
+        if command == 35:
+            address = data & 0x7f
+            if data & (1 << 7):
+                actuator.memory[address] = data >> 8
+            return (35,(actuator.memory.get(address,0) << 8) + address)
+        if command == 36:
+            actuator.settings = dict(DEFAULT_SETTINGS)
+            return (36,0)
+        if command in SETTING_COMMANDS:
+            actuator.settings[command] = data
+            return (command,data)
+        if command == 50:
+            return (50,actuator.actuator_id)
+        if command == 53:
+            if data not in actuator.settings:
+                return (ERROR_COMMAND,53)
+            return (data,actuator.settings[data])
+        if command == 54:
+            return (54,actuator.status(t))
+        if command == 55:
+            return (55,data)
+        if command == 60:
+            return (60,actuator.position_at(t))
+        if command == 122:
+            return (122,data)
+        return (ERROR_COMMAND,ERROR_INVALID_COMMAND)
+
+    def _handle(self,frame,t):
+        number,command,data = FRAME_STRUCT.unpack(frame)
+        self.request_count += 1
+        actuators = self._addressed(number)
+        if command == 2:
+            for index,actuator in enumerate(self._actuators):
+                actuator.number = index + 1
+        t_reply = t + self._frame_time()
+        for actuator in actuators:
+            reply = self._reply(actuator,command,data,t)
+            if reply is None:
+                continue
+            reply_command,reply_data = reply
+            t_reply += self._frame_time()
+            self._schedule(t_reply,actuator.number,reply_command,reply_data)
+        if command == 122:
+            self._chain_baudrate = data
+
+    def write(self,data):
+        self._check_open()
+        with self._condition:
+            if self._baudrate != self._chain_baudrate:
+                # frames sent at the wrong baudrate are garbage to the chain
+                return len(data)
+            t = time.monotonic()
+            self._request += data
+            while len(self._request) >= FRAME_LENGTH:
+                frame = bytes(self._request[:FRAME_LENGTH])
+                del self._request[:FRAME_LENGTH]
+                self._handle(frame,t)
+            self._condition.notify_all()
+        return len(data)
+
+    def _wait_for_input(self,size,timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            t = time.monotonic()
+            t_next = self._deliver(t)
+            if (len(self._input) >= size) or (t >= deadline):
+                return
+            wait = deadline - t
+            if t_next is not None:
+                wait = min(wait,max(t_next - t,0))
+            self._condition.wait(wait)
+
+    def read(self,size=1):
+        self._check_open()
+        with self._condition:
+            self._wait_for_input(size,self.timeout)
+            data = bytes(self._input[:size])
+            del self._input[:size]
+        if self._baudrate != self._chain_baudrate:
+            return b''
+        return data
+
+    def readinto(self,buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _get_in_waiting(self):
+        with self._condition:
+            self._deliver(time.monotonic())
+            return len(self._input)
+
+    in_waiting = property(_get_in_waiting)
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._deliver(time.monotonic())
+            del self._input[:]
+
+    def reset_output_buffer(self):
+        pass
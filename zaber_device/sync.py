@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+'''
+Starts moves on several serial ports at the same instant and measures
+how far apart the writes actually left the host.
+'''
+import threading
+
+from .zaber_device import ZaberError
+
+
+SKEW_LIMIT = 0.001
+SKEW_HISTORY = 1000
+
+
+class ZaberSyncDispatcher(object):
+    '''
+    ZaberSyncDispatcher encodes every request up front, concatenating the
+    requests for one port into a single write, and hands each port to
+    its own thread. Each thread takes the write lock of its port and
+    waits for the write throttle, then all threads are released together
+    from a shared barrier. The skew of a dispatch is the spread of the
+    host write start times over the ports.
+
+    Example Usage:
+
+    dispatcher = ZaberSyncDispatcher()
+    dispatcher.dispatch([(dev_x,20,10,50000),(dev_y,20,11,50000)])
+    0.00011
+    dispatcher.get_metrics()
+    {'dispatches': 1, 'skew_last': 0.00011, 'skew_mean': 0.00011, 'skew_max': 0.00011, 'skew_p95': 0.00011, 'over_limit': 0}
+    '''
+    _TIMEOUT = 1.0
+
+    def __init__(self,timeout=None,skew_limit=SKEW_LIMIT):
+        if timeout is None:
+            timeout = self._TIMEOUT
+        self._timeout = timeout
+        self._skew_limit = skew_limit
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def _encode(self,requests):
+        '''
+        Returns a list of (dev,request bytes) with one entry per device.
+        '''
+        encoded = []
+        for dev,command,actuator,data in requests:
+            number = dev._actuator_to_number(actuator)
+            request = dev._args_to_request_bytes(number,command,data)
+            for entry in encoded:
+                if entry[0] is dev:
+                    entry[1] += request
+                    break
+            else:
+                encoded.append([dev,request])
+        return encoded
+
+    def dispatch(self,requests):
+        '''
+        Writes requests, a list of (dev,command,actuator,data) tuples, so
+        that the writes to all ports start together. Returns the skew in
+        seconds, which is 0 when every request goes to one port.
+        '''
+        encoded = self._encode(requests)
+        if not encoded:
+            return None
+        with self._lock:
+            barrier = threading.Barrier(len(encoded))
+            times = [None]*len(encoded)
+            errors = []
+            def write(index,dev,request):
+                try:
+                    times[index] = dev._write_at_barrier(request,barrier,self._timeout)
+                except threading.BrokenBarrierError:
+                    errors.append(ZaberError('synchronized dispatch timed out'))
+                except Exception as e:
+                    barrier.abort()
+                    errors.append(e)
+            threads = []
+            for index,(dev,request) in enumerate(encoded[1:],1):
+                thread = threading.Thread(target=write,args=(index,dev,request))
+                thread.start()
+                threads.append(thread)
+            write(0,encoded[0][0],encoded[0][1])
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+            time_writes = [time_write for time_write,time_written in times]
+            skew = max(time_writes) - min(time_writes)
+            self._record(skew)
+        return skew
+
+    def _record(self,skew):
+        self._dispatch_count += 1
+        self._skews.append(skew)
+        if len(self._skews) > SKEW_HISTORY:
+            del self._skews[0]
+        if skew > self._skew_limit:
+            self._over_limit_count += 1
+
+    def get_metrics(self):
+        '''
+        Returns the number of dispatches, the last, mean, maximum and 95th
+        percentile skew in seconds over the last 1000 dispatches, and
+        how many dispatches exceeded the skew limit.
+        '''
+        with self._lock:
+            skews = list(self._skews)
+            metrics = {'dispatches': self._dispatch_count,
+                       'skew_last': None,
+                       'skew_mean': None,
+                       'skew_max': None,
+                       'skew_p95': None,
+                       'over_limit': self._over_limit_count}
+        if skews:
+            metrics['skew_last'] = skews[-1]
+            skews.sort()
+            metrics['skew_mean'] = sum(skews)/len(skews)
+            metrics['skew_max'] = skews[-1]
+            metrics['skew_p95'] = skews[min(int(0.95*len(skews)),len(skews)-1)]
+        return metrics
+
+    def reset_metrics(self):
+        self._dispatch_count = 0
+        self._over_limit_count = 0
+        self._skews = []
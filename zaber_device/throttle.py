@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+Spaces serial writes on one port by the time the chain needs to carry
+each request and its replies, instead of by a fixed delay.
+'''
+import time
+
+
+# start bit, 8 data bits and stop bit per byte
+BITS_PER_BYTE = 10
+FRAME_LENGTH = 6
+
+
+def frame_time(baudrate,frames=1):
+    '''
+    Returns the seconds needed to transmit frames 6-byte frames at baudrate.
+    '''
+    return (frames*FRAME_LENGTH*BITS_PER_BYTE)/float(baudrate)
+
+
+class WriteThrottle(object):
+    '''
+    WriteThrottle decides when the next request may be written to one
+    port. By default the gap after a request is the transmission time of
+    the request and of every reply it causes at the current baudrate,
+    plus a guard time, and a reply read back from the chain (device
+    acknowledgment) releases the port immediately after the guard time.
+    A fixed delay restores the old constant spacing. An optional token
+    bucket caps the sustained command rate.
+    '''
+    _GUARD_TIME = 0.002
+
+    def __init__(self,fixed_delay=None,guard_time=None):
+        self._fixed_delay = fixed_delay
+        if guard_time is None:
+            guard_time = self._GUARD_TIME
+        self._guard_time = guard_time
+        self._time_next = 0.0
+        self._rate = None
+        self._burst = 1
+        self._tokens = 0.0
+        self._time_tokens = None
+        self._write_count = 0
+        self._wait_count = 0
+        self._wait_time = 0.0
+        self._time_first = None
+        self._time_last = None
+
+    def set_fixed_delay(self,fixed_delay):
+        '''
+        Uses a constant gap in seconds between writes, or the adaptive
+        gap when fixed_delay is None.
+        '''
+        self._fixed_delay = fixed_delay
+
+    def get_fixed_delay(self):
+        return self._fixed_delay
+
+    def set_rate_limit(self,rate=None,burst=1):
+        '''
+        Caps the sustained write rate at rate commands per second while
+        allowing bursts of up to burst commands. None removes the cap.
+        '''
+        if rate is not None:
+            rate = float(rate)
+        self._rate = rate
+        self._burst = max(int(burst),1)
+        self._tokens = float(self._burst)
+        self._time_tokens = None
+
+    def get_rate_limit(self):
+        return self._rate,self._burst
+
+    def _token_delay(self,time_now):
+        if self._rate is None:
+            return 0.0
+        if self._time_tokens is not None:
+            self._tokens = min(self._burst,self._tokens + (time_now - self._time_tokens)*self._rate)
+        self._time_tokens = time_now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens)/self._rate
+
+    def wait(self,baudrate,reply_frames=1):
+        '''
+        Sleeps until the next write is allowed, then reserves the port for
+        a request that causes reply_frames replies. Returns the time slept.
+        '''
+        time_now = time.monotonic()
+        delay = max(self._time_next - time_now,self._token_delay(time_now))
+        if delay > 0:
+            time.sleep(delay)
+            self._wait_count += 1
+            self._wait_time += delay
+            time_now = time.monotonic()
+            self._token_delay(time_now)
+        else:
+            delay = 0.0
+        if self._rate is not None:
+            self._tokens -= 1
+        if self._fixed_delay is not None:
+            self._time_next = time_now + self._fixed_delay
+        else:
+            self._time_next = time_now + frame_time(baudrate,1 + reply_frames) + self._guard_time
+        if self._time_first is None:
+            self._time_first = time_now
+        self._time_last = time_now
+        self._write_count += 1
+        return delay
+
+    def acknowledge(self):
+        '''
+        Releases the port after the guard time once the replies to the
+        last request have been read.
+        '''
+        if self._fixed_delay is None:
+            self._time_next = min(self._time_next,time.monotonic() + self._guard_time)
+
+    def get_metrics(self):
+        '''
+        Returns write count, how many writes waited and for how long in
+        total, and the mean write rate in commands per second.
+        '''
+        rate = None
+        if (self._write_count > 1) and (self._time_last > self._time_first):
+            rate = (self._write_count - 1)/(self._time_last - self._time_first)
+        return {'writes': self._write_count,
+                'waits': self._wait_count,
+                'wait_time': self._wait_time,
+                'write_rate': rate}
+
+    def reset_metrics(self):
+        self._write_count = 0
+        self._wait_count = 0
+        self._wait_time = 0.0
+        self._time_first = None
+        self._time_last = None
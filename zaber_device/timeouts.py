@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+'''
+Sets the read deadline of each kind of query on one port from the reply
+latencies observed on that port, instead of one fixed timeout.
+'''
+import collections
+
+
+class ReadTimeoutTuner(object):
+    '''
+    ReadTimeoutTuner keeps the latest reply latencies of every command
+    and expected reply count on one port and returns a read deadline of
+    a high percentile of those latencies plus a margin, clamped to hard
+    bounds and never shorter than the transmission time of the request
+    and its replies. The default timeout is used until enough replies
+    have been seen. The deadline is only the first wait: ZaberDevice
+    keeps reading a short read until the default timeout before it
+    fails. A read that ends the first wait with fewer replies than
+    expected doubles the deadline of its kind, up to eight times, and
+    the extra factor decays again with every complete read. Queries
+    whose reply count is unknown, which always wait the whole deadline
+    to count replies, are never given less than the default timeout.
+    '''
+    _PERCENTILE = 99
+    _MARGIN = 0.003
+    _MIN_TIMEOUT = 0.002
+    _MAX_TIMEOUT = 0.5
+    _MIN_SAMPLES = 20
+    _HISTORY = 200
+    _BACKOFF_MAX = 8.0
+    _BACKOFF_DECAY = 0.9
+    # recompute a percentile after this many new samples
+    _UPDATE_PERIOD = 10
+
+    def __init__(self,default_timeout,min_timeout=None,max_timeout=None,percentile=None,margin=None):
+        self._default_timeout = default_timeout
+        self._enabled = True
+        self._min_timeout = self._MIN_TIMEOUT
+        self._max_timeout = self._MAX_TIMEOUT
+        self._percentile = self._PERCENTILE
+        self._margin = self._MARGIN
+        self._kinds = {}
+        self.set_bounds(min_timeout,max_timeout)
+        self.set_policy(percentile,margin)
+
+    def get_default_timeout(self):
+        return self._default_timeout
+
+    def set_enabled(self,enabled):
+        self._enabled = bool(enabled)
+
+    def is_enabled(self):
+        return self._enabled
+
+    def set_bounds(self,min_timeout=None,max_timeout=None):
+        '''
+        Sets the shortest and longest read deadline in seconds. None
+        leaves a bound unchanged.
+        '''
+        if min_timeout is not None:
+            self._min_timeout = float(min_timeout)
+        if max_timeout is not None:
+            self._max_timeout = float(max_timeout)
+        self._invalidate()
+
+    def get_bounds(self):
+        return self._min_timeout,self._max_timeout
+
+    def set_policy(self,percentile=None,margin=None):
+        '''
+        Sets the latency percentile and the margin in seconds added to it.
+        None leaves a value unchanged.
+        '''
+        if percentile is not None:
+            self._percentile = float(percentile)
+        if margin is not None:
+            self._margin = float(margin)
+        self._invalidate()
+
+    def get_policy(self):
+        return self._percentile,self._margin
+
+    def _invalidate(self):
+        for kind in self._kinds.values():
+            kind['tuned'] = None
+
+    def _kind(self,command,reply_count):
+        key = (command,reply_count)
+        kind = self._kinds.get(key)
+        if kind is None:
+            kind = {'latencies': collections.deque(maxlen=self._HISTORY),
+                    'new_samples': 0,
+                    'tuned': None,
+                    'backoff': 1.0,
+                    'reads': 0,
+                    'misses': 0}
+            self._kinds[key] = kind
+        return kind
+
+    def _latency_percentile(self,latencies,percentile):
+        ordered = sorted(latencies)
+        index = int(round((percentile/100.0)*(len(ordered) - 1)))
+        return ordered[min(max(index,0),len(ordered) - 1)]
+
+    def _tuned(self,kind):
+        if len(kind['latencies']) < self._MIN_SAMPLES:
+            return None
+        if (kind['tuned'] is None) or (kind['new_samples'] >= self._UPDATE_PERIOD):
+            kind['tuned'] = self._latency_percentile(kind['latencies'],self._percentile) + self._margin
+            kind['new_samples'] = 0
+        return kind['tuned']
+
+    def get_timeout(self,command,reply_count,floor=0.0):
+        '''
+        Returns the read deadline in seconds for a query with command and
+        reply_count expected replies, None when unknown. floor is the
+        transmission time of the request and its replies.
+        '''
+        if not self._enabled:
+            return self._default_timeout
+        kind = self._kind(command,reply_count)
+        timeout = self._tuned(kind)
+        if timeout is None:
+            timeout = self._default_timeout
+        timeout *= kind['backoff']
+        if reply_count is None:
+            # a shorter wait would silently undercount slow or extra replies
+            timeout = max(timeout,self._default_timeout)
+        timeout = max(timeout,self._min_timeout,floor)
+        return min(timeout,max(self._max_timeout,floor))
+
+    def observe(self,command,reply_count,latency):
+        '''
+        Records the latency of a complete read.
+        '''
+        kind = self._kind(command,reply_count)
+        kind['latencies'].append(latency)
+        kind['new_samples'] += 1
+        kind['reads'] += 1
+        kind['backoff'] = max(1.0,kind['backoff']*self._BACKOFF_DECAY)
+
+    def observe_miss(self,command,reply_count):
+        '''
+        Records a read that ended before every expected reply arrived.
+        '''
+        kind = self._kind(command,reply_count)
+        kind['reads'] += 1
+        kind['misses'] += 1
+        kind['backoff'] = min(self._BACKOFF_MAX,kind['backoff']*2)
+
+    def observe_late(self,command,reply_count,latency):
+        '''
+        Records the latency of a read completed after its first deadline,
+        already counted as a miss, so the deadline learns from it.
+        '''
+        kind = self._kind(command,reply_count)
+        kind['latencies'].append(latency)
+        kind['new_samples'] += 1
+
+    def get_timeouts(self):
+        '''
+        Returns a dictionary with (command,reply count) keys and the
+        current deadline, sample count, median and percentile latency,
+        read count and miss count of each kind of query as values.
+        '''
+        timeouts = {}
+        for key in sorted(self._kinds,key=str):
+            kind = self._kinds[key]
+            latencies = kind['latencies']
+            median = None
+            high = None
+            if latencies:
+                median = self._latency_percentile(latencies,50)
+                high = self._latency_percentile(latencies,self._percentile)
+            timeouts[key] = {'timeout': self.get_timeout(key[0],key[1]),
+                             'samples': len(latencies),
+                             'median': median,
+                             'percentile': high,
+                             'reads': kind['reads'],
+                             'misses': kind['misses']}
+        return timeouts
+
+    def reset(self):
+        '''
+        Forgets every observed latency.
+        '''
+        self._kinds = {}
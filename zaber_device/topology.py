@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+'''
+Identifies the actuators on each chain and remaps actuator indices to
+device numbers in software, so reordered or hot-plugged actuators keep
+their actuator indices without a renumber broadcast.
+'''
+import json
+import os
+
+from .zaber_device import ZaberError, SERIAL_NUMBER_ADDRESS
+
+
+LAYOUT_VERSION = 1
+IDENTITY_KEYS = ('serial_number','actuator_id','alias')
+
+def _get_devs(devices):
+    try:
+        return devices._devs
+    except AttributeError:
+        pass
+    if isinstance(devices,dict):
+        return devices
+    return None
+
+def _identity(actuator):
+    return tuple(actuator[key] for key in IDENTITY_KEYS)
+
+
+class ZaberTopology(object):
+    '''
+    ZaberTopology identifies every actuator by serial number memory,
+    actuator id and alias in one probe round of three broadcast queries,
+    keeps a persistent mapping from actuator index to identity and, after
+    cables are swapped or actuators are added or removed, points each
+    actuator index back at the device number its actuator now answers to
+    using ZaberDevice.set_actuator_numbers. Actuators that share an
+    identity keep their relative order. Devices are never renumbered, so
+    aliases and stored positions stay valid.
+
+    devices is a ZaberDevice, ZaberDevices or ZaberStage. Mappings are
+    kept per serial number and saved as JSON to path when given.
+
+    Example Usage:
+
+    dev = ZaberDevice()
+    topology = ZaberTopology(dev,'topology.json')
+    topology.apply()
+    # after swapping cables
+    topology.apply()
+    {'actuator_numbers': [1, 0], 'moved': [(0, 0, 1), (1, 1, 0)], 'added': [], 'missing': []}
+    '''
+    def __init__(self,devices,path=None):
+        devs = _get_devs(devices)
+        if devs is None:
+            self._devs = {None: devices}
+        else:
+            self._devs = devs
+        self._path = path
+        self._mappings = {}
+        if (path is not None) and os.path.exists(path):
+            self.load(path)
+
+    def probe(self,dev):
+        '''
+        Returns one dictionary per actuator answering on dev, in device
+        number order, with its number (device number minus one),
+        serial_number, actuator_id and alias.
+        '''
+        replies = {}
+        for key,command,data in [('actuator_id',50,None),
+                                 ('alias',53,48),
+                                 ('serial_number',35,SERIAL_NUMBER_ADDRESS)]:
+            numbers = []
+            for number,cmd,value in dev._request_replies(command,None,data):
+                if number in numbers:
+                    raise ZaberError('device number {0} is used by more than one actuator, use renumber method to fix'.format(number+1))
+                numbers.append(number)
+                if key == 'alias':
+                    value = (value - 1) if value > 0 else None
+                elif key == 'serial_number':
+                    value = value >> 8
+                replies.setdefault(number,{'number': number})[key] = value
+        actuators = [replies[number] for number in sorted(replies)
+                     if all(key in replies[number] for key in IDENTITY_KEYS)]
+        return actuators
+
+    def _chain_key(self,key,actuators):
+        if key is not None:
+            return str(key)
+        serial_numbers = [actuator['serial_number'] for actuator in actuators]
+        if not serial_numbers:
+            raise ZaberError('no actuators answered')
+        return str(max(set(serial_numbers),key=serial_numbers.count))
+
+    def apply(self,allow_missing=False):
+        '''
+        Probes every chain, matches the actuators against the saved
+        mapping and sets the actuator numbers of each device. Actuators
+        not in the mapping are added after the known ones in chain
+        order. Raises ZaberError when a known actuator is missing unless
+        allow_missing is True, in which case it is dropped and the
+        actuator indices after it shift down. Returns a report per
+        device, or a single report for a ZaberDevice.
+        '''
+        reports = {}
+        for key in self._devs:
+            dev = self._devs[key]
+            actuators = self.probe(dev)
+            chain_key = self._chain_key(key,actuators)
+            known = self._mappings.get(chain_key,[])
+            unused = list(actuators)
+            mapping = []
+            moved = []
+            missing = []
+            for index,entry in enumerate(known):
+                match = None
+                for actuator in unused:
+                    if _identity(actuator) == _identity(entry):
+                        match = actuator
+                        break
+                if match is None:
+                    missing.append(dict(entry))
+                    continue
+                unused.remove(match)
+                if match['number'] != entry['number']:
+                    moved.append((len(mapping),entry['number'],match['number']))
+                mapping.append(match)
+            if missing and not allow_missing:
+                raise ZaberError('actuators missing from chain {0}: {1}'.format(chain_key,missing))
+            added = [dict(actuator) for actuator in unused]
+            mapping.extend(unused)
+            dev.set_actuator_numbers([actuator['number'] for actuator in mapping])
+            self._mappings[chain_key] = [dict(actuator) for actuator in mapping]
+            reports[key] = {'actuator_numbers': dev.get_actuator_numbers(),
+                            'moved': moved,
+                            'added': added,
+                            'missing': missing}
+        if self._path is not None:
+            self.save(self._path)
+        if list(reports.keys()) == [None]:
+            return reports[None]
+        return reports
+
+    def get_mappings(self):
+        '''
+        Returns a dictionary with chain serial numbers as keys and lists of
+        actuator identities in actuator index order as values.
+        '''
+        return {key: [dict(entry) for entry in self._mappings[key]] for key in self._mappings}
+
+    def clear(self):
+        '''
+        Forgets the saved mapping and restores chain order numbering.
+        '''
+        self._mappings = {}
+        for key in self._devs:
+            self._devs[key].set_actuator_numbers(None)
+
+    def save(self,path):
+        with open(path,'w') as f:
+            json.dump({'version': LAYOUT_VERSION,
+                       'chains': self._mappings},f,indent=2,sort_keys=True)
+
+    def load(self,path):
+        with open(path,'r') as f:
+            layout = json.load(f)
+        if layout.get('version') != LAYOUT_VERSION:
+            raise ZaberError('unsupported topology file version {0}'.format(layout.get('version')))
+        self._mappings = layout['chains']
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+'''
+Tracks what each actuator was last told to do and what its replies
+confirmed, so positions of idle actuators can be answered without a
+serial round trip.
+'''
+import time
+
+
+# commands whose reply arrives when the motion ends
+COMPLETION_COMMANDS = (1,18,20,21)
+# manual move tracking, manual move, slip tracking, unexpected position
+MANUAL_MOVE_COMMANDS = (10,11,12,13)
+ERROR_COMMAND = 255
+
+
+class ZaberPositionTracker(object):
+    '''
+    ZaberPositionTracker keeps per actuator the last commanded target,
+    the last position confirmed by a move completion, stop or position
+    reply, and whether the actuator is moving, idle or unknown. A
+    position is trusted only while the actuator is confirmed idle and,
+    when max_age is given, for at most max_age seconds after it was
+    confirmed. Stop, reset, home, potentiometer changes, manual move
+    replies and error replies make an actuator unknown until a reply
+    confirms it again.
+
+    Example Usage:
+
+    tracker = ZaberPositionTracker(max_age=1.0)
+    tracker.command([0],20,1000)
+    tracker.observe_reply(0,20,1000)
+    tracker.get_positions(1)
+    [1000]
+    '''
+    def __init__(self,max_age=None):
+        self._max_age = max_age
+        self._states = {}
+        self._hit_count = 0
+        self._miss_count = 0
+
+    def set_max_age(self,max_age=None):
+        '''
+        Trusts confirmed positions for at most max_age seconds, or until
+        invalidated when max_age is None.
+        '''
+        self._max_age = max_age
+
+    def get_max_age(self):
+        return self._max_age
+
+    def _state(self,actuator):
+        state = self._states.get(actuator)
+        if state is None:
+            state = {'target': None,
+                     'position': None,
+                     'moving': None,
+                     'command': None,
+                     'time_command': 0.0,
+                     'time_confirmed': None}
+            self._states[actuator] = state
+        return state
+
+    def command(self,actuators,command,data=None):
+        '''
+        Records a command sent to actuators. Call after the command is
+        written so replies to queries written earlier cannot mark the
+        actuators idle.
+        '''
+        time_command = time.monotonic()
+        for actuator in actuators:
+            state = self._state(actuator)
+            state['time_command'] = time_command
+            state['command'] = command
+            if command == 20:
+                state['target'] = int(data)
+            elif command == 21:
+                base = state['target']
+                if state['moving'] is False:
+                    base = state['position']
+                if base is None:
+                    state['target'] = None
+                else:
+                    state['target'] = base + int(data)
+            elif command == 1:
+                state['target'] = 0
+            else:
+                state['target'] = None
+            if command in (0,23):
+                # stop replies with the stopped position, reset never replies
+                state['position'] = None
+                state['moving'] = None
+            else:
+                state['moving'] = True
+
+    def invalidate(self,actuators=None):
+        '''
+        Forgets the tracked state of actuators, or of every actuator when
+        actuators is None.
+        '''
+        if actuators is None:
+            self._states = {}
+            return
+        time_command = time.monotonic()
+        for actuator in actuators:
+            state = self._state(actuator)
+            state['position'] = None
+            state['moving'] = None
+            state['target'] = None
+            state['command'] = None
+            state['time_command'] = time_command
+
+    def observe_reply(self,actuator,command,data):
+        '''
+        Updates the tracked state from a reply that no query was waiting
+        for.
+        '''
+        state = self._state(actuator)
+        if (command in MANUAL_MOVE_COMMANDS) or (command == ERROR_COMMAND):
+            self.invalidate([actuator])
+        elif (command == 23) and (state['command'] == 23):
+            state['position'] = data
+            state['moving'] = False
+            state['time_confirmed'] = time.monotonic()
+        elif command in COMPLETION_COMMANDS:
+            state['position'] = data
+            state['time_confirmed'] = time.monotonic()
+            # an earlier move interrupted by the latest command also replies
+            if (command == state['command']) and ((state['target'] is None) or (data == state['target'])):
+                state['moving'] = False
+
+    def observe_positions(self,positions,time_query):
+        '''
+        Confirms positions read by a query written at time_query for the
+        actuators not commanded since.
+        '''
+        time_confirmed = time.monotonic()
+        for actuator,position in enumerate(positions):
+            state = self._state(actuator)
+            if state['time_command'] < time_query:
+                state['position'] = position
+                state['time_confirmed'] = time_confirmed
+
+    def observe_moving(self,movings,time_query):
+        '''
+        Records the moving states read by a query written at time_query
+        for the actuators not commanded since.
+        '''
+        for actuator,moving in enumerate(movings):
+            state = self._state(actuator)
+            if state['time_command'] < time_query:
+                state['moving'] = bool(moving)
+
+    def _trusted(self,state,time_now):
+        if (state['moving'] is not False) or (state['position'] is None):
+            return False
+        if self._max_age is None:
+            return True
+        return (time_now - state['time_confirmed']) <= self._max_age
+
+    def get_positions(self,actuator_count):
+        '''
+        Returns the positions of actuators 0 to actuator_count-1 if all
+        of them are trusted, None otherwise.
+        '''
+        time_now = time.monotonic()
+        positions = []
+        for actuator in range(actuator_count):
+            state = self._states.get(actuator)
+            if (state is None) or (not self._trusted(state,time_now)):
+                self._miss_count += 1
+                return None
+            positions.append(state['position'])
+        self._hit_count += 1
+        return positions
+
+    def get_state(self):
+        '''
+        Returns a dictionary with actuators as keys and dictionaries of
+        target, position, moving (True, False or None when unknown) and
+        age in seconds of the position as values.
+        '''
+        time_now = time.monotonic()
+        states = {}
+        for actuator in sorted(self._states):
+            state = self._states[actuator]
+            age = None
+            if state['time_confirmed'] is not None:
+                age = time_now - state['time_confirmed']
+            states[actuator] = {'target': state['target'],
+                                'position': state['position'],
+                                'moving': state['moving'],
+                                'age': age,
+                                'trusted': self._trusted(state,time_now)}
+        return states
+
+    def get_metrics(self):
+        '''
+        Returns how many position queries were answered locally and how
+        many had to go over serial.
+        '''
+        return {'hits': self._hit_count,
+                'misses': self._miss_count}
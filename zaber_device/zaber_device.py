@@ -1,30 +1,65 @@
 # -*- coding: utf-8 -*-
-import serial
 import time
 import atexit
-import platform
 import os
 import threading
-
-from serial_interface import SerialInterface, SerialInterfaces, find_serial_interface_ports, WriteFrequencyError, WriteError, ReadError
-
-try:
-    from pkg_resources import get_distribution, DistributionNotFound
-    _dist = get_distribution('zaber_device')
+import select
+import struct
+import collections
+import weakref
+
+from .kinematics import ZaberKinematicModel, SPEED_UNIT
+from .throttle import WriteThrottle, frame_time
+from .timeouts import ReadTimeoutTuner
+from .tracking import ZaberPositionTracker
+from .flight_recorder import ZaberFlightRecorder, FLIGHT_RECORD_CAPACITY, KIND_COMMAND, KIND_QUERY, KIND_REPLY, KIND_CLEAR, KIND_NUMBERING_ERROR, KIND_SHORT_READ
+
+# serial, serial_interface and platform are imported on first use by
+# _import_serial_stack, or on first access to one of these names from
+# outside through __getattr__, so that importing zaber_device stays fast
+_SERIAL_STACK_NAMES = ('serial','platform','SerialInterface','SerialInterfaces','find_serial_interface_ports',
+                       'WriteFrequencyError','WriteError','ReadError')
+
+
+def _import_serial_stack():
+    global serial, platform, SerialInterface, SerialInterfaces, find_serial_interface_ports, WriteFrequencyError, WriteError, ReadError
+    if 'ReadError' in globals():
+        return
+    import serial
+    import platform
+    from serial_interface import SerialInterface, SerialInterfaces, find_serial_interface_ports, WriteFrequencyError, WriteError, ReadError
+
+def _get_version():
+    try:
+        from importlib.metadata import distribution, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        dist = distribution('zaber_device')
+    except PackageNotFoundError:
+        return None
     # Normalize case for Windows systems
-    dist_loc = os.path.normcase(_dist.location)
+    dist_loc = os.path.normcase(str(dist.locate_file('')))
     here = os.path.normcase(__file__)
     if not here.startswith(os.path.join(dist_loc, 'zaber_device')):
         # not installed, but there is another version that *is*
-        raise DistributionNotFound
-except (ImportError,DistributionNotFound):
-    __version__ = None
-else:
-    __version__ = _dist.version
+        return None
+    return dist.version
+
+def __getattr__(name):
+    if name == '__version__':
+        version = _get_version()
+        globals()['__version__'] = version
+        return version
+    if name in _SERIAL_STACK_NAMES:
+        _import_serial_stack()
+        return globals()[name]
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__,name))
 
 
 DEBUG = False
 BAUDRATE = 9600
+BAUDRATES = [9600,19200,38400,57600,115200]
 RESPONSE_LENGTH = 6
 CURRENT_MIN = 1
 CURRENT_MAX = 100
@@ -36,7 +71,25 @@ POSITION_ADDRESS_MIN = 0
 POSITION_ADDRESS_MAX = 15
 SERIAL_NUMBER_ADDRESS = 123
 REQUEST_ATTEMPTS_MAX = 10
+# commands that must not be resent after a reconnect since repeating
+# them would change the outcome
+UNREPLAYABLE_COMMANDS = [21]
 READ_SIZE = RESPONSE_LENGTH*8
+RECEIVE_BUFFER_SIZE = READ_SIZE*8
+# replies kept for poll_replies when no reply handler is set
+REPLY_QUEUE_LENGTH = 256
+# actuator, command, little-endian data
+REQUEST_STRUCT = struct.Struct('<BBL')
+RESPONSE_STRUCT = struct.Struct('<BBl')
+
+# devices open in this process, so a reconnect never probes their ports
+_open_devices = weakref.WeakSet()
+_open_devices_lock = threading.Lock()
+
+def _get_held_ports(exclude=None):
+    with _open_devices_lock:
+        devices = list(_open_devices)
+    return set(dev.get_port() for dev in devices if dev is not exclude)
 
 class ZaberError(Exception):
     def __init__(self,value):
@@ -50,6 +103,9 @@ class ZaberNumberingError(Exception):
     def __str__(self):
         return repr(self.value)
 
+class ZaberConnectionError(ZaberError):
+    pass
+
 class ZaberDevice(object):
     '''
     This Python package (zaber_device) creates a class named ZaberDevice,
@@ -94,10 +150,14 @@ class ZaberDevice(object):
     [20000, 10000]
     '''
     _TIMEOUT = 0.05
-    _WRITE_WRITE_DELAY = 0.05
     _RESET_DELAY = 2.0
+    _BAUDRATE_SWITCH_DELAY = 0.1
+    _POLL_PERIOD = 0.01
+    # fraction of the predicted duration to sleep before the first poll
+    _POLL_LEAD = 0.9
 
     def __init__(self,*args,**kwargs):
+        _import_serial_stack()
         if 'debug' in kwargs:
             self.debug = kwargs['debug']
         else:
@@ -108,28 +168,117 @@ class ZaberDevice(object):
             try_ports = kwargs.pop('try_ports')
         else:
             try_ports = None
+        if 'high_speed' in kwargs:
+            high_speed = kwargs.pop('high_speed')
+        else:
+            high_speed = False
+        if 'baudrates' in kwargs:
+            baudrates = kwargs.pop('baudrates')
+        else:
+            baudrates = BAUDRATES
+        if 'auto_reconnect' in kwargs:
+            self._auto_reconnect = kwargs.pop('auto_reconnect')
+        else:
+            self._auto_reconnect = False
+        if 'serial_interface' in kwargs:
+            serial_interface = kwargs.pop('serial_interface')
+        else:
+            serial_interface = None
+        if 'flight_record_size' in kwargs:
+            flight_record_size = kwargs.pop('flight_record_size')
+        else:
+            flight_record_size = FLIGHT_RECORD_CAPACITY
+        # always on, so the frames before a failure can be dumped
+        self._flight_recorder = ZaberFlightRecorder(flight_record_size)
+        self._flight_record_path = None
+        if 'reset_delay' in kwargs:
+            reset_delay = kwargs.pop('reset_delay')
+        elif serial_interface is not None:
+            reset_delay = 0
+        else:
+            reset_delay = self._RESET_DELAY
         if 'baudrate' not in kwargs:
             kwargs.update({'baudrate': BAUDRATE})
         elif (kwargs['baudrate'] is None) or (str(kwargs['baudrate']).lower() == 'default'):
             kwargs.update({'baudrate': BAUDRATE})
+        self._baudrate_initial = kwargs['baudrate']
         if 'timeout' not in kwargs:
             kwargs.update({'timeout': self._TIMEOUT})
-        if 'write_write_delay' not in kwargs:
-            kwargs.update({'write_write_delay': self._WRITE_WRITE_DELAY})
-        if ('port' not in kwargs) or (kwargs['port'] is None):
-            port =  find_zaber_device_port(baudrate=kwargs['baudrate'],
-                                           try_ports=try_ports,
-                                           debug=kwargs['debug'])
-            kwargs.update({'port': port})
+        # writes are spaced by frame transmission time unless a fixed
+        # write_write_delay is requested
+        self._throttle = WriteThrottle(kwargs.get('write_write_delay'))
+        # read deadlines start at timeout and follow observed latencies
+        self._read_timeouts = ReadTimeoutTuner(kwargs['timeout'])
+        if serial_interface is not None:
+            # an already open port or a ZaberSimulator, used as given
+            kwargs.update({'port': serial_interface.port,
+                           'baudrate': serial_interface.baudrate})
+        elif ('port' not in kwargs) or (kwargs['port'] is None):
+            if high_speed:
+                # chain may still be running at a high baudrate if a
+                # previous session did not revert it
+                port_baudrates = baudrates
+            else:
+                port_baudrates = [kwargs['baudrate']]
+            port, baudrate = find_zaber_device_port_baudrate(baudrates=port_baudrates,
+                                                             try_ports=try_ports,
+                                                             debug=kwargs['debug'])
+            kwargs.update({'port': port,
+                           'baudrate': baudrate})
 
         t_start = time.time()
         self._debug_print("port = {0}".format(kwargs['port']))
-        self._serial_interface = SerialInterface(*args,**kwargs)
+        if serial_interface is None:
+            serial_interface = SerialInterface(*args,**kwargs)
+        self._serial_interface = serial_interface
+        self._serial_interface_args = args
+        self._serial_interface_kwargs = kwargs
+        with _open_devices_lock:
+            _open_devices.add(self)
         atexit.register(self._exit_zaber_device)
-        time.sleep(self._RESET_DELAY)
-        self._lock = threading.Lock()
+        time.sleep(reset_delay)
+        # _lock serializes queries and their reads, _write_lock only writes
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
         self._actuator_count = None
-        self._zaber_response = ''
+        self._actuator_numbers = None
+        self._actuator_indices = None
+        self._serial_number = None
+        self._reconnecting = False
+        self._reconnect_count = 0
+        self._reconnect_time = None
+        self._kinematic_model = None
+        self._kinematic_model_enabled = False
+        # expected position of each actuator once its moves end
+        self._expected_positions = {}
+        self._position_tracker = None
+        self._aliases = None
+        self._expected_motions = {}
+        self._poll_count = 0
+        self._broadcast_reply_count = None
+        self._reply_handler = None
+        self._replies = collections.deque(maxlen=REPLY_QUEUE_LENGTH)
+        self._awaited_replies = {}
+        self._response_length = 0
+        self._time_write = None
+        self._time_query_write = None
+        self._time_read = None
+        self._time_last_reply = None
+        self._port_timeout = None
+        self._retry_count = 0
+        self._idle_closed = False
+        # thread closing the idle port, whose writes are the only ones let through
+        self._idle_closing = None
+        self._idle_baudrate = None
+        self._time_opened = time.monotonic()
+        self._read_buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self._read_view = memoryview(self._read_buffer)
+        self._rx_start = 0
+        self._rx_end = 0
+        self._response_buffer = bytearray(READ_SIZE)
+        self._response_view = memoryview(self._response_buffer)
+        if high_speed:
+            self._negotiate_baudrate(baudrates)
         t_end = time.time()
         self._debug_print('Initialization time =', (t_end - t_start))
 
@@ -138,127 +287,798 @@ class ZaberDevice(object):
             print(*args)
 
     def _exit_zaber_device(self):
-        pass
-
-    def _args_to_request(self,*args):
-        request = ''.join(map(chr,args))
-        return request
+        self._revert_baudrate()
 
-    def _data_to_args_list(self,data):
-        if data is None:
-            return [0,0,0,0]
-        # Handle negative data
-        # If Cmd_Data < 0 then Cmd_Data = 256^4 + Cmd_Data
-        # Cmd_Byte_6 = Cmd_Data / 256^3
-        # Cmd_Data   = Cmd_Data - 256^3 * Cmd_Byte_6
-        # Cmd_Byte_5 = Cmd_Data / 256^2
-        # Cmd_Data   = Cmd_Data - 256^2 * Cmd_Byte_5
-        # Cmd_Byte_4 = Cmd_Data / 256
-        # Cmd_Data   = Cmd_Data - 256   * Cmd_Byte_4
-        # Cmd_Byte 3 = Cmd_Data
-        data = int(data)
-        if data < 0:
-            data += pow(256,4)
-        arg3 = data // pow(256,3)
-        data -= pow(256,3)*arg3
-        arg2 = data // pow(256,2)
-        data -= pow(256,2)*arg2
-        arg1 = data // 256
-        data -= 256*arg1
-        arg0 = data
-        return [arg0,arg1,arg2,arg3]
-
-    def _response_to_data(self,response):
-        self._debug_print('len(response)',len(response))
-        actuator_count = len(response) // RESPONSE_LENGTH
+    def _response_to_data(self,response,response_length=None):
+        if response_length is None:
+            response_length = len(response)
+        actuator_count = response_length // RESPONSE_LENGTH
+        self._debug_print('len(response)',response_length)
         self._debug_print('actuator_count',actuator_count)
         if self._actuator_count is not None:
             if actuator_count != self._actuator_count:
                 self._debug_print("actuator_count != self._actuator_count!!")
                 raise ZaberNumberingError('')
-        data_list = [None for d in range(actuator_count)]
-        for actuator_n in range(actuator_count):
-            actuator = ord(response[0+actuator_n*RESPONSE_LENGTH]) - 1
-            self._debug_print('response_actuator',actuator)
+        data_list = [None]*actuator_count
+        unpack_from = RESPONSE_STRUCT.unpack_from
+        for offset in range(0,actuator_count*RESPONSE_LENGTH,RESPONSE_LENGTH):
+            # Reply_Data is a signed little-endian 32-bit integer
+            actuator,cmd,data = unpack_from(response,offset)
+            actuator -= 1
+            if self._actuator_indices is not None:
+                actuator = self._actuator_indices.get(actuator,-1)
+            if self.debug:
+                self._debug_print('response_actuator',actuator)
+                self._debug_print('response_command',cmd)
             if (actuator >= actuator_count) or (actuator < 0):
                 self._debug_print("invalid actuator number!!")
                 raise ZaberNumberingError('')
-            cmd = ord(response[1+actuator_n*RESPONSE_LENGTH])
-            self._debug_print('response_command',cmd)
-            response_copy = response[(2+actuator_n*RESPONSE_LENGTH):(6+actuator_n*RESPONSE_LENGTH)]
-            # Reply_Data = 256^3 * Rpl_Byte 6 + 256^2 * Rpl_Byte_5 + 256 * Rpl_Byte_4 + Rpl_Byte_3
-            # If Rpl_Byte_6 > 127 then Reply_Data = Reply_Data - 256^4
-            data = pow(256,3)*ord(response_copy[3]) + pow(256,2)*ord(response_copy[2]) + 256*ord(response_copy[1]) + ord(response_copy[0])
             data_list[actuator] = data
-        if any([data is None for data in data_list]):
+        if None in data_list:
             raise ZaberNumberingError('')
         return data_list
 
+    def _actuator_to_number(self,actuator):
+        '''
+        Returns the device number addressed by actuator, mapping actuator
+        indices through the software actuator numbering when it is set.
+        '''
+        if actuator is None:
+            return 0
+        actuator = int(actuator)
+        if actuator < 0:
+            raise ZaberError('actuator must be >= 0')
+        if (self._actuator_numbers is not None) and (actuator < len(self._actuator_numbers)):
+            actuator = self._actuator_numbers[actuator]
+        return actuator + 1
+
+    def _args_to_request_bytes(self,actuator,command,data):
+        if data is None:
+            data = 0
+        return REQUEST_STRUCT.pack(actuator,command,int(data) & 0xFFFFFFFF)
+
+    def _get_read_fileno(self):
+        try:
+            if hasattr(os,'readv'):
+                return self._serial_interface.fileno()
+        except (AttributeError,serial.SerialException,ValueError):
+            pass
+        return None
+
+    def _read_available(self,timeout):
+        '''
+        Waits up to timeout seconds for bytes and appends whatever has
+        arrived to the receive buffer. Returns number of bytes read.
+        Must be called with self._lock held.
+        '''
+        if self._idle_closed:
+            return 0
+        if self._rx_start == self._rx_end:
+            self._rx_start = self._rx_end = 0
+        elif len(self._read_buffer) - self._rx_end < READ_SIZE:
+            # move the partial frame to the front of the buffer
+            pending = self._rx_end - self._rx_start
+            self._read_view[:pending] = self._read_view[self._rx_start:self._rx_end]
+            self._rx_start = 0
+            self._rx_end = pending
+        view = self._read_view[self._rx_end:]
+        fileno = self._get_read_fileno()
+        if fileno is None:
+            bytes_read = 0
+            if (timeout > 0) or self._serial_interface.in_waiting:
+                self._set_port_timeout(timeout)
+                bytes_read = self._serial_interface.readinto(view[:1])
+            if bytes_read:
+                waiting = min(self._serial_interface.in_waiting,len(view) - 1)
+                if waiting > 0:
+                    bytes_read += self._serial_interface.readinto(view[1:1+waiting])
+        else:
+            ready,_,_ = select.select((fileno,),(),(),max(timeout,0))
+            if not ready:
+                return 0
+            bytes_read = os.readv(fileno,(view,))
+            if bytes_read == 0:
+                # readable but empty means the port has gone away
+                raise serial.SerialException('device reports readiness to read but returned no data')
+        self._rx_end += bytes_read
+        return bytes_read
+
+    def _set_port_timeout(self,timeout):
+        '''
+        Shortens the blocking read timeout of the port to timeout, rounded
+        up to whole milliseconds so the port is rarely reconfigured.
+        '''
+        timeout = max(int(timeout*1000 + 0.999),1)/1000.0
+        if timeout != self._port_timeout:
+            self._serial_interface.timeout = timeout
+            self._port_timeout = timeout
+
+    def _route_reply(self,number,command,data):
+        '''
+        Passes a reply that no query is waiting for to the reply handler,
+        or queues it for poll_replies.
+        '''
+        actuator = number - 1
+        if self._actuator_indices is not None:
+            actuator = self._actuator_indices.get(actuator,actuator)
+        if (actuator,command) in self._awaited_replies:
+            self._awaited_replies[(actuator,command)] = data
+        if self._position_tracker is not None:
+            self._position_tracker.observe_reply(actuator,command,data)
+        if self._reply_handler is None:
+            self._replies.append((actuator,command,data))
+            return
+        try:
+            self._reply_handler(actuator,command,data)
+        except Exception as e:
+            self._debug_print('reply handler error: {0}'.format(e))
+
+    def _collect_replies(self,reply_commands,expected_count,timeout,response_length=0):
+        '''
+        Copies reply frames whose command is in reply_commands into the
+        response buffer after response_length bytes until expected_count
+        have arrived or timeout expires, routing every other frame to the
+        reply handler. Frames after the expected ones stay buffered.
+        Returns number of response bytes. Must be called with self._lock
+        held.
+        '''
+        deadline = time.monotonic() + timeout
+        response_size = len(self._response_buffer)
+        unpack_from = RESPONSE_STRUCT.unpack_from
+        while True:
+            complete = False
+            while (self._rx_end - self._rx_start) >= RESPONSE_LENGTH:
+                offset = self._rx_start
+                number,cmd,data = unpack_from(self._read_view,offset)
+                self._rx_start += RESPONSE_LENGTH
+                self._flight_recorder.record(KIND_REPLY,self._read_view[offset:offset+RESPONSE_LENGTH])
+                if (reply_commands is not None) and (cmd in reply_commands) and (response_length < response_size):
+                    self._response_view[response_length:response_length+RESPONSE_LENGTH] = self._read_view[offset:offset+RESPONSE_LENGTH]
+                    response_length += RESPONSE_LENGTH
+                    self._time_last_reply = time.monotonic()
+                    if (expected_count is not None) and (response_length >= expected_count*RESPONSE_LENGTH):
+                        complete = True
+                        break
+                else:
+                    self._route_reply(number,cmd,data)
+            if complete:
+                break
+            remaining = deadline - time.monotonic()
+            # a zero timeout still takes whatever has already arrived
+            if (self._read_available(max(remaining,0)) == 0) and (remaining <= 0):
+                break
+        return response_length
+
+    def _clear_receive_buffer(self):
+        '''
+        Drops buffered bytes so a corrupted or misaligned stream cannot
+        affect the next request. Must be called with self._lock held.
+        '''
+        self._rx_start = self._rx_end = 0
+        self._serial_interface.reset_input_buffer()
+        self._flight_recorder.record(KIND_CLEAR)
+
+    def _reply_commands(self,command,data):
+        '''
+        Returns the commands a reply to the request may carry. Return
+        setting replies carry the setting number.
+        '''
+        if command == 53:
+            return (command,int(data))
+        return (command,)
+
+    def _expected_reply_count(self,number):
+        '''
+        Returns how many replies a query to device number causes, or None
+        if unknown.
+        '''
+        if number != 0:
+            return 1
+        if self._actuator_count is not None:
+            return self._actuator_count
+        return self._broadcast_reply_count
+
+    def _write_read(self,request,reply_commands=None,expected_count=None):
+        '''
+        Writes request and collects its replies into the response buffer,
+        returning early once expected_count replies arrive. Returns number
+        of response bytes. Must be called with self._lock held.
+        '''
+        command = request[1]
+        if reply_commands is None:
+            reply_commands = (command,)
+        floor = frame_time(self._serial_interface.baudrate,1 + (expected_count or 1))
+        timeout = self._read_timeouts.get_timeout(command,expected_count,floor)
+        bytes_written,self._time_query_write = self._write(request,KIND_QUERY)
+        self._time_last_reply = None
+        response_length = self._collect_replies(reply_commands,expected_count,timeout)
+        self._time_read = time.monotonic()
+        if expected_count is None:
+            if self._time_last_reply is not None:
+                self._read_timeouts.observe(command,None,self._time_last_reply - self._time_query_write)
+        elif response_length >= expected_count*RESPONSE_LENGTH:
+            self._read_timeouts.observe(command,expected_count,self._time_read - self._time_query_write)
+        else:
+            # the tuned deadline is only the first wait, a late reply
+            # gets the rest of the default timeout before the read fails
+            self._read_timeouts.observe_miss(command,expected_count)
+            self._flight_recorder.record(KIND_SHORT_READ,request,self._time_read)
+            remaining = self._query_deadline(timeout) - (self._time_read - self._time_query_write)
+            if remaining > 0:
+                response_length = self._collect_replies(reply_commands,expected_count,remaining,response_length)
+                self._time_read = time.monotonic()
+                if response_length >= expected_count*RESPONSE_LENGTH:
+                    self._read_timeouts.observe_late(command,expected_count,self._time_read - self._time_query_write)
+        self._response_length = response_length
+        if response_length == 0:
+            raise ReadError('No read_data received.')
+        self._throttle.acknowledge()
+        return response_length
+
+    def _query_deadline(self,timeout):
+        '''
+        Returns how long after the request a query may wait for a late
+        reply, the longer of the default and the tuned timeout.
+        '''
+        return max(self._read_timeouts.get_default_timeout(),timeout)
+
+    def _reply_frames(self,number):
+        '''
+        Returns the number of reply frames a request to device number
+        causes.
+        '''
+        if (number == 0) and (self._actuator_count is not None):
+            return self._actuator_count
+        return 1
+
+    def _port_unavailable(self):
+        closing = self._idle_closing
+        return self._idle_closed or ((closing is not None) and (closing != threading.get_ident()))
+
+    def _acquire_write_lock(self):
+        '''
+        Acquires self._write_lock with the port open, reopening it when it
+        was closed while idle. While another thread is closing the idle
+        port, waits for it to finish so no reply to this write is lost.
+        '''
+        while True:
+            if self._port_unavailable():
+                # blocks on self._lock until a running close_idle is done
+                self._reopen_idle()
+            self._write_lock.acquire()
+            if not self._port_unavailable():
+                return
+            self._write_lock.release()
+
+    def _write(self,request,kind=KIND_COMMAND):
+        '''
+        Writes request once the throttle allows and returns the number of
+        bytes written and the write time. Safe to call without self._lock,
+        so commands never wait for another caller's reply.
+        '''
+        self._acquire_write_lock()
+        try:
+            self._throttle.wait(self._serial_interface.baudrate,self._reply_frames(request[0]))
+            time_write = time.monotonic()
+            self._time_write = time_write
+            bytes_written = self._serial_interface.write(request)
+            self._flight_recorder.record_request(kind,request,time_write)
+        finally:
+            self._write_lock.release()
+        if not bytes_written:
+            raise WriteError('No bytes written.')
+        return bytes_written,time_write
+
+    def _write_at_barrier(self,request,barrier,timeout=None):
+        '''
+        Holds the port, waits for the throttle and then for every party
+        of barrier before writing request, so requests on several ports
+        leave together. Returns the write start and end times.
+        '''
+        self._acquire_write_lock()
+        try:
+            self._throttle.wait(self._serial_interface.baudrate,len(request)//RESPONSE_LENGTH)
+            barrier.wait(timeout)
+            time_write = time.monotonic()
+            bytes_written = self._serial_interface.write(request)
+            time_written = time.monotonic()
+            self._time_write = time_write
+            self._flight_recorder.record_request(KIND_COMMAND,request,time_write)
+        finally:
+            self._write_lock.release()
+        if not bytes_written:
+            raise WriteError('No bytes written.')
+        return time_write,time_written
+
+    def _write_request(self,request):
+        bytes_written,time_write = self._write(request)
+        self._debug_print('bytes_written', bytes_written)
+        return bytes_written
+
+    def _request_response(self,request,reply_commands):
+        request_successful = False
+        request_attempt = 0
+        while (not request_successful) and (request_attempt < REQUEST_ATTEMPTS_MAX):
+            try:
+                self._debug_print('request attempt: {0}'.format(request_attempt))
+                self._debug_print('request', list(request))
+                request_attempt += 1
+                expected_count = self._expected_reply_count(request[0])
+                response_length = self._write_read(request,reply_commands,expected_count)
+                if self.debug:
+                    self._debug_print('response', self._format_response())
+                if request[0] == 0:
+                    data = self._response_to_data(self._response_view,response_length)
+                    if expected_count is None:
+                        self._broadcast_reply_count = len(data)
+                else:
+                    data = [RESPONSE_STRUCT.unpack_from(self._response_view,offset)[2]
+                            for offset in range(0,response_length,RESPONSE_LENGTH)]
+                self._debug_print('data', data)
+                request_successful = True
+            except ZaberNumberingError:
+                self._debug_print("request error!!")
+                self._flight_recorder.record(KIND_NUMBERING_ERROR)
+                self._retry_count += 1
+                self._broadcast_reply_count = None
+                self._clear_receive_buffer()
+        if not request_successful:
+            raise ZaberError('Improper actuator response, may need to rearrange zaber cables, use ZaberTopology to remap actuators, or use renumber method to fix.')
+        return data
+
+    def _call_with_reconnect(self,command,function,*args):
+        '''
+        Calls function and, if the serial connection drops and
+        auto_reconnect is enabled, reconnects and calls it again unless
+        repeating the command is unsafe. Must be called with self._lock held.
+        '''
+        reconnect_count = self._reconnect_count
+        try:
+            return function(*args)
+        except (OSError,ReadError) as e:
+            if (not self._auto_reconnect) or self._reconnecting:
+                raise
+            self._debug_print('connection lost: {0}'.format(e))
+        # another caller may have reconnected while this one was failing
+        if self._reconnect_count == reconnect_count:
+            self._reconnect()
+        if command in UNREPLAYABLE_COMMANDS:
+            raise ZaberConnectionError('Connection lost while sending command {0}. Reconnected on {1}, but the command was not resent because repeating it is unsafe.'.format(command,self.get_port()))
+        return function(*args)
+
     def _send_request(self,command,actuator=None,data=None):
 
         '''Sends request to device over serial port and
         returns number of bytes written'''
 
-        with self._lock:
-            if actuator is None:
-                actuator = 0
-            elif actuator < 0:
-                raise ZaberError('actuator must be >= 0')
-            else:
-                actuator = int(actuator)
-                actuator += 1
-            args_list = self._data_to_args_list(data)
-            request = self._args_to_request(actuator,command,*args_list)
-            self._debug_print('request', [ord(c) for c in request])
-            self._serial_interface.reset_output_buffer()
-            bytes_written = self._serial_interface.write_check_freq(request,delay_write=True)
-            self._debug_print('bytes_written', bytes_written)
-            self._serial_interface.reset_input_buffer()
-        return bytes_written
+        actuator = self._actuator_to_number(actuator)
+        request = self._args_to_request_bytes(actuator,command,data)
+        self._debug_print('request', list(request))
+        try:
+            # replies are routed to the reply handler by later reads
+            return self._write_request(request)
+        except OSError:
+            if (not self._auto_reconnect) or self._reconnecting:
+                self._dump_flight_record_on_error()
+                raise
+        try:
+            with self._lock:
+                return self._call_with_reconnect(command,self._write_request,request)
+        except (ZaberError,OSError):
+            self._dump_flight_record_on_error()
+            raise
 
     def _send_request_get_response(self,command,actuator=None,data=None):
 
         '''Sends request to device over serial port and
         returns response'''
 
-        request_successful = False
         with self._lock:
-            if actuator is None:
-                actuator = 0
-            elif actuator < 0:
-                raise ZaberError('actuator must be >= 0')
-            else:
-                actuator = int(actuator)
-                actuator += 1
-            args_list = self._data_to_args_list(data)
-            request = self._args_to_request(actuator,command,*args_list)
-            request_attempt = 0
-            while (not request_successful) and (request_attempt < REQUEST_ATTEMPTS_MAX):
-                try:
-                    self._debug_print('request attempt: {0}'.format(request_attempt))
-                    self._debug_print('request', [ord(c) for c in request])
-                    request_attempt += 1
-                    response = self._serial_interface.write_read(request,use_readline=False,size=READ_SIZE)
-                    response_array = [ord(c) for c in response]
-                    response_str = str(response_array)
-                    self._debug_print('response', response_str)
-                    self._zaber_response = response_str
-                    data = self._response_to_data(response)
-                    self._debug_print('data', data)
-                    request_successful = True
-                except ZaberNumberingError:
-                    self._debug_print("request error!!")
-        if not request_successful:
-            raise ZaberError('Improper actuator response, may need to rearrange zaber cables or use renumber method to fix.')
-        else:
-            return data
+            actuator = self._actuator_to_number(actuator)
+            request = self._args_to_request_bytes(actuator,command,data)
+            reply_commands = self._reply_commands(command,data)
+            try:
+                data = self._call_with_reconnect(command,self._request_response,request,reply_commands)
+            except (ZaberError,OSError,ReadError,WriteError):
+                self._dump_flight_record_on_error()
+                raise
+        return data
+
+    def get_flight_recorder(self):
+        '''
+        Returns the ZaberFlightRecorder holding the latest request and
+        reply frames of this port.
+        '''
+        return self._flight_recorder
+
+    def dump_flight_record(self,path):
+        '''
+        Writes the recorded frames and the session baudrate, serial number
+        and actuator count to path, for load_flight_record or the
+        zaber_device_replay tool. Returns the number of records written.
+        '''
+        return self._flight_recorder.dump(path,
+                                          baudrate=self._serial_interface.baudrate,
+                                          serial_number=self._serial_number,
+                                          actuator_count=self._actuator_count,
+                                          port=str(self.get_port()))
+
+    def set_flight_record_path(self,path=None):
+        '''
+        Dumps the flight record to path whenever a command or query fails
+        with an exception. None turns it off.
+        '''
+        self._flight_record_path = path
+
+    def _dump_flight_record_on_error(self):
+        if self._flight_record_path is None:
+            return
+        try:
+            self.dump_flight_record(self._flight_record_path)
+        except (OSError,ValueError) as e:
+            self._debug_print('flight record dump failed: {0}'.format(e))
+
+    def set_reply_handler(self,handler=None):
+        '''
+        Calls handler(actuator,command,data) from the reading thread for
+        every reply no query is waiting for, such as the replies to
+        commands sent without waiting and move completion replies. With
+        no handler those replies are queued for poll_replies.
+        '''
+        self._reply_handler = handler
+
+    def poll_replies(self,timeout=0):
+        '''
+        Reads any replies that have arrived, waiting up to timeout seconds
+        for the first, routes them to the reply handler and returns the
+        queued (actuator,command,data) tuples.
+        '''
+        with self._lock:
+            self._collect_replies(None,None,timeout)
+            replies = list(self._replies)
+            self._replies.clear()
+        return replies
+
+    def _await_replies(self,replies):
+        '''
+        Starts collecting the data of the next reply of every
+        (actuator,command) in replies. Call before sending the requests
+        so no reply can be missed.
+        '''
+        with self._lock:
+            # replies that have already arrived belong to earlier requests
+            self._collect_replies(None,None,0)
+            self._awaited_replies = dict.fromkeys(replies)
+
+    def _wait_for_replies(self,timeout=None):
+        '''
+        Reads replies until every awaited reply has arrived and returns a
+        dictionary with (actuator,command) keys and reply data values.
+        Raises ZaberError after timeout seconds.
+        '''
+        t_start = time.monotonic()
+        while True:
+            with self._lock:
+                missing = [key for key in self._awaited_replies if self._awaited_replies[key] is None]
+                if not missing:
+                    replies = self._awaited_replies
+                    self._awaited_replies = {}
+                    return replies
+                if (timeout is not None) and ((time.monotonic() - t_start) >= timeout):
+                    self._awaited_replies = {}
+                    raise ZaberError('no reply to {0} after {1} s'.format(missing,timeout))
+                self._collect_replies(None,None,self._POLL_PERIOD)
+
+    def _verify_session(self):
+        '''
+        Returns True if the chain answers at the session baudrate and has
+        the session serial number. A chain that was power cycled is
+        switched back from the initial baudrate to the session baudrate.
+        '''
+        baudrate = self.get_baudrate()
+        if not self._check_communication():
+            if baudrate == self._baudrate_initial:
+                return False
+            self._serial_interface.baudrate = self._baudrate_initial
+            if not self._check_communication():
+                self._serial_interface.baudrate = baudrate
+                return False
+            self._change_baudrate(baudrate)
+            if not self._check_communication():
+                return False
+        if self._serial_number is not None:
+            try:
+                if self.get_serial_number() != self._serial_number:
+                    return False
+            except (ZaberError,OSError,ReadError):
+                return False
+        return True
+
+    def _reopen(self):
+        try:
+            self._serial_interface.open()
+            return self._verify_session()
+        except (OSError,ValueError,ReadError,WriteError):
+            return False
+
+    def _reconnect(self):
+        t_start = time.time()
+        self._reconnecting = True
+        try:
+            try:
+                self._serial_interface.close()
+            except OSError:
+                pass
+            if not self._reopen():
+                self._reconnect_new_port()
+        finally:
+            self._reconnecting = False
+        self._broadcast_reply_count = None
+        self._port_timeout = None
+        self._idle_closed = False
+        if self._position_tracker is not None:
+            # the actuators may have been moved while disconnected
+            self._position_tracker.invalidate()
+        self._reconnect_count += 1
+        self._reconnect_time = time.time() - t_start
+        self._debug_print('Reconnect time =', self._reconnect_time)
+
+    def _reconnect_new_port(self):
+        '''
+        Looks for the session serial number on every serial port not held
+        by another ZaberDevice in this process and opens the port it is
+        found on.
+        '''
+        if self._serial_number is None:
+            raise ZaberConnectionError('Could not reopen {0} and serial number is unknown, so cannot search other ports.'.format(self.get_port()))
+        try:
+            self._serial_interface.close()
+        except OSError:
+            pass
+        baudrates = [self.get_baudrate()]
+        if self._baudrate_initial not in baudrates:
+            baudrates.append(self._baudrate_initial)
+        held_ports = _get_held_ports(exclude=self)
+        try_ports = [port for port in find_serial_interface_ports(debug=self.debug) if port not in held_ports]
+        zaber_device_ports = find_zaber_device_ports(baudrates=baudrates,
+                                                     try_ports=try_ports,
+                                                     serial_number=self._serial_number,
+                                                     debug=self.debug,
+                                                     reset_delay=0)
+        if len(zaber_device_ports) != 1:
+            raise ZaberConnectionError('Could not find Zaber device with serial number {0} on any port.'.format(self._serial_number))
+        port = list(zaber_device_ports.keys())[0]
+        kwargs = dict(self._serial_interface_kwargs)
+        kwargs['port'] = port
+        baudrate = self.get_baudrate()
+        kwargs['baudrate'] = zaber_device_ports[port]['baudrate']
+        self._serial_interface = SerialInterface(*self._serial_interface_args,**kwargs)
+        self._serial_interface_kwargs = kwargs
+        try:
+            if self.get_baudrate() != baudrate:
+                self._change_baudrate(baudrate)
+            session_verified = self._verify_session()
+        except (OSError,ReadError,WriteError):
+            session_verified = False
+        if not session_verified:
+            raise ZaberConnectionError('Zaber device with serial number {0} found on {1} but not responding.'.format(self._serial_number,port))
+
+    def reconnect(self):
+        '''
+        Reopens the serial connection, or finds the device serial number on
+        another port, and restores the session baudrate. Returns the port.
+        '''
+        with self._lock:
+            self._reconnect()
+        return self.get_port()
+
+    def set_write_delay(self,delay=None):
+        '''
+        Spaces writes by a fixed delay in seconds, or by the transmission
+        time of each request and its replies at the current baudrate when
+        delay is None.
+        '''
+        if (delay is not None) and (delay < 0):
+            raise ZaberError('delay must be >= 0')
+        self._throttle.set_fixed_delay(delay)
+
+    def set_rate_limit(self,rate=None,burst=1):
+        '''
+        Caps the sustained command rate of this port at rate commands per
+        second, allowing bursts of up to burst commands. None removes the
+        cap.
+        '''
+        if (rate is not None) and (rate <= 0):
+            raise ZaberError('rate must be > 0')
+        with self._lock:
+            self._throttle.set_rate_limit(rate,burst)
+
+    def get_write_metrics(self):
+        '''
+        Returns the number of writes, how many were delayed by the
+        throttle and for how long in total, and the mean write rate.
+        '''
+        return self._throttle.get_metrics()
+
+    def reset_write_metrics(self):
+        self._throttle.reset_metrics()
+
+    def set_read_timeout_tuning(self,enabled=True,percentile=None,margin=None,min_timeout=None,max_timeout=None):
+        '''
+        Enables or disables read deadlines tuned per command and reply
+        count from observed reply latency. The deadline is the percentile
+        of the latency plus margin seconds, bounded by min_timeout and
+        max_timeout. None leaves a value unchanged. When disabled every
+        read waits up to the timeout given at construction.
+        '''
+        if (percentile is not None) and ((percentile <= 0) or (percentile > 100)):
+            raise ZaberError('percentile must be > 0 and <= 100')
+        if (margin is not None) and (margin < 0):
+            raise ZaberError('margin must be >= 0')
+        current_min,current_max = self._read_timeouts.get_bounds()
+        if min_timeout is None:
+            min_timeout = current_min
+        if max_timeout is None:
+            max_timeout = current_max
+        if (min_timeout <= 0) or (max_timeout < min_timeout):
+            raise ZaberError('timeout bounds must satisfy 0 < min_timeout <= max_timeout')
+        self._read_timeouts.set_enabled(enabled)
+        self._read_timeouts.set_policy(percentile,margin)
+        self._read_timeouts.set_bounds(min_timeout,max_timeout)
+
+    def get_read_timeouts(self):
+        '''
+        Returns the current read deadline and latency statistics of every
+        kind of query, see ReadTimeoutTuner.get_timeouts.
+        '''
+        return self._read_timeouts.get_timeouts()
+
+    def reset_read_timeouts(self):
+        self._read_timeouts.reset()
+
+    def get_retry_count(self):
+        '''
+        Returns the number of queries repeated because replies were
+        missing or out of order.
+        '''
+        return self._retry_count
+
+    def get_reconnect_count(self):
+        '''
+        Returns the number of times the serial connection has been restored.
+        '''
+        return self._reconnect_count
+
+    def _change_baudrate(self,baudrate):
+        '''
+        Asks every actuator in the chain to switch baudrate, then
+        switches the host serial port to match.
+        '''
+        baudrate = int(baudrate)
+        self._send_request(122,None,baudrate)
+        time.sleep(self._BAUDRATE_SWITCH_DELAY)
+        with self._lock:
+            self._serial_interface.baudrate = baudrate
+            self._clear_receive_buffer()
+        self._debug_print('baudrate', baudrate)
+
+    def _check_communication(self):
+        '''
+        Returns True if the chain echoes data back at the current baudrate.
+        '''
+        test_data = 123
+        try:
+            return self.echo_data(test_data) == test_data
+        except (ZaberError,ReadError,WriteError,TypeError,OSError):
+            return False
+
+    def _negotiate_baudrate(self,baudrates):
+        '''
+        Switches the chain and host serial port to the fastest baudrate in
+        baudrates that the chain acknowledges. Falls back to the initial
+        baudrate if no faster baudrate works.
+        '''
+        for baudrate in sorted(baudrates,reverse=True):
+            if baudrate <= self.get_baudrate():
+                break
+            self._change_baudrate(baudrate)
+            if self._check_communication():
+                return baudrate
+            self._debug_print('baudrate {0} not supported'.format(baudrate))
+            self._revert_baudrate()
+        return self.get_baudrate()
+
+    def _revert_baudrate(self):
+        '''
+        Returns the chain and host serial port to the initial baudrate.
+        '''
+        if not self._serial_interface.is_open:
+            return
+        if self._serial_interface.baudrate == self._baudrate_initial:
+            return
+        try:
+            self._change_baudrate(self._baudrate_initial)
+        except (serial.SerialException,WriteError,IOError):
+            pass
+
+    def get_baudrate(self):
+        '''
+        Returns the baudrate currently used by the host serial port.
+        '''
+        return self._serial_interface.baudrate
+
+    def set_high_speed(self,baudrates=None):
+        '''
+        Switches the chain and host serial port to the fastest supported
+        baudrate and returns it. The initial baudrate is restored on close.
+        '''
+        if baudrates is None:
+            baudrates = BAUDRATES
+        return self._negotiate_baudrate(baudrates)
 
     def close(self):
         '''
         Close the device serial port.
         '''
+        with _open_devices_lock:
+            _open_devices.discard(self)
+        self._revert_baudrate()
         self._serial_interface.close()
 
+    def get_idle_time(self):
+        '''
+        Returns the seconds since the last write or reply on the port.
+        '''
+        times = [t for t in (self._time_opened,self._time_write,self._time_last_reply) if t is not None]
+        return time.monotonic() - max(times)
+
+    def close_idle(self,time_write=None):
+        '''
+        Closes the serial port to free its file descriptor until the next
+        command, which reopens it and restores the session baudrate.
+        Replies that arrive while closed are lost, so only call it when no
+        move is running. With time_write, the last write time seen when
+        that was checked, the port is left open if anything was written
+        since. Returns True if the port was closed.
+        '''
+        with self._lock:
+            with self._write_lock:
+                if self._idle_closed or (not self._serial_interface.is_open):
+                    return False
+                if (time_write is not None) and (self._time_write != time_write):
+                    return False
+                # writes from other threads now wait until the port is closed
+                self._idle_closing = threading.get_ident()
+            try:
+                baudrate = self.get_baudrate()
+                # route replies still arriving for moves that just ended
+                self._collect_replies(None,None,frame_time(baudrate,1))
+                self._revert_baudrate()
+                with self._write_lock:
+                    self._serial_interface.close()
+                    self._idle_baudrate = baudrate
+                    self._idle_closed = True
+                    self._port_timeout = None
+                    self._rx_start = self._rx_end = 0
+            finally:
+                self._idle_closing = None
+        self._debug_print('closed idle port', self.get_port())
+        return True
+
+    def is_idle_closed(self):
+        return self._idle_closed
+
+    def _reopen_idle(self):
+        with self._lock:
+            if not self._idle_closed:
+                return
+            self._serial_interface.open()
+            self._idle_closed = False
+            self._time_opened = time.monotonic()
+            if self._idle_baudrate != self.get_baudrate():
+                self._change_baudrate(self._idle_baudrate)
+        self._debug_print('reopened idle port', self.get_port())
+
     def get_port(self):
         return self._serial_interface.port
 
@@ -267,18 +1087,23 @@ class ZaberDevice(object):
         Sets the actuator to its power-up condition.
         '''
         self._send_request(0,actuator)
+        self._track_command(actuator,0)
+        self._clear_expected_motion(actuator)
 
     def home(self,actuator=None):
         '''
         Moves to the home position and resets the actuator's internal position.
         '''
         self._send_request(1,actuator)
+        self._track_command(actuator,1)
+        self._expect_motion(actuator,None,home=True)
 
     def renumber(self):
         '''
         Assigns new numbers to all the actuators in the order in which they are connected.
         '''
         self._send_request(2,None)
+        self.set_actuator_numbers(None)
 
     def store_position(self,address,actuator=None):
         '''
@@ -308,6 +1133,8 @@ class ZaberDevice(object):
         if (address < POSITION_ADDRESS_MIN) or (address > POSITION_ADDRESS_MAX):
             raise ZaberError('address must be between {0} and {1}'.format(POSITION_ADDRESS_MIN,POSITION_ADDRESS_MAX))
         self._send_request(18,actuator,address)
+        self._track_command(actuator,18,address)
+        self._expect_motion(actuator,None)
 
     def move_absolute(self,position,actuator=None):
         '''
@@ -316,6 +1143,7 @@ class ZaberDevice(object):
         if position < 0:
             return
         self._send_request(20,actuator,position)
+        self._record_motion(20,actuator,position)
 
     def find_actuator_count(self):
         '''
@@ -325,17 +1153,19 @@ class ZaberDevice(object):
         actuator = 0
         command = 55
         with self._lock:
-            args_list = self._data_to_args_list(data)
-            request = self._args_to_request(actuator,command,*args_list)
-            self._debug_print('request', [ord(c) for c in request])
+            request = self._args_to_request_bytes(actuator,command,data)
+            self._debug_print('request', list(request))
             actuator_count = None
             request_attempt = 0
             while (actuator_count is None) and (request_attempt < REQUEST_ATTEMPTS_MAX):
-                response = self._serial_interface.write_read(request,use_readline=False,size=READ_SIZE)
-                self._debug_print('len(response)',len(response))
                 request_attempt += 1
-                if (len(response) % RESPONSE_LENGTH) == 0:
-                    actuator_count = len(response) // RESPONSE_LENGTH
+                try:
+                    response_length = self._write_read(request,(command,),None)
+                except ReadError:
+                    continue
+                self._debug_print('len(response)',response_length)
+                if (response_length % RESPONSE_LENGTH) == 0:
+                    actuator_count = response_length // RESPONSE_LENGTH
         if actuator_count is None:
             actuator_count = 0
         self._debug_print('actuator_count',actuator_count)
@@ -352,24 +1182,86 @@ class ZaberDevice(object):
         Set the number of Zaber actuators connected in a chain.
         '''
         self._actuator_count = actuator_count
+        self._broadcast_reply_count = None
+        self._invalidate_tracked_positions()
+
+    def _request_replies(self,command,actuator=None,data=None):
+        '''
+        Sends request and returns a list of (actuator,command,data) tuples,
+        one per reply frame, using raw device numbers minus one and without
+        checking actuator numbering. Waits the full read timeout.
+        '''
+        with self._lock:
+            if actuator is None:
+                actuator = 0
+            else:
+                actuator = int(actuator) + 1
+            request = self._args_to_request_bytes(actuator,command,data)
+            reply_commands = self._reply_commands(command,data)
+            response_length = self._call_with_reconnect(command,self._write_read,request,reply_commands,None)
+            replies = []
+            for offset in range(0,response_length,RESPONSE_LENGTH):
+                number,cmd,value = RESPONSE_STRUCT.unpack_from(self._response_view,offset)
+                replies.append((number-1,cmd,value))
+        return replies
+
+    def set_actuator_numbers(self,actuator_numbers):
+        '''
+        Maps actuator indices to device numbers in software, so actuator n
+        is addressed as device number actuator_numbers[n]+1 and replies are
+        ordered by actuator index. Lets a chain with gaps or swapped
+        cables be used without renumbering. None restores the identity
+        mapping.
+        '''
+        with self._lock:
+            if actuator_numbers is None:
+                self._actuator_numbers = None
+                self._actuator_indices = None
+            else:
+                actuator_numbers = [int(number) for number in actuator_numbers]
+                if len(set(actuator_numbers)) != len(actuator_numbers):
+                    raise ZaberError('actuator numbers must be unique')
+                self._actuator_numbers = actuator_numbers
+                self._actuator_indices = {number: index for index,number in enumerate(actuator_numbers)}
+                self._actuator_count = len(actuator_numbers)
+            self._aliases = None
+            self._kinematic_model = None
+            self._expected_motions = {}
+            self._expected_positions = {}
+            self._broadcast_reply_count = None
+            self._invalidate_tracked_positions()
+
+    def get_actuator_numbers(self):
+        '''
+        Returns the device number minus one of each actuator index, or None
+        when actuators are numbered in chain order.
+        '''
+        if self._actuator_numbers is None:
+            return None
+        return list(self._actuator_numbers)
 
     def move_relative(self,position,actuator=None):
         '''
         Moves the actuator by the positive or negative number of microsteps specified.
         '''
         self._send_request(21,actuator,position)
+        self._record_motion(21,actuator,position)
 
     def move_at_speed(self,speed,actuator=None):
         '''
         Moves the actuator at a constant speed until stop is commanded or a limit is reached.
         '''
         self._send_request(22,actuator,speed)
+        self._track_command(actuator,22,speed)
+        self._clear_expected_motion(actuator)
 
     def stop(self,actuator=None):
         '''
         Stops the device from moving by preempting any move instruction.
         '''
         self._send_request(23,actuator)
+        self._track_command(actuator,23)
+        self._clear_expected_motion(actuator)
 
     def restore_settings(self):
         '''
@@ -490,12 +1382,14 @@ class ZaberDevice(object):
         Disables the potentiometer preventing manual adjustment.
         '''
         self._set_actuator_mode_bit(3,actuator)
+        self._invalidate_tracked_positions(actuator)
 
     def enable_potentiometer(self,actuator=None):
         '''
         Enables the potentiometer allowing manual adjustment.
         '''
         self._clear_actuator_mode_bit(3,actuator)
+        self._invalidate_tracked_positions(actuator)
 
     def disable_power_led(self,actuator=None):
         '''
@@ -534,6 +1428,7 @@ class ZaberDevice(object):
         Sets the speed at which the actuator moves when using the "Home" command.
         '''
         self._send_request(41,actuator,speed)
+        self._kinematic_model = None
 
     def get_home_speed(self):
         '''
@@ -548,6 +1443,7 @@ class ZaberDevice(object):
         Sets the speed at which the actuator moves when using "move_absolute" or "move_relative" commands.
         '''
         self._send_request(42,actuator,speed)
+        self._kinematic_model = None
 
     def get_target_speed(self):
         '''
@@ -562,6 +1458,7 @@ class ZaberDevice(object):
         Sets the acceleration used by the movement commands.
         '''
         self._send_request(43,actuator,acceleration)
+        self._kinematic_model = None
 
     def get_acceleration(self):
         '''
@@ -609,12 +1506,25 @@ class ZaberDevice(object):
         if (alias < ALIAS_MIN) or (alias > ALIAS_MAX):
             raise ZaberError('alias must be between {0} and {1}'.format(ALIAS_MIN,ALIAS_MAX))
         self._send_request(48,actuator,alias+1)
+        self._aliases = None
+
+    def apply_profile(self,settings,dry_run=False):
+        '''
+        Reads the settings named in settings in one batch and writes only
+        the values that differ. settings is a dictionary keyed by actuator
+        index, or 'all' for every actuator, see profile.apply_profile.
+        Returns the writes made as (setting,actuator,value,previous_value)
+        tuples.
+        '''
+        from .profile import apply_device
+        return apply_device(self,settings,dry_run)
 
     def remove_alias(self,actuator=None):
         '''
         Removes the alternate device number for the actuator.
         '''
         response = self._send_request_get_response(48,actuator,0)
+        self._aliases = None
         return response
 
     def moving(self):
@@ -622,8 +1532,11 @@ class ZaberDevice(object):
         Returns True if actuator is moving, False otherwise
         '''
         actuator = None
-        response = self._send_request_get_response(54,actuator)
-        response = [bool(r) for r in response]
+        with self._lock:
+            response = self._send_request_get_response(54,actuator)
+            response = [bool(r) for r in response]
+            if self._position_tracker is not None:
+                self._position_tracker.observe_moving(response,self._time_query_write)
         return response
 
     def echo_data(self,data):
@@ -641,11 +1554,254 @@ class ZaberDevice(object):
     def get_position(self):
         '''
         Returns the current absolute position of the actuator in microsteps.
-        '''
+        With position tracking enabled, positions of actuators confirmed
+        idle are returned without a serial round trip.
+        '''
+        if self._position_tracker is not None:
+            with self._lock:
+                # replies that have already arrived may change tracked state
+                self._collect_replies(None,None,0)
+                actuator_count = self._actuator_count
+                if actuator_count is None:
+                    actuator_count = self._broadcast_reply_count
+                if actuator_count is not None:
+                    positions = self._position_tracker.get_positions(actuator_count)
+                    if positions is not None:
+                        return positions
+        return self._query_position()
+
+    def _query_position(self):
         actuator = None
-        response = self._send_request_get_response(60,actuator)
+        with self._lock:
+            response = self._send_request_get_response(60,actuator)
+            if self._position_tracker is not None:
+                self._position_tracker.observe_positions(response,self._time_query_write)
+        self._expected_positions = dict(enumerate(response))
         return response
 
+    def get_position_timed(self):
+        '''
+        Returns the current absolute position of the actuator in microsteps
+        along with time.monotonic() timestamps taken just before the
+        request was written and just after the reply was read. Always
+        queries the actuators.
+        '''
+        with self._lock:
+            response = self._query_position()
+            return response,self._time_query_write,self._time_read
+
+    def _record_motion(self,command,actuator,data):
+        '''
+        Updates tracked positions and move time predictions after a move
+        absolute or move relative request has been written.
+        '''
+        self._track_command(actuator,command,data)
+        if command == 20:
+            self._expect_motion(actuator,None,target=int(data))
+        else:
+            self._expect_motion(actuator,int(data))
+
+    def _track_command(self,actuator,command,data=None):
+        if self._position_tracker is None:
+            return
+        with self._lock:
+            self._position_tracker.command(self._get_actuators(actuator),command,data)
+
+    def _invalidate_tracked_positions(self,actuator=None):
+        if self._position_tracker is None:
+            return
+        with self._lock:
+            if actuator is None:
+                self._position_tracker.invalidate()
+            else:
+                self._position_tracker.invalidate(self._get_actuators(actuator))
+
+    def enable_position_tracking(self,max_age=None):
+        '''
+        Tracks the last commanded target, the last position confirmed by
+        a reply and the motion state of every actuator, so get_position
+        only queries the actuators when one of them may be moving or was
+        stopped, reset, homed or moved by the potentiometer since its
+        position was last confirmed. max_age limits how many seconds a
+        confirmed position is trusted, None trusts it until invalidated.
+        '''
+        if (max_age is not None) and (max_age < 0):
+            raise ZaberError('max_age must be >= 0')
+        with self._lock:
+            if self._position_tracker is None:
+                self._position_tracker = ZaberPositionTracker(max_age)
+            else:
+                self._position_tracker.set_max_age(max_age)
+
+    def disable_position_tracking(self):
+        with self._lock:
+            self._position_tracker = None
+
+    def get_position_tracker(self):
+        '''
+        Returns the ZaberPositionTracker, or None when position tracking
+        is disabled.
+        '''
+        return self._position_tracker
+
+    def _get_actuators(self,actuator):
+        '''
+        Returns the actuator indices addressed by actuator, which may be an
+        actuator index, an alias or None for all actuators.
+        '''
+        if self._aliases is None:
+            self._aliases = self.get_alias()
+        if actuator is None:
+            return list(range(len(self._aliases)))
+        actuator = int(actuator)
+        actuators = [n for n,alias in enumerate(self._aliases) if (alias == actuator) or (n == actuator)]
+        return actuators
+
+    def _kinematic_model_actuators(self):
+        if self._kinematic_model is None:
+            self._kinematic_model = ZaberKinematicModel.from_device(self)
+        return range(self._kinematic_model.get_actuator_count())
+
+    def _expect_motion(self,actuator,distance,target=None,home=False):
+        '''
+        Records the start time and predicted duration of a move so
+        wait_until_idle can sleep until just before it should finish.
+        '''
+        if not self._kinematic_model_enabled:
+            return
+        t_start = time.monotonic()
+        # settings changes drop the model, rebuild it from the new settings
+        self._kinematic_model_actuators()
+        for a in self._get_actuators(actuator):
+            a_distance = distance
+            start = self._expected_positions.get(a)
+            if (a_distance is None) and (start is not None):
+                if home:
+                    a_distance = start
+                elif target is not None:
+                    a_distance = target - start
+            # where this move ends is where the next one starts
+            if home:
+                self._expected_positions[a] = 0
+            elif target is not None:
+                self._expected_positions[a] = target
+            elif (distance is not None) and (start is not None):
+                self._expected_positions[a] = start + distance
+            else:
+                self._expected_positions.pop(a,None)
+            if a_distance is None:
+                self._expected_motions.pop(a,None)
+                continue
+            if home:
+                raw_duration = self._kinematic_model.predict_home_raw(a,a_distance)
+            else:
+                raw_duration = self._kinematic_model.predict_move_raw(a,a_distance)
+            self._expected_motions[a] = (t_start,raw_duration)
+
+    def _clear_expected_motion(self,actuator):
+        '''
+        Forgets the predicted move and the expected position of actuators
+        stopped, reset or moving at speed, whose end position is unknown.
+        '''
+        if not self._kinematic_model_enabled:
+            return
+        for a in self._get_actuators(actuator):
+            self._expected_motions.pop(a,None)
+            self._expected_positions.pop(a,None)
+
+    def enable_kinematic_model(self):
+        '''
+        Reads speed, acceleration and microstep resolution settings and
+        predicts the duration of every following move so wait_until_idle
+        can skip polling until a move is about to finish.
+        '''
+        self._kinematic_model = ZaberKinematicModel.from_device(self)
+        self._kinematic_model_enabled = True
+
+    def disable_kinematic_model(self):
+        self._kinematic_model_enabled = False
+        self._expected_motions = {}
+        self._expected_positions = {}
+
+    def get_kinematic_model(self):
+        '''
+        Returns the ZaberKinematicModel, reading settings if needed.
+        '''
+        self._kinematic_model_actuators()
+        return self._kinematic_model
+
+    def estimate_move_time(self,distance,actuator=0):
+        '''
+        Returns the predicted duration in seconds of a move of distance
+        microsteps by one actuator.
+        '''
+        return self.get_kinematic_model().predict_move(actuator,distance)
+
+    def wait_until_idle(self,actuator=None,timeout=None):
+        '''
+        Waits until the actuators stop moving and returns the time waited.
+        actuator may be an actuator, an alias, a list of either or None
+        for all actuators. With the kinematic model enabled, sleeps until
+        just before the latest predicted move end before the first
+        moving() poll, and refines the model from the completion time of
+        moves a poll still saw running.
+        '''
+        t_start = time.monotonic()
+        actuators = None
+        if isinstance(actuator,(list,tuple)):
+            actuators = []
+            for a in actuator:
+                actuators.extend(self._get_actuators(a))
+        elif actuator is not None:
+            actuators = self._get_actuators(actuator)
+        model = self._kinematic_model
+        expected = {}
+        if self._kinematic_model_enabled and (model is not None):
+            for a in list(self._expected_motions.keys()):
+                if (actuators is None) or (a in actuators):
+                    expected[a] = self._expected_motions[a]
+            t_first_poll = None
+            for a in expected:
+                t_move_start,raw_duration = expected[a]
+                t_poll = t_move_start + self._POLL_LEAD*model.correct(a,raw_duration)
+                if (t_first_poll is None) or (t_poll > t_first_poll):
+                    t_first_poll = t_poll
+            if t_first_poll is not None:
+                delay = t_first_poll - time.monotonic()
+                if timeout is not None:
+                    delay = min(delay,timeout)
+                if delay > 0:
+                    time.sleep(delay)
+        # only a move seen running has its completion time bracketed by
+        # polls, a caller arriving late would inflate the correction
+        seen_moving = set()
+        while True:
+            self._poll_count += 1
+            movings = self.moving()
+            t_now = time.monotonic()
+            seen_moving.update(a for a in expected if movings[a])
+            if actuators is None:
+                moving = any(movings)
+            else:
+                moving = any(movings[a] for a in actuators)
+            if not moving:
+                break
+            if (timeout is not None) and ((t_now - t_start) >= timeout):
+                raise ZaberError('actuators still moving after {0} s'.format(timeout))
+            time.sleep(self._POLL_PERIOD)
+        for a in expected:
+            t_move_start,raw_duration = expected[a]
+            if a in seen_moving:
+                model.observe(a,raw_duration,t_now - t_move_start)
+            self._expected_motions.pop(a,None)
+        return t_now - t_start
+
+    def get_poll_count(self):
+        '''
+        Returns the number of moving() polls made by wait_until_idle.
+        '''
+        return self._poll_count
+
     def set_serial_number(self,serial_number):
         '''
         Sets serial number. Useful for talking communicating with ZaberDevices on multiple serial ports.
@@ -672,10 +1828,18 @@ class ZaberDevice(object):
         response = self._send_request_get_response(35,actuator,data)
         response = response[0]
         response = response >> 8
+        self._serial_number = response
         return response
 
     def get_zaber_response(self):
-        return self._zaber_response
+        '''
+        Returns the bytes of the most recent reply as a string of a list.
+        '''
+        with self._lock:
+            return self._format_response()
+
+    def _format_response(self):
+        return str(list(self._response_view[:self._response_length]))
 
     def _map_list(self,x_list,in_min,in_max,out_min,out_max):
         return [int((x-in_min)*(out_max-out_min)/(in_max-in_min)+out_min) for x in x_list]
@@ -701,27 +1865,169 @@ class ZaberDevices(dict):
     devs = ZaberDevices(use_ports=['COM3','COM4']) # Windows
     devs.keys()
     dev = devs[serial_number]
+    # with known serial numbers, each device is opened on first access
+    devs = ZaberDevices(device_ports={123: '/dev/ttyUSB0', 124: '/dev/ttyUSB1'})
+    # and ports idle for 60 s are closed until the next command
+    devs = ZaberDevices(device_ports={123: '/dev/ttyUSB0'},idle_timeout=60)
     '''
     def __init__(self,*args,**kwargs):
-        if ('use_ports' not in kwargs) or (kwargs['use_ports'] is None):
-            zaber_device_ports = find_zaber_device_ports(*args,**kwargs)
+        self._device_args = args
+        self._device_kwargs = None
+        self._device_ports = {}
+        self._open_lock = threading.Lock()
+        self._idle_thread = None
+        self._idle_stop_event = threading.Event()
+        if 'idle_timeout' in kwargs:
+            self._idle_timeout = kwargs.pop('idle_timeout')
+        else:
+            self._idle_timeout = None
+        if ('device_ports' in kwargs) and (kwargs['device_ports'] is not None):
+            device_ports = kwargs.pop('device_ports')
+            kwargs.pop('use_ports',None)
+            self._device_kwargs = kwargs
+            for serial_number in device_ports:
+                self._device_ports[int(serial_number)] = device_ports[serial_number]
+                dict.__setitem__(self,int(serial_number),None)
         else:
-            zaber_device_ports = kwargs.pop('use_ports')
+            if ('use_ports' not in kwargs) or (kwargs['use_ports'] is None):
+                zaber_device_ports = find_zaber_device_ports(*args,**kwargs)
+            else:
+                zaber_device_ports = kwargs.pop('use_ports')
 
-        for port in zaber_device_ports:
-            kwargs.update({'port': port})
-            self._add_device(*args,**kwargs)
+            for port in zaber_device_ports:
+                kwargs.update({'port': port})
+                self._add_device(*args,**kwargs)
+        if self._idle_timeout is not None:
+            self._start_idle_thread()
 
     def _add_device(self,*args,**kwargs):
         dev = ZaberDevice(*args,**kwargs)
         serial_number = dev.get_serial_number()
         self[serial_number] = dev
 
+    def __getitem__(self,serial_number):
+        dev = dict.__getitem__(self,serial_number)
+        if dev is None:
+            dev = self._open_device(serial_number)
+        return dev
+
+    def get(self,serial_number,default=None):
+        if serial_number in self:
+            return self[serial_number]
+        return default
+
+    def values(self):
+        return [self[serial_number] for serial_number in self]
+
+    def items(self):
+        return [(serial_number,self[serial_number]) for serial_number in self]
+
+    def _open_device(self,serial_number):
+        '''
+        Opens the device of a lazy entry, trusting the serial number of
+        its port instead of reading it.
+        '''
+        with self._open_lock:
+            dev = dict.__getitem__(self,serial_number)
+            if dev is None:
+                kwargs = dict(self._device_kwargs)
+                port = self._device_ports[serial_number]
+                if isinstance(port,str):
+                    kwargs['port'] = port
+                else:
+                    # an already open port or a ZaberSimulator
+                    kwargs['serial_interface'] = port
+                dev = ZaberDevice(*self._device_args,**kwargs)
+                # lets reconnect verify the session and find a moved device
+                dev._serial_number = serial_number
+                dict.__setitem__(self,serial_number,dev)
+        return dev
+
+    def get_open_serial_numbers(self):
+        '''
+        Returns the serial numbers of devices with an open serial port.
+        '''
+        return [serial_number for serial_number,dev in dict.items(self)
+                if (dev is not None) and (not dev.is_idle_closed())]
+
+    def close_idle_devices(self,idle_timeout=None):
+        '''
+        Closes the ports of open devices with no writes or replies for
+        idle_timeout seconds, or the idle_timeout given on creation, that
+        are not waiting for move completion replies and report no
+        actuator moving, so a long move is never cut off from its
+        completion reply. Closed ports reopen on the next command.
+        Returns the serial numbers closed.
+        '''
+        if idle_timeout is None:
+            idle_timeout = self._idle_timeout
+        closed = []
+        for serial_number,dev in list(dict.items(self)):
+            if (dev is None) or dev.is_idle_closed() or dev._awaited_replies:
+                continue
+            if dev.get_idle_time() < idle_timeout:
+                continue
+            try:
+                with dev._lock:
+                    if any(dev.moving()):
+                        continue
+                    # fire-and-forget moves only take the write lock, so
+                    # close only if nothing was written since the moving query
+                    if dev.close_idle(dev._time_query_write):
+                        closed.append(serial_number)
+            except Exception as e:
+                dev._debug_print('could not close idle port', dev.get_port(), e)
+        return closed
+
+    def _run_idle(self):
+        period = min(max(self._idle_timeout/4.0,0.01),1.0)
+        while not self._idle_stop_event.wait(period):
+            self.close_idle_devices()
+
+    def _start_idle_thread(self):
+        self._idle_thread = threading.Thread(target=self._run_idle,name='ZaberDevicesIdle')
+        self._idle_thread.daemon = True
+        self._idle_thread.start()
+
+    def close(self):
+        '''
+        Stops closing idle ports and closes every opened device.
+        '''
+        if self._idle_thread is not None:
+            self._idle_stop_event.set()
+            self._idle_thread.join()
+            self._idle_thread = None
+        for dev in dict.values(self):
+            if dev is not None:
+                dev.close()
+
+    def apply_profile(self,profile,dry_run=False):
+        '''
+        Applies a profile dictionary or JSON or YAML file keyed by serial
+        number to every device in parallel, writing only changed
+        settings. Returns the writes made per serial number.
+        '''
+        from .profile import apply_profile
+        return apply_profile(self,profile,dry_run)
+
+    def home(self,force=False,fast_rehome=False,timeout=None):
+        '''
+        Homes the actuators that are not homed on every device in
+        parallel and waits for their completion replies. Returns a report
+        per serial number, see home_devices.
+        '''
+        from .homing import home_devices, HOME_TIMEOUT
+        if timeout is None:
+            timeout = HOME_TIMEOUT
+        return home_devices(self,force,fast_rehome,timeout)
+
 
 class ZaberStage(object):
     '''
     ZaberStage contains an instance of ZaberDevices and adds
-    methods to it to use it as an xyz stage.
+    methods to it to use it as a stage with any number of named axes.
+    The x, y, and z methods are shortcuts for the axes named 'x', 'y',
+    and 'z'.
     Example Usage:
     stage = ZaberStage()  # Might automatically find all available devices
     # if they are not found automatically, specify ports to use
@@ -777,20 +2083,20 @@ class ZaberStage(object):
     stage.move_to_stored_x_position(0)
     stage.get_positions()
     [49.99980078125, 74.99994921875, 0.0]
+    # any number of named axes
+    stage.set_axis('theta',serial_number,12,microstep_size=0.000234375)
+    stage.move_absolute({'x': 10, 'theta': 90})
+    stage.get_axis_positions(['x','theta'])
+    {'x': 9.99996015625, 'theta': 89.999765625}
     '''
+    _LEGACY_AXES = ('x','y','z')
+
     def __init__(self,*args,**kwargs):
         self._devs = ZaberDevices(*args,**kwargs)
         if len(self._devs) == 0:
             raise ZaberError('Could not find any Zaber devices. Check connections and permissions.')
-        self._x_axis = None
-        self._y_axis = None
-        self._z_axis = None
-        self._x_microstep_size = 1
-        self._y_microstep_size = 1
-        self._z_microstep_size = 1
-        self._x_travel = None
-        self._y_travel = None
-        self._z_travel = None
+        self._axes = {}
+        self._sync_dispatcher = None
 
     def get_aliases(self):
         '''
@@ -823,76 +2129,176 @@ class ZaberStage(object):
             for actuator in range(len(aliases[serial_number])):
                 dev.set_alias(actuator,aliases[serial_number][actuator])
 
-    def _set_axis(self,axis,serial_number,alias):
+    def _get_axis(self,axis):
+        '''
+        Returns the record of axis, creating an unset one if needed.
+        '''
+        try:
+            return self._axes[axis]
+        except KeyError:
+            ax = {'serial_number': None,
+                  'dev': None,
+                  'alias': None,
+                  'actuator': None,
+                  'microstep_size': 1,
+                  'calibration': None,
+                  'travel': None}
+            self._axes[axis] = ax
+            return ax
+
+    def _set_axes(self,axes=None):
+        '''
+        Returns (axis,record) pairs for the set axes among axes, or for
+        every set axis when axes is None.
+        '''
+        if axes is None:
+            axes = self._axes.keys()
+        elif isinstance(axes,str):
+            axes = [axes]
+        set_axes = []
+        for axis in axes:
+            ax = self._axes.get(axis)
+            if (ax is not None) and (ax['dev'] is not None):
+                set_axes.append((axis,ax))
+        return set_axes
+
+    def _get_scale(self,ax):
+        '''
+        Returns the stage units per microstep of an axis record, the mean
+        over the calibration table when one is set.
+        '''
+        if ax['calibration'] is None:
+            return ax['microstep_size']
+        return ax['calibration'].get_scale()
+
+    def _to_positions(self,ax,microsteps):
+        if ax['calibration'] is None:
+            if isinstance(microsteps,(int,float)):
+                return microsteps*ax['microstep_size']
+            from .calibration import scale
+            return scale(microsteps,ax['microstep_size'])
+        return ax['calibration'].to_positions(microsteps)
+
+    def _to_microsteps(self,ax,positions):
+        if ax['calibration'] is None:
+            try:
+                return float(positions)/ax['microstep_size']
+            except TypeError:
+                from .calibration import scale
+                return scale(positions,1.0/ax['microstep_size'])
+        return ax['calibration'].to_microsteps(positions)
+
+    def _distance_to_microsteps(self,ax,distance):
+        '''
+        Returns a relative move of distance in stage units in microsteps.
+        With a calibration table the distance depends on where the move
+        starts, so the position of the actuator is read first.
+        '''
+        if ax['calibration'] is None:
+            return float(distance)/ax['microstep_size']
+        current = ax['dev'].get_position()[ax['actuator']]
+        target = ax['calibration'].to_microsteps(ax['calibration'].to_positions(current) + float(distance))
+        return target - current
+
+    def _query_axes(self,method,axes=None):
+        '''
+        Calls method once per device holding any of axes and returns a
+        dictionary with axis names as keys and the reply of each axis
+        actuator as values.
+        '''
+        set_axes = self._set_axes(axes)
+        replies = {}
+        values = {}
+        for axis,ax in set_axes:
+            serial_number = ax['serial_number']
+            if serial_number not in replies:
+                replies[serial_number] = getattr(ax['dev'],method)()
+            values[axis] = replies[serial_number][ax['actuator']]
+        return values
+
+    def set_axis(self,axis,serial_number,alias,microstep_size=None,travel=None):
+        '''
+        Assigns the actuator with alias on device serial_number to the
+        named axis, optionally setting its microstep size and travel.
+        '''
         serial_number = int(serial_number)
         alias = int(alias)
-        ax = {}
+        dev = self._devs[serial_number]
+        ax = self._get_axis(axis)
+        ax['actuator'] = dev.get_alias().index(alias)
         ax['serial_number'] = serial_number
-        ax['dev'] = self._devs[serial_number]
+        ax['dev'] = dev
         ax['alias'] = alias
-        aliases = self.get_aliases()
-        ax['actuator'] = aliases[serial_number].index(alias)
-        if axis == 'x':
-            self._x_axis = ax
-        elif axis == 'y':
-            self._y_axis = ax
-        elif axis == 'z':
-            self._z_axis = ax
+        if microstep_size is not None:
+            self.set_microstep_size(axis,microstep_size)
+        if travel is not None:
+            self.set_travel(axis,travel)
+
+    def get_axes(self):
+        '''
+        Returns the names of the set axes.
+        '''
+        return [axis for axis,ax in self._set_axes()]
+
+    def get_axes_info(self):
+        '''
+        Returns a dictionary with axis names as keys and the serial_number,
+        alias, actuator, microstep_size, calibration, and travel of each
+        set axis as values.
+        '''
+        axes_info = {}
+        for axis,ax in self._set_axes():
+            axes_info[axis] = {'serial_number': ax['serial_number'],
+                               'alias': ax['alias'],
+                               'actuator': ax['actuator'],
+                               'microstep_size': ax['microstep_size'],
+                               'calibration': ax['calibration'],
+                               'travel': ax['travel']}
+        return axes_info
 
     def set_x_axis(self,serial_number,alias):
-        self._set_axis('x',serial_number,alias)
+        self.set_axis('x',serial_number,alias)
 
     def set_y_axis(self,serial_number,alias):
-        self._set_axis('y',serial_number,alias)
+        self.set_axis('y',serial_number,alias)
 
     def set_z_axis(self,serial_number,alias):
-        self._set_axis('z',serial_number,alias)
-
-    def _move_at_speed(self,axis,speed):
-        speed = float(speed)
-        if axis == 'x':
-            ax = self._x_axis
-            speed /= (9.375*self._x_microstep_size)
-        elif axis == 'y':
-            ax = self._y_axis
-            speed /= (9.375*self._y_microstep_size)
-        elif axis == 'z':
-            ax = self._z_axis
-            speed /= (9.375*self._z_microstep_size)
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.move_at_speed(speed,alias)
+        self.set_axis('z',serial_number,alias)
+
+    def move_at_speed(self,speeds):
+        '''
+        Moves each axis in speeds, a dictionary with axis names as keys,
+        at a constant speed in stage units per second. Axes with a
+        calibration table use its mean stage units per microstep.
+        '''
+        for axis,ax in self._set_axes(speeds):
+            speed = float(speeds[axis])/(SPEED_UNIT*self._get_scale(ax))
+            ax['dev'].move_at_speed(speed,ax['alias'])
 
     def move_x_at_speed(self,speed):
-        self._move_at_speed('x',speed)
+        self.move_at_speed({'x': speed})
 
     def move_y_at_speed(self,speed):
-        self._move_at_speed('y',speed)
+        self.move_at_speed({'y': speed})
 
     def move_z_at_speed(self,speed):
-        self._move_at_speed('z',speed)
-
-    def _stop(self,axis):
-        if axis == 'x':
-            ax = self._x_axis
-        elif axis == 'y':
-            ax = self._y_axis
-        elif axis == 'z':
-            ax = self._z_axis
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.stop(alias)
+        self.move_at_speed({'z': speed})
+
+    def stop_axes(self,axes=None):
+        '''
+        Stops the axes, or every set axis when axes is None.
+        '''
+        for axis,ax in self._set_axes(axes):
+            ax['dev'].stop(ax['alias'])
 
     def stop_x(self):
-        self._stop('x')
+        self.stop_axes('x')
 
     def stop_y(self):
-        self._stop('y')
+        self.stop_axes('y')
 
     def stop_z(self):
-        self._stop('z')
+        self.stop_axes('z')
 
     def get_positions_and_debug_info(self):
         positions = {}
@@ -905,392 +2311,529 @@ class ZaberStage(object):
             positions[serial_number]['position_microstep'] = [0,0,0]
             positions[serial_number]['position'] = [0.0,0.0,0.0]
             positions[serial_number]['response_time'] = time.time()
-            if self._x_axis is not None:
-                positions[serial_number]['position'][0] = position_microstep[self._x_axis['actuator']] * self._x_microstep_size
-                positions[serial_number]['position_microstep'][0] = position_microstep[self._x_axis['actuator']]
-            if self._y_axis is not None:
-                positions[serial_number]['position'][1] = position_microstep[self._y_axis['actuator']] * self._y_microstep_size
-                positions[serial_number]['position_microstep'][1] = position_microstep[self._y_axis['actuator']]
-            if self._z_axis is not None:
-                positions[serial_number]['position'][2] = position_microstep[self._z_axis['actuator']] * self._z_microstep_size
-                positions[serial_number]['position_microstep'][2] = position_microstep[self._z_axis['actuator']]
+            for axis,ax in self._set_axes(self._LEGACY_AXES):
+                if ax['serial_number'] == serial_number:
+                    index = self._LEGACY_AXES.index(axis)
+                    positions[serial_number]['position'][index] = self._to_positions(ax,position_microstep[ax['actuator']])
+                    positions[serial_number]['position_microstep'][index] = position_microstep[ax['actuator']]
         if len(positions) == 1:
             return positions[list(positions.keys())[0]]
         else:
             return positions
 
+    def get_axis_positions(self,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and positions in stage
+        units as values, reading each device once.
+        '''
+        positions = self._query_axes('get_position',axes)
+        for axis,ax in self._set_axes(list(positions.keys())):
+            positions[axis] = self._to_positions(ax,positions[axis])
+        return positions
+
     def get_positions(self):
         positions = {}
         for serial_number in self._devs:
             dev = self._devs[serial_number]
             position_microstep = dev.get_position()
             positions[serial_number] = [0.0,0.0,0.0]
-            if self._x_axis is not None:
-                positions[serial_number][0] = position_microstep[self._x_axis['actuator']] * self._x_microstep_size
-            if self._y_axis is not None:
-                positions[serial_number][1] = position_microstep[self._y_axis['actuator']] * self._y_microstep_size
-            if self._z_axis is not None:
-                positions[serial_number][2] = position_microstep[self._z_axis['actuator']] * self._z_microstep_size
+            for axis,ax in self._set_axes(self._LEGACY_AXES):
+                if ax['serial_number'] == serial_number:
+                    positions[serial_number][self._LEGACY_AXES.index(axis)] = self._to_positions(ax,position_microstep[ax['actuator']])
         if len(positions) == 1:
             return positions[list(positions.keys())[0]]
         else:
             return positions
 
+    def get_axis_moving(self,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and moving status as
+        values, reading each device once.
+        '''
+        return self._query_axes('moving',axes)
+
     def moving(self):
-        movings = {}
+        movings = self.get_axis_moving(self._LEGACY_AXES)
+        return tuple(movings.get(axis,False) for axis in self._LEGACY_AXES)
+
+    def home(self,force=False,fast_rehome=False,timeout=None):
+        '''
+        Homes the actuators that are not homed on all devices in parallel
+        and returns once they have all finished, see home_devices.
+        '''
+        from .homing import home_devices, HOME_TIMEOUT
+        if timeout is None:
+            timeout = HOME_TIMEOUT
+        return home_devices(self,force,fast_rehome,timeout)
+
+    def enable_kinematic_model(self):
+        '''
+        Predicts move durations on every device so wait_until_idle polls
+        only when moves are about to finish.
+        '''
         for serial_number in self._devs:
-            dev = self._devs[serial_number]
-            moving = dev.moving()
-            movings[serial_number] = moving
-        if self._x_axis is not None:
-            x_moving = movings[serial_number][self._x_axis['actuator']]
-        else:
-            x_moving = False
-        if self._y_axis is not None:
-            y_moving = movings[serial_number][self._y_axis['actuator']]
-        else:
-            y_moving = False
-        if self._z_axis is not None:
-            z_moving = movings[serial_number][self._z_axis['actuator']]
-        else:
-            z_moving = False
-        return x_moving,y_moving,z_moving
+            self._devs[serial_number].enable_kinematic_model()
 
-    def home(self):
+    def enable_position_tracking(self,max_age=None):
+        '''
+        Answers position queries of idle actuators on every device from
+        tracked state, see ZaberDevice.enable_position_tracking.
+        '''
         for serial_number in self._devs:
-            dev = self._devs[serial_number]
-            dev.home()
+            self._devs[serial_number].enable_position_tracking(max_age)
 
-    def homed(self):
-        homed_dict = {}
+    def disable_position_tracking(self):
         for serial_number in self._devs:
-            dev = self._devs[serial_number]
-            homed = dev.homed()
-            homed_dict[serial_number] = homed
-        if self._x_axis is not None:
-            x_homed = homed_dict[serial_number][self._x_axis['actuator']]
-        else:
-            x_homed = True
-        if self._y_axis is not None:
-            y_homed = homed_dict[serial_number][self._y_axis['actuator']]
-        else:
-            y_homed = True
-        if self._z_axis is not None:
-            z_homed = homed_dict[serial_number][self._z_axis['actuator']]
+            self._devs[serial_number].disable_position_tracking()
+
+    def wait_until_idle(self,timeout=None,axes=None):
+        '''
+        Waits until the axes, or every actuator when axes is None, stop
+        moving and returns the time waited.
+        '''
+        t_start = time.monotonic()
+        if axes is None:
+            for serial_number in self._devs:
+                dev = self._devs[serial_number]
+                dev.wait_until_idle(timeout=timeout)
         else:
-            z_homed = True
-        return x_homed,y_homed,z_homed
+            aliases = {}
+            for axis,ax in self._set_axes(axes):
+                aliases.setdefault(ax['serial_number'],[]).append(ax['alias'])
+            for serial_number in aliases:
+                self._devs[serial_number].wait_until_idle(aliases[serial_number],timeout=timeout)
+        return time.monotonic() - t_start
+
+    def get_axis_homed(self,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and home status as
+        values, reading each device once.
+        '''
+        return self._query_axes('homed',axes)
+
+    def homed(self):
+        homed = self.get_axis_homed(self._LEGACY_AXES)
+        return tuple(homed.get(axis,True) for axis in self._LEGACY_AXES)
 
     def stop(self):
         for serial_number in self._devs:
             dev = self._devs[serial_number]
             dev.stop()
 
-    def _move_absolute(self,axis,position):
-        position = float(position)
-        if axis == 'x':
-            ax = self._x_axis
-            position /= self._x_microstep_size
-        elif axis == 'y':
-            ax = self._y_axis
-            position /= self._y_microstep_size
-        elif axis == 'z':
-            ax = self._z_axis
-            position /= self._z_microstep_size
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.move_absolute(position,alias)
+    def _move_synchronized(self,command,positions):
+        '''
+        Starts the moves of every axis together even when the axes are on
+        different ports and returns the measured skew in seconds.
+        '''
+        if self._sync_dispatcher is None:
+            from .sync import ZaberSyncDispatcher
+            self._sync_dispatcher = ZaberSyncDispatcher()
+        moves = []
+        for axis,ax in self._set_axes(positions):
+            if command == 21:
+                position = self._distance_to_microsteps(ax,positions[axis])
+            else:
+                position = self._to_microsteps(ax,positions[axis])
+            if (command == 20) and (position < 0):
+                continue
+            moves.append((ax['dev'],command,ax['alias'],position))
+        skew = self._sync_dispatcher.dispatch(moves)
+        for dev,command,alias,position in moves:
+            dev._record_motion(command,alias,position)
+        return skew
+
+    def get_sync_metrics(self):
+        '''
+        Returns the skew metrics of synchronized moves, see
+        ZaberSyncDispatcher.get_metrics.
+        '''
+        if self._sync_dispatcher is None:
+            from .sync import ZaberSyncDispatcher
+            self._sync_dispatcher = ZaberSyncDispatcher()
+        return self._sync_dispatcher.get_metrics()
+
+    def move_absolute(self,positions,synchronized=False):
+        '''
+        Moves each axis in positions, a dictionary with axis names as keys,
+        to the position in stage units. With synchronized True the moves
+        on all ports start together and the skew in seconds is returned.
+        '''
+        if synchronized:
+            return self._move_synchronized(20,positions)
+        for axis,ax in self._set_axes(positions):
+            position = self._to_microsteps(ax,positions[axis])
+            ax['dev'].move_absolute(position,ax['alias'])
 
     def move_x_absolute(self,position):
-        self._move_absolute('x',position)
+        self.move_absolute({'x': position})
 
     def move_y_absolute(self,position):
-        self._move_absolute('y',position)
+        self.move_absolute({'y': position})
 
     def move_z_absolute(self,position):
-        self._move_absolute('z',position)
-
-    def _move_relative(self,axis,position):
-        position = float(position)
-        if axis == 'x':
-            ax = self._x_axis
-            position /= self._x_microstep_size
-        elif axis == 'y':
-            ax = self._y_axis
-            position /= self._y_microstep_size
-        elif axis == 'z':
-            ax = self._z_axis
-            position /= self._z_microstep_size
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.move_relative(position,alias)
+        self.move_absolute({'z': position})
+
+    def move_relative(self,positions,synchronized=False):
+        '''
+        Moves each axis in positions, a dictionary with axis names as keys,
+        by the distance in stage units. With synchronized True the moves
+        on all ports start together and the skew in seconds is returned.
+        '''
+        if synchronized:
+            return self._move_synchronized(21,positions)
+        for axis,ax in self._set_axes(positions):
+            position = self._distance_to_microsteps(ax,positions[axis])
+            ax['dev'].move_relative(position,ax['alias'])
 
     def move_x_relative(self,position):
-        self._move_relative('x',position)
+        self.move_relative({'x': position})
 
     def move_y_relative(self,position):
-        self._move_relative('y',position)
+        self.move_relative({'y': position})
 
     def move_z_relative(self,position):
-        self._move_relative('z',position)
-
-    def _store_position(self,axis,address):
-        if axis == 'x':
-            ax = self._x_axis
-        elif axis == 'y':
-            ax = self._y_axis
-        elif axis == 'z':
-            ax = self._z_axis
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.store_position(address,alias)
+        self.move_relative({'z': position})
+
+    def store_position(self,address,axes=None):
+        '''
+        Saves the current position of the axes, or every set axis when axes
+        is None, into the address.
+        '''
+        for axis,ax in self._set_axes(axes):
+            ax['dev'].store_position(address,ax['alias'])
 
     def store_x_position(self,address):
-        self._store_position('x',address)
+        self.store_position(address,'x')
 
     def store_y_position(self,address):
-        self._store_position('y',address)
+        self.store_position(address,'y')
 
     def store_z_position(self,address):
-        self._store_position('z',address)
-
-    def _get_stored_position(self,axis,address):
-        if axis == 'x':
-            ax = self._x_axis
-            microstep_size = self._x_microstep_size
-        elif axis == 'y':
-            ax = self._y_axis
-            microstep_size = self._y_microstep_size
-        elif axis == 'z':
-            ax = self._z_axis
-            microstep_size = self._z_microstep_size
-        if ax is not None:
-            dev = ax['dev']
-            actuator = ax['actuator']
-            positions = dev.get_stored_position(address)
-            position = positions[actuator]
-            position *= microstep_size
-            return position
+        self.store_position(address,'z')
+
+    def get_stored_position(self,address,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and the positions in
+        stage units stored at the address as values.
+        '''
+        set_axes = self._set_axes(axes)
+        replies = {}
+        positions = {}
+        for axis,ax in set_axes:
+            serial_number = ax['serial_number']
+            if serial_number not in replies:
+                replies[serial_number] = ax['dev'].get_stored_position(address)
+            positions[axis] = self._to_positions(ax,replies[serial_number][ax['actuator']])
+        return positions
 
     def get_stored_x_position(self,address):
-        return self._get_stored_position('x',address)
+        return self.get_stored_position(address,'x').get('x')
 
     def get_stored_y_position(self,address):
-        return self._get_stored_position('y',address)
+        return self.get_stored_position(address,'y').get('y')
 
     def get_stored_z_position(self,address):
-        return self._get_stored_position('z',address)
-
-    def _move_to_stored_position(self,axis,address):
-        if axis == 'x':
-            ax = self._x_axis
-        elif axis == 'y':
-            ax = self._y_axis
-        elif axis == 'z':
-            ax = self._z_axis
-        if ax is not None:
-            dev = ax['dev']
-            alias = ax['alias']
-            dev.move_to_stored_position(address,alias)
+        return self.get_stored_position(address,'z').get('z')
+
+    def move_to_stored_position(self,address,axes=None):
+        '''
+        Moves the axes, or every set axis when axes is None, to the
+        position stored at the address.
+        '''
+        for axis,ax in self._set_axes(axes):
+            ax['dev'].move_to_stored_position(address,ax['alias'])
 
     def move_to_stored_x_position(self,address):
-        self._move_to_stored_position('x',address)
+        self.move_to_stored_position(address,'x')
 
     def move_to_stored_y_position(self,address):
-        self._move_to_stored_position('y',address)
+        self.move_to_stored_position(address,'y')
 
     def move_to_stored_z_position(self,address):
-        self._move_to_stored_position('z',address)
+        self.move_to_stored_position(address,'z')
+
+    def compile_move_sequence(self,targets,axes=('x','y','z'),addresses=None):
+        '''
+        Compiles a list of targets in stage units, one position per axis in
+        axes, into a ZaberMoveSequence that reuses stored-position slots
+        for targets visited more than once. addresses limits which slots
+        may be overwritten.
+        '''
+        from .move_sequence import ZaberMoveSequence
+        return ZaberMoveSequence(self,targets,axes,addresses)
+
+    def plan_path(self,targets,axes=('x','y'),mode='nearest',start='current',**kwargs):
+        '''
+        Orders targets in stage units, one position per axis in axes, to
+        minimise total move time. mode is 'nearest' (nearest neighbour
+        plus 2-opt) or 'serpentine'. Returns the ordered targets and the
+        estimated move time in seconds.
+        '''
+        from .path_planner import ZaberPathPlanner
+        planner = ZaberPathPlanner(self,axes)
+        return planner.plan(targets,mode=mode,start=start,**kwargs)
+
+    def start_servo(self,axes=('x',),rate=50.0,**kwargs):
+        '''
+        Starts a ZaberServo holding axes on targets set with its
+        set_target method, correcting at rate ticks per second, and
+        returns it. kwargs are passed to ZaberServo.
+        '''
+        from .servo import ZaberServo
+        servo = ZaberServo(self,axes,rate,**kwargs)
+        servo.start()
+        return servo
+
+    def get_axis_actuator_ids(self,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and actuator ids as
+        values, reading each device once.
+        '''
+        return self._query_axes('get_actuator_id',axes)
 
     def get_actuator_ids(self):
-        actuator_ids = {}
-        for serial_number in self._devs:
-            dev = self._devs[serial_number]
-            actuator_id = dev.get_actuator_id()
-            actuator_ids[serial_number] = actuator_id
-        if self._x_axis is not None:
-            x_actuator_id = actuator_ids[serial_number][self._x_axis['actuator']]
-        else:
-            x_actuator_id = None
-        if self._y_axis is not None:
-            y_actuator_id = actuator_ids[serial_number][self._y_axis['actuator']]
-        else:
-            y_actuator_id = None
-        if self._z_axis is not None:
-            z_actuator_id = actuator_ids[serial_number][self._z_axis['actuator']]
-        else:
-            z_actuator_id = None
-        return x_actuator_id,y_actuator_id,z_actuator_id
+        actuator_ids = self.get_axis_actuator_ids(self._LEGACY_AXES)
+        return tuple(actuator_ids.get(axis) for axis in self._LEGACY_AXES)
 
-    def _set_microstep_size(self,axis,microstep_size):
+    def set_microstep_size(self,axis,microstep_size):
         try:
-            microstep_size = float(microstep_size)
-            if axis == 'x':
-                self._x_microstep_size = microstep_size
-            elif axis == 'y':
-                self._y_microstep_size = microstep_size
-            elif axis == 'z':
-                self._z_microstep_size = microstep_size
+            self._get_axis(axis)['microstep_size'] = float(microstep_size)
         except:
             pass
 
+    def get_microstep_size(self,axis):
+        return self._get_axis(axis)['microstep_size']
+
     def set_x_microstep_size(self,microstep_size):
-        self._set_microstep_size('x',microstep_size)
+        self.set_microstep_size('x',microstep_size)
 
     def set_y_microstep_size(self,microstep_size):
-        self._set_microstep_size('y',microstep_size)
+        self.set_microstep_size('y',microstep_size)
 
     def set_z_microstep_size(self,microstep_size):
-        self._set_microstep_size('z',microstep_size)
+        self.set_microstep_size('z',microstep_size)
 
     def get_x_microstep_size(self):
-        return self._x_microstep_size
+        return self.get_microstep_size('x')
 
     def get_y_microstep_size(self):
-        return self._y_microstep_size
+        return self.get_microstep_size('y')
 
     def get_z_microstep_size(self):
-        return self._z_microstep_size
+        return self.get_microstep_size('z')
+
+    def set_calibration(self,axis,calibration):
+        '''
+        Sets the calibration table of axis, a ZaberCalibration, the path
+        of a calibration file or a (microsteps,positions) pair, used in
+        place of the microstep size to convert positions. None clears it.
+        '''
+        if calibration is not None:
+            from .calibration import ZaberCalibration, load_calibration
+            if isinstance(calibration,str):
+                calibration = load_calibration(calibration)
+            elif not isinstance(calibration,ZaberCalibration):
+                microsteps,positions = calibration
+                calibration = ZaberCalibration(microsteps,positions)
+        self._get_axis(axis)['calibration'] = calibration
+
+    def get_calibration(self,axis):
+        return self._get_axis(axis)['calibration']
+
+    def set_x_calibration(self,calibration):
+        self.set_calibration('x',calibration)
+
+    def set_y_calibration(self,calibration):
+        self.set_calibration('y',calibration)
+
+    def set_z_calibration(self,calibration):
+        self.set_calibration('z',calibration)
+
+    def get_x_calibration(self):
+        return self.get_calibration('x')
+
+    def get_y_calibration(self):
+        return self.get_calibration('y')
+
+    def get_z_calibration(self):
+        return self.get_calibration('z')
+
+    def positions_to_microsteps(self,axis,positions):
+        '''
+        Converts positions in stage units, a number or a sequence such as
+        a whole scan path, to microsteps of axis, through its calibration
+        table when one is set. Sequences return NumPy arrays when NumPy
+        is available.
+        '''
+        return self._to_microsteps(self._get_axis(axis),positions)
+
+    def microsteps_to_positions(self,axis,microsteps):
+        '''
+        Converts microsteps of axis, a number or a sequence, to positions
+        in stage units, the inverse of positions_to_microsteps.
+        '''
+        return self._to_positions(self._get_axis(axis),microsteps)
 
-    def _set_travel(self,axis,travel):
+    def set_travel(self,axis,travel):
         try:
-            travel = float(travel)
-            if axis == 'x':
-                self._x_travel = travel
-            elif axis == 'y':
-                self._y_travel = travel
-            elif axis == 'z':
-                self._z_travel = travel
+            self._get_axis(axis)['travel'] = float(travel)
         except:
             pass
 
+    def get_travel(self,axis):
+        return self._get_axis(axis)['travel']
+
     def set_x_travel(self,travel):
-        self._set_travel('x',travel)
+        self.set_travel('x',travel)
 
     def set_y_travel(self,travel):
-        self._set_travel('y',travel)
+        self.set_travel('y',travel)
 
     def set_z_travel(self,travel):
-        self._set_travel('z',travel)
+        self.set_travel('z',travel)
 
     def get_x_travel(self):
-        return self._x_travel
+        return self.get_travel('x')
 
     def get_y_travel(self):
-        return self._y_travel
+        return self.get_travel('y')
 
     def get_z_travel(self):
-        return self._z_travel
-
-    def _move_absolute_percent(self,axis,percent):
-        percent = float(percent)
-        if axis == 'x':
-            if self._x_travel is not None:
-                position = self._x_travel*(percent/100)
-                self.move_x_absolute(position)
-        elif axis == 'y':
-            if self._y_travel is not None:
-                position = self._y_travel*(percent/100)
-                self.move_y_absolute(position)
-        elif axis == 'z':
-            if self._z_travel is not None:
-                position = self._z_travel*(percent/100)
-                self.move_z_absolute(position)
+        return self.get_travel('z')
+
+    def _percents_to_positions(self,percents):
+        positions = {}
+        for axis in percents:
+            travel = self._axes.get(axis,{}).get('travel')
+            if travel is not None:
+                positions[axis] = travel*(float(percents[axis])/100)
+        return positions
+
+    def move_absolute_percent(self,percents):
+        '''
+        Moves each axis in percents, a dictionary with axis names as keys,
+        to the percentage of its travel. Axes without travel are skipped.
+        '''
+        self.move_absolute(self._percents_to_positions(percents))
 
     def move_x_absolute_percent(self,percent):
-        self._move_absolute_percent('x',percent)
+        self.move_absolute_percent({'x': percent})
 
     def move_y_absolute_percent(self,percent):
-        self._move_absolute_percent('y',percent)
+        self.move_absolute_percent({'y': percent})
 
     def move_z_absolute_percent(self,percent):
-        self._move_absolute_percent('z',percent)
-
-    def _move_relative_percent(self,axis,percent):
-        percent = float(percent)
-        if axis == 'x':
-            if self._x_travel is not None:
-                position = self._x_travel*(percent/100)
-                self.move_x_relative(position)
-        elif axis == 'y':
-            if self._y_travel is not None:
-                position = self._y_travel*(percent/100)
-                self.move_y_relative(position)
-        elif axis == 'z':
-            if self._z_travel is not None:
-                position = self._z_travel*(percent/100)
-                self.move_z_relative(position)
+        self.move_absolute_percent({'z': percent})
+
+    def move_relative_percent(self,percents):
+        '''
+        Moves each axis in percents, a dictionary with axis names as keys,
+        by the percentage of its travel. Axes without travel are skipped.
+        '''
+        self.move_relative(self._percents_to_positions(percents))
 
     def move_x_relative_percent(self,percent):
-        self._move_relative_percent('x',percent)
+        self.move_relative_percent({'x': percent})
 
     def move_y_relative_percent(self,percent):
-        self._move_relative_percent('y',percent)
+        self.move_relative_percent({'y': percent})
 
     def move_z_relative_percent(self,percent):
-        self._move_relative_percent('z',percent)
+        self.move_relative_percent({'z': percent})
+
+    def get_axis_positions_percent(self,axes=None):
+        '''
+        Returns a dictionary with axis names as keys and positions as
+        percentages of travel as values, for set axes with travel.
+        '''
+        positions = self.get_axis_positions(axes)
+        percents = {}
+        for axis in positions:
+            travel = self._axes[axis]['travel']
+            if travel is not None:
+                percents[axis] = (100*positions[axis])/travel
+        return percents
 
     def get_positions_percent(self):
         positions = self.get_positions()
-        if self._x_travel is not None:
-            x_percent = (100*positions[0])/self._x_travel
-        else:
-            x_percent = 0
-        if self._y_travel is not None:
-            y_percent = (100*positions[1])/self._y_travel
-        else:
-            y_percent = 0
-        if self._z_travel is not None:
-            z_percent = (100*positions[2])/self._z_travel
-        else:
-            z_percent = 0
-        return x_percent,y_percent,z_percent
-
+        percents = []
+        for index,axis in enumerate(self._LEGACY_AXES):
+            travel = self._axes.get(axis,{}).get('travel')
+            if travel is not None:
+                percents.append((100*positions[index])/travel)
+            else:
+                percents.append(0)
+        return tuple(percents)
 
 def find_zaber_device_ports(baudrate=None,
                             try_ports=None,
                             serial_number=None,
                             debug=DEBUG,
+                            baudrates=None,
+                            reset_delay=None,
                             *args,
                             **kwargs):
+    _import_serial_stack()
+    if baudrates is None:
+        baudrates = [baudrate]
     serial_interface_ports = find_serial_interface_ports(try_ports=try_ports, debug=debug)
     os_type = platform.system()
     if os_type == 'Darwin':
         serial_interface_ports = [x for x in serial_interface_ports if 'tty.usbmodem' in x or 'tty.usbserial' in x]
 
+    if reset_delay is None:
+        reset_delay = ZaberDevice._RESET_DELAY
+
     zaber_device_ports = {}
     for port in serial_interface_ports:
-        try:
-            dev = ZaberDevice(port=port,baudrate=baudrate,debug=debug)
+        numbering_error_baudrate = None
+        for port_baudrate in baudrates:
             try:
-                test_data = 123
-                echo_data = dev.echo_data(test_data)
-                if test_data == echo_data:
-                    s_n = dev.get_serial_number()
-                    if (serial_number is None) or (s_n == serial_number):
-                        zaber_device_ports[port] = {'serial_number':s_n}
-            except ZaberError as e:
-                zaber_device_ports[port] = {'serial_number':None}
-            except ReadError:
-                continue
-            dev.close()
-        except (serial.SerialException, IOError):
-            pass
+                dev = ZaberDevice(port=port,baudrate=port_baudrate,debug=debug,reset_delay=reset_delay)
+                try:
+                    test_data = 123
+                    echo_data = dev.echo_data(test_data)
+                    if test_data == echo_data:
+                        s_n = dev.get_serial_number()
+                        if (serial_number is None) or (s_n == serial_number):
+                            zaber_device_ports[port] = {'serial_number':s_n,
+                                                        'baudrate':dev.get_baudrate()}
+                except ZaberError as e:
+                    if numbering_error_baudrate is None:
+                        numbering_error_baudrate = dev.get_baudrate()
+                except ReadError:
+                    pass
+                dev.close()
+            except (serial.SerialException, IOError):
+                break
+            if port in zaber_device_ports:
+                break
+        if (port not in zaber_device_ports) and (numbering_error_baudrate is not None):
+            zaber_device_ports[port] = {'serial_number':None,
+                                        'baudrate':numbering_error_baudrate}
     return zaber_device_ports
 
 def find_zaber_device_port(baudrate=None,
                            try_ports=None,
                            serial_number=None,
                            debug=DEBUG):
-    zaber_device_ports = find_zaber_device_ports(baudrate=baudrate,
+    port, baudrate = find_zaber_device_port_baudrate(baudrates=[baudrate],
+                                                     try_ports=try_ports,
+                                                     serial_number=serial_number,
+                                                     debug=debug)
+    return port
+
+def find_zaber_device_port_baudrate(baudrates=None,
+                                    try_ports=None,
+                                    serial_number=None,
+                                    debug=DEBUG):
+    zaber_device_ports = find_zaber_device_ports(baudrates=baudrates,
                                                  try_ports=try_ports,
                                                  serial_number=serial_number,
                                                  debug=debug)
     if len(zaber_device_ports) == 1:
-        return list(zaber_device_ports.keys())[0]
+        port = list(zaber_device_ports.keys())[0]
+        return port, zaber_device_ports[port]['baudrate']
     elif len(zaber_device_ports) == 0:
         serial_interface_ports = find_serial_interface_ports(try_ports)
         err_string = 'Could not find any Zaber devices. Check connections and permissions.\n'